@@ -8,7 +8,12 @@ admin.site.register(models.ProjectAttributeKey)
 admin.site.register(models.ProjectAttribute)
 admin.site.register(models.ConsumptionMetadata)
 admin.site.register(models.ConsumptionRecord)
+admin.site.register(models.ConsumptionSeries)
+admin.site.register(models.IngestionJob)
 admin.site.register(models.MeterRun)
+admin.site.register(models.MeterConfiguration)
+admin.site.register(models.MeterBatch)
+admin.site.register(models.MeterBatchItem)
 admin.site.register(models.DailyUsageBaseline)
 admin.site.register(models.DailyUsageReporting)
 admin.site.register(models.MonthlyAverageUsageBaseline)
@@ -0,0 +1,221 @@
+"""Synthetic benchmarks of the meter pipeline.
+
+Projects get generated, temperature-sensitive consumption and run against
+seeded in-memory temperatures, so throughput can be measured without
+production data or network access. Results are plain dicts, ready to be
+dumped as JSON and compared between releases.
+"""
+from __future__ import absolute_import, division
+
+import json
+import platform
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.utils.timezone import now
+
+from oauth2_provider.models import AccessToken, get_application_model
+
+from . import ingest
+from .models import ConsumptionMetadata, Project, ProjectBlock
+from .weather import SyntheticWeatherNormalSource, SyntheticWeatherSource, synthetic_fetch
+
+FREQUENCIES = {
+    "daily": 24,
+    "hourly": 1,
+}
+
+# any station will do; its temperatures are generated
+STATION = '725300'
+
+START = datetime(2010, 1, 1, tzinfo=pytz.UTC)
+
+API_READS = [
+    ("projects", "/api/v1/projects/"),
+    ("project_meter_runs", "/api/v1/projects/?with_meter_runs=True"),
+    ("meter_runs_summary", "/api/v1/meter_runs/?summary=True&most_recent=True"),
+    ("meter_runs_daily", "/api/v1/meter_runs/?daily=True&projects={project}"),
+    ("project_block_monthly", "/api/v1/project_blocks/{block}/?monthly_timeseries=True"),
+    ("consumption_records", "/api/v1/consumption_records/?metadata={metadata}"),
+]
+
+
+def _stats(seconds):
+    return {
+        "n": len(seconds),
+        "total": float(np.sum(seconds)),
+        "min": float(np.min(seconds)),
+        "median": float(np.median(seconds)),
+        "max": float(np.max(seconds)),
+    }
+
+
+def _timed(call):
+    started = time.time()
+    result = call()
+    return result, time.time() - started
+
+
+def synthetic_usage(temps, rng, reporting_start, hours):
+    """ Usage (kWh) per `hours`-hour interval for the days of daily `temps`
+    (degC): a baseload plus heating and cooling slopes, with savings from
+    day `reporting_start` on.
+    """
+    temps = np.asarray(temps, dtype=float)
+    n = len(temps)
+    daily = rng.uniform(10, 30) \
+            + rng.uniform(0.5, 2.0) * np.maximum(18 - temps, 0) \
+            + rng.uniform(0.5, 3.0) * np.maximum(temps - 22, 0) \
+            + rng.normal(0, 1, n)
+    daily[reporting_start:] *= 1 - rng.uniform(0.05, 0.2)
+    daily = np.maximum(daily, 0)
+    if hours == 24:
+        return daily
+    hour = np.arange(24)
+    profile = 1 + 0.5 * np.sin(2 * np.pi * (hour - 9) / 24)
+    profile /= profile.sum()
+    return np.outer(daily, profile).ravel()
+
+
+def create_projects(owner, n_projects, years=2, frequency="daily", seed=0, tag=None):
+    """ Create `n_projects` projects with `years` of daily or hourly
+    electricity records each, a baseline over the first half and a
+    reporting period after a month-long installation. Returns the projects
+    and the number of records written.
+    """
+    hours = FREQUENCIES[frequency]
+    tag = tag or uuid.uuid4().hex[:8]
+    rng = np.random.RandomState(seed)
+
+    end = START.replace(year=START.year + years)
+    n_days = (end - START).days
+    baseline_end = n_days // 2
+    reporting_start = baseline_end + 30
+    fetch = synthetic_fetch(seed)
+    temps = []
+    for year in range(START.year, end.year):
+        temps.extend(t for d, t in sorted(fetch(STATION, year).items()))
+    starts = int((START - datetime(1970, 1, 1, tzinfo=pytz.UTC)).total_seconds()) \
+            + 3600 * hours * np.arange(n_days * 24 // hours, dtype=np.int64)
+
+    projects = []
+    n_records = 0
+    for i in range(n_projects):
+        project = Project.objects.create(project_owner=owner,
+                project_id="BENCHMARK_{}_{}".format(tag, i),
+                baseline_period_start=START,
+                baseline_period_end=START + timedelta(days=baseline_end),
+                reporting_period_start=START + timedelta(days=reporting_start),
+                reporting_period_end=end,
+                weather_station=STATION)
+        metadata = ConsumptionMetadata.objects.create(project=project,
+                fuel_type="E", energy_unit="KWH")
+        values = synthetic_usage(temps, rng, reporting_start, hours)
+        n_records += ingest.load_arrays(metadata.pk, starts, values)["n_written"]
+        projects.append(project)
+    return projects, n_records
+
+
+def _stage_totals(meter_runs):
+    totals = {}
+    for timings_json in set(meter_run.timings_json for meter_run in meter_runs):
+        if not timings_json:
+            continue
+        for name, stage in json.loads(timings_json)["stages"].items():
+            total = totals.setdefault(name, {"seconds": 0.0, "queries": 0})
+            total["seconds"] += stage["seconds"]
+            if stage["queries"] is None or total["queries"] is None:
+                total["queries"] = None
+            else:
+                total["queries"] += stage["queries"]
+    return totals
+
+
+def _api_client():
+    user = User.objects.create_user("benchmark-" + uuid.uuid4().hex[:8])
+    Application = get_application_model()
+    application = Application.objects.create(name="benchmark", user=user,
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS)
+    token = AccessToken.objects.create(user=user, token=uuid.uuid4().hex,
+            application=application, expires=now() + timedelta(days=1),
+            scope="read write")
+    return Client(HTTP_AUTHORIZATION="Bearer " + token.token)
+
+
+def run_benchmark(n_projects=10, years=2, frequency="daily", repeat=3, seed=0):
+    """ Generate a synthetic portfolio and time run_meter for each project,
+    compute_summary_timeseries for a block of all of them and the main API
+    reads. Writes to the database; callers wrap it in a transaction they
+    roll back.
+    """
+    results = {
+        "parameters": {
+            "n_projects": n_projects,
+            "years": years,
+            "frequency": frequency,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "started": now().isoformat(),
+        },
+    }
+
+    owner = User.objects.create_user("benchmark-owner-" + uuid.uuid4().hex[:8]).projectowner
+    (projects, n_records), seconds = _timed(lambda: create_projects(owner,
+            n_projects, years, frequency, seed))
+    results["generate"] = {"n_records": n_records, "seconds": seconds}
+
+    # one weather source and set of normals for every project, as when
+    # grouped by station; neither touches the network
+    weather_source = SyntheticWeatherSource(STATION, seed)
+    weather_normal_source = SyntheticWeatherNormalSource(STATION, seed)
+    end_date = max(project.reporting_period_end for project in projects)
+    seconds, meter_runs = [], []
+    for _ in range(repeat):
+        for project in projects:
+            runs, elapsed = _timed(lambda: project.run_meter(end_date=end_date,
+                    weather_source=weather_source,
+                    weather_normal_source=weather_normal_source))
+            seconds.append(elapsed)
+            meter_runs.extend(runs or [])
+    results["run_meter"] = dict(_stats(seconds),
+            projects_per_minute=len(seconds) / sum(seconds) * 60,
+            n_meter_runs=len(meter_runs), stages=_stage_totals(meter_runs))
+
+    block = ProjectBlock.objects.create(name="BENCHMARK")
+    block.projects.add(*projects)
+    seconds = []
+    for _ in range(repeat):
+        timings, elapsed = _timed(block.compute_summary_timeseries)
+        seconds.append(elapsed)
+    results["compute_summary_timeseries"] = dict(_stats(seconds),
+            stages=timings["stages"], counts=timings["counts"])
+
+    client = _api_client()
+    context = {
+        "project": projects[0].pk,
+        "block": block.pk,
+        "metadata": projects[0].consumptionmetadata_set.get().pk,
+    }
+    results["api"] = {}
+    for name, url in API_READS:
+        url = url.format(**context)
+        seconds = []
+        for _ in range(repeat):
+            response, elapsed = _timed(lambda: client.get(url))
+            seconds.append(elapsed)
+        results["api"][name] = dict(_stats(seconds), url=url,
+                status_code=response.status_code, bytes=len(response.content))
+
+    return results
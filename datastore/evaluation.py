@@ -0,0 +1,103 @@
+"""Compute-only meter runs: the `run_meter` pipeline over what-if periods,
+returned as plain dicts and cached briefly instead of saved.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from eemeter.evaluation import Period
+
+from .models import _json_clean
+
+# the project periods that can be overridden
+PERIOD_FIELDS = (
+    'baseline_period_start',
+    'baseline_period_end',
+    'reporting_period_start',
+    'reporting_period_end',
+)
+
+CACHE_KEY_PREFIX = 'datastore:evaluation:'
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def output_dict(output):
+    """ A JSON-ready dict of an unsaved MeterRunOutput. """
+    meter_run = output.meter_run
+    return {
+        "consumption_metadata": meter_run.consumption_metadata_id,
+        "meter_type": meter_run.meter_type,
+        "annual_usage_baseline": meter_run.annual_usage_baseline_clean(),
+        "annual_usage_reporting": meter_run.annual_usage_reporting_clean(),
+        "gross_savings": meter_run.gross_savings_clean(),
+        "annual_savings": meter_run.annual_savings_clean(),
+        "cvrmse_baseline": meter_run.cvrmse_baseline_clean(),
+        "cvrmse_reporting": meter_run.cvrmse_reporting_clean(),
+        "model_parameter_json_baseline": meter_run.model_parameter_json_baseline,
+        "model_parameter_json_reporting": meter_run.model_parameter_json_reporting,
+        "timings_json": meter_run.timings_json,
+        "daily": [
+            {"date": _isoformat(date), "baseline": _json_clean(baseline),
+                "reporting": _json_clean(reporting)}
+            for date, baseline, reporting in zip(output.daily_dates,
+                    output.daily_baseline, output.daily_reporting)
+        ],
+        "monthly": [
+            {"date": _isoformat(date), "baseline": _json_clean(baseline),
+                "reporting": _json_clean(reporting)}
+            for date, baseline, reporting in zip(output.monthly_dates,
+                    output.monthly_baseline, output.monthly_reporting)
+        ],
+    }
+
+
+def cache_key(project, parameters):
+    """ Key for an evaluation of `project` with `parameters`. The project's
+    input fingerprint is part of it, so new data is never answered from
+    the cache.
+    """
+    inputs = [project.pk, project.input_fingerprint(), sorted(parameters.items())]
+    return CACHE_KEY_PREFIX + hashlib.sha1(
+            json.dumps(inputs, default=str).encode('utf-8')).hexdigest()
+
+
+def evaluate_project(project, meter_type='residential', start_date=None, end_date=None,
+        **periods):
+    """ Evaluate the meter for `project` without saving a MeterRun, with
+    any of PERIOD_FIELDS given as keyword arguments in place of the
+    project's own. Returns a dict of the effective parameters and a list of
+    results per consumption metadata (None if the project cannot be run),
+    served from the cache for METER_EVALUATION_CACHE_SECONDS.
+    """
+    for field in PERIOD_FIELDS:
+        if periods.get(field) is None:
+            periods[field] = getattr(project, field)
+    parameters = dict(periods, meter_type=meter_type, start_date=start_date,
+            end_date=end_date)
+
+    key = cache_key(project, parameters)
+    evaluation = cache.get(key)
+    if evaluation is not None:
+        return dict(evaluation, cached=True)
+
+    outputs = project.evaluate_meter(meter_type, start_date, end_date,
+            baseline_period=Period(periods['baseline_period_start'],
+                    periods['baseline_period_end']),
+            reporting_period=Period(periods['reporting_period_start'],
+                    periods['reporting_period_end']))
+    evaluation = {
+        "project": project.pk,
+        "parameters": dict((name, _isoformat(value) if name != 'meter_type' else value)
+                for name, value in parameters.items()),
+        "results": [output_dict(output) for output in outputs]
+                if outputs is not None else None,
+    }
+    cache.set(key, evaluation, settings.METER_EVALUATION_CACHE_SECONDS)
+    return dict(evaluation, cached=False)
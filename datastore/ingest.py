@@ -0,0 +1,504 @@
+"""Set-based loading of consumption records.
+
+Records are written in fixed-size batches with PostgreSQL ``COPY`` (or a
+multi-row ``bulk_create`` on other backends) instead of one INSERT per
+reading.
+"""
+from __future__ import absolute_import
+
+import logging
+import math
+import struct
+import time
+from collections import defaultdict
+from itertools import islice
+
+import numpy as np
+
+from django.db import connection, transaction
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+MAX_REJECTED_ROWS = 1000
+
+TRUE_STRINGS = ('t', 'true', 'y', 'yes', '1')
+FALSE_STRINGS = ('f', 'false', 'n', 'no', '0', '')
+
+COPY_COLUMNS = ('metadata_id', 'start', 'value', 'estimated')
+
+ON_CONFLICT_CHOICES = ('ignore', 'update')
+
+STAGING_TABLE = 'datastore_consumptionrecord_staging'
+
+# seconds between the unix epoch and the PostgreSQL epoch (2000-01-01)
+PG_EPOCH_OFFSET = 946684800
+
+
+def batches(iterable, batch_size):
+    """ Yield lists of at most `batch_size` items from `iterable`.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _metadata_id(record):
+    if 'metadata_id' in record:
+        return record['metadata_id']
+    metadata = record['metadata']
+    return getattr(metadata, 'pk', metadata)
+
+
+def _aware(start):
+    if timezone.is_naive(start):
+        return timezone.make_aware(start, timezone.get_default_timezone())
+    return start
+
+
+def _copy_float(value):
+    if value is None:
+        return r'\N'
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return repr(value)
+
+
+def _copy_batch(cursor, batch, table, with_ordinal=False):
+    buf = six.StringIO()
+    for ordinal, record in enumerate(batch):
+        row = u'{}\t{}\t{}\t{}\n'.format(
+            _metadata_id(record),
+            _aware(record['start']).isoformat(),
+            _copy_float(record.get('value')),
+            't' if record.get('estimated') else 'f')
+        if with_ordinal:
+            row = u'{}\t{}'.format(ordinal, row)
+        buf.write(row)
+    buf.seek(0)
+    columns = (('ordinal',) if with_ordinal else ()) + COPY_COLUMNS
+    cursor.copy_from(buf, table, columns=columns)
+
+
+def _create_staging_table(cursor):
+    cursor.execute('''
+      CREATE TEMPORARY TABLE IF NOT EXISTS {} (
+        ordinal integer,
+        metadata_id integer,
+        start timestamp with time zone,
+        value double precision,
+        estimated boolean
+      )
+    '''.format(STAGING_TABLE))
+
+
+def _merge_staging_table(cursor, on_conflict):
+    """ INSERT ... ON CONFLICT the staged rows into the records table.
+    Duplicates within the stage are collapsed first (the last one wins for
+    'update', the first one for 'ignore').
+    """
+    if on_conflict == 'update':
+        order = 'DESC'
+        action = '''DO UPDATE SET
+            value = EXCLUDED.value,
+            estimated = EXCLUDED.estimated'''
+    else:
+        order = 'ASC'
+        action = 'DO NOTHING'
+
+    cursor.execute('''
+      INSERT INTO {table} (metadata_id, start, value, estimated)
+      SELECT DISTINCT ON (metadata_id, start)
+        metadata_id, start, value, estimated
+      FROM {staging}
+      ORDER BY metadata_id, start, ordinal {order}
+      ON CONFLICT (metadata_id, start) {action}
+    '''.format(table=models.ConsumptionRecord._meta.db_table,
+               staging=STAGING_TABLE, order=order, action=action))
+    n_written = cursor.rowcount
+    cursor.execute('TRUNCATE {}'.format(STAGING_TABLE))
+    return n_written
+
+
+def _upsert_batch(cursor, batch, on_conflict):
+    _create_staging_table(cursor)
+    _copy_batch(cursor, batch, STAGING_TABLE, with_ordinal=True)
+    return _merge_staging_table(cursor, on_conflict)
+
+
+def _copy_arrays(cursor, table, metadata_id, start, value, estimated,
+                 with_ordinal=False):
+    """ COPY arrays in PostgreSQL's binary format. Each tuple is laid out
+    as a packed big-endian numpy record, so no per-row Python runs. Rows
+    with a NaN value are written as NULL.
+    """
+    columns = (('ordinal',) if with_ordinal else ()) + COPY_COLUMNS
+    ordinal = np.arange(len(start))
+    # timestamptz is microseconds since 2000-01-01 UTC
+    start = (start - PG_EPOCH_OFFSET) * 1000000
+    missing = np.isnan(value)
+
+    buf = six.BytesIO()
+    buf.write(b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0))
+    for mask, has_value in ((~missing, True), (missing, False)):
+        fields = [('n_fields', '>i2')]
+        if with_ordinal:
+            fields += [('ordinal_size', '>i4'), ('ordinal', '>i4')]
+        fields += [('metadata_id_size', '>i4'), ('metadata_id', '>i4'),
+                   ('start_size', '>i4'), ('start', '>i8'),
+                   ('value_size', '>i4')]
+        if has_value:
+            fields.append(('value', '>f8'))
+        fields += [('estimated_size', '>i4'), ('estimated', 'u1')]
+
+        tuples = np.empty(int(mask.sum()), dtype=fields)
+        tuples['n_fields'] = len(columns)
+        if with_ordinal:
+            tuples['ordinal_size'] = 4
+            tuples['ordinal'] = ordinal[mask]
+        tuples['metadata_id_size'] = 4
+        tuples['metadata_id'] = metadata_id[mask]
+        tuples['start_size'] = 8
+        tuples['start'] = start[mask]
+        if has_value:
+            tuples['value_size'] = 8
+            tuples['value'] = value[mask]
+        else:
+            tuples['value_size'] = -1
+        tuples['estimated_size'] = 1
+        tuples['estimated'] = estimated[mask]
+        buf.write(tuples.tobytes())
+    buf.write(struct.pack('!h', -1))
+    buf.seek(0)
+
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT binary)'.format(
+            table, ', '.join(columns)), buf)
+
+
+def _bulk_create_batch(batch, on_conflict=None):
+    if on_conflict is None:
+        records = batch
+    else:
+        by_key = {}
+        for record in batch:
+            key = (_metadata_id(record), _aware(record['start']))
+            if on_conflict == 'update' or key not in by_key:
+                by_key[key] = record
+
+        existing = models.ConsumptionRecord.objects.filter(
+                metadata_id__in=set(k[0] for k in by_key),
+                start__in=set(k[1] for k in by_key))
+        existing = dict(((r.metadata_id, r.start), r.pk) for r in existing)
+        existing = dict((k, pk) for k, pk in existing.items() if k in by_key)
+
+        if on_conflict == 'update':
+            models.ConsumptionRecord.objects.filter(pk__in=existing.values()).delete()
+        else:
+            by_key = dict((k, r) for k, r in by_key.items() if k not in existing)
+        records = list(by_key.values())
+
+    models.ConsumptionRecord.objects.bulk_create([
+        models.ConsumptionRecord(
+            metadata_id=_metadata_id(record),
+            start=record['start'],
+            value=record.get('value'),
+            estimated=bool(record.get('estimated')))
+        for record in records
+    ])
+    return len(records)
+
+
+def _merge_into_series(series, batch, overwrite=True):
+    start = np.array([models._to_epoch(_aware(r['start'])) for r in batch], dtype=np.int64)
+    value = np.array([np.nan if r.get('value') is None else r['value'] for r in batch], dtype=np.float64)
+    estimated = np.array([bool(r.get('estimated')) for r in batch], dtype=bool)
+    n_written = series.merge(start, value, estimated, overwrite=overwrite)
+    series.save()
+    return n_written
+
+
+def _check_on_conflict(on_conflict):
+    if on_conflict not in (None,) + ON_CONFLICT_CHOICES:
+        raise ValueError("on_conflict must be one of {}".format(ON_CONFLICT_CHOICES))
+
+
+def _packed_series(metadata_ids):
+    return dict((series.metadata_id, series) for series in
+            models.ConsumptionSeries.objects.select_for_update()
+            .filter(metadata_id__in=metadata_ids))
+
+
+def _touch_metadata(metadata_ids):
+    # bulk writes bypass the records' metadata; bump its `updated` so the
+    # change shows up in Project.input_fingerprints
+    models.ConsumptionMetadata.objects.filter(pk__in=metadata_ids) \
+            .update(updated=timezone.now())
+
+
+def load_batch(batch, on_conflict=None):
+    """ Write a single batch of records in one set-based statement and
+    return a dict with its row count, rows written and timing.
+
+    With `on_conflict` set to 'ignore' or 'update', records whose
+    (metadata, start) already exists are skipped or overwritten instead of
+    failing the batch. Records for metadata stored as a packed
+    `ConsumptionSeries` are merged into the series instead of being
+    written as rows.
+    """
+    _check_on_conflict(on_conflict)
+
+    t0 = time.time()
+    n_written = 0
+    with transaction.atomic():
+        packed = _packed_series(set(_metadata_id(record) for record in batch))
+
+        rows = batch
+        if packed:
+            rows = []
+            packed_records = defaultdict(list)
+            for record in batch:
+                metadata_id = _metadata_id(record)
+                if metadata_id in packed:
+                    packed_records[metadata_id].append(record)
+                else:
+                    rows.append(record)
+            for metadata_id, records in packed_records.items():
+                n_written += _merge_into_series(packed[metadata_id], records,
+                        overwrite=on_conflict != 'ignore')
+
+        if rows and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                if on_conflict is None:
+                    _copy_batch(cursor, rows, models.ConsumptionRecord._meta.db_table)
+                    n_written += len(rows)
+                else:
+                    n_written += _upsert_batch(cursor, rows, on_conflict)
+        elif rows:
+            n_written += _bulk_create_batch(rows, on_conflict)
+
+        if n_written:
+            _touch_metadata(set(_metadata_id(record) for record in batch))
+    elapsed = time.time() - t0
+    logger.info("Loaded %d consumption records (%d written) in %.3fs",
+            len(batch), n_written, elapsed)
+    return {"n_records": len(batch), "n_written": n_written, "seconds": elapsed}
+
+
+def load_records(records, batch_size=DEFAULT_BATCH_SIZE, on_conflict=None,
+                 progress=None):
+    """ Load an iterable of record dicts (`metadata` or `metadata_id`,
+    `start`, `value`, `estimated`) in batches of `batch_size`.
+
+    Returns a report with total row count and timing plus one entry per
+    batch. Each batch is committed on its own; wrap the call in
+    ``transaction.atomic()`` for all-or-nothing loads. See `load_batch`
+    for `on_conflict`. `progress` is called with the running report after
+    each batch.
+    """
+    t0 = time.time()
+    report = {"n_records": 0, "n_written": 0, "seconds": 0.0, "batches": []}
+    for batch in batches(records, batch_size):
+        batch_report = load_batch(batch, on_conflict=on_conflict)
+        report["n_records"] += batch_report["n_records"]
+        report["n_written"] += batch_report["n_written"]
+        report["batches"].append(batch_report)
+        if progress is not None:
+            progress(report)
+    report["seconds"] = time.time() - t0
+    return report
+
+
+def load_arrays_batch(metadata_id, start, value, estimated, on_conflict=None):
+    """ Array counterpart of `load_batch`: one batch of equal-length
+    metadata id, epoch second start, float64 value (NaN if missing) and
+    boolean estimated arrays, written with a binary COPY.
+    """
+    _check_on_conflict(on_conflict)
+
+    t0 = time.time()
+    n_written = 0
+    with transaction.atomic():
+        packed = _packed_series(set(np.unique(metadata_id).tolist()))
+
+        rows = np.ones(len(start), dtype=bool)
+        for packed_id, series in packed.items():
+            mask = metadata_id == packed_id
+            n_written += series.merge(start[mask], value[mask], estimated[mask],
+                    overwrite=on_conflict != 'ignore')
+            series.save()
+            rows &= ~mask
+
+        arrays = [a[rows] for a in (metadata_id, start, value, estimated)]
+        if rows.any() and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                if on_conflict is None:
+                    _copy_arrays(cursor, models.ConsumptionRecord._meta.db_table, *arrays)
+                    n_written += len(arrays[0])
+                else:
+                    _create_staging_table(cursor)
+                    _copy_arrays(cursor, STAGING_TABLE, *arrays, with_ordinal=True)
+                    n_written += _merge_staging_table(cursor, on_conflict)
+        elif rows.any():
+            n_written += _bulk_create_batch([{
+                "metadata_id": m,
+                "start": models._from_epoch(s),
+                "value": None if np.isnan(v) else v,
+                "estimated": e,
+            } for m, s, v, e in zip(*[a.tolist() for a in arrays])], on_conflict)
+
+        if n_written:
+            _touch_metadata(np.unique(metadata_id).tolist())
+    elapsed = time.time() - t0
+    logger.info("Loaded %d consumption records (%d written) in %.3fs",
+            len(start), n_written, elapsed)
+    return {"n_records": len(start), "n_written": n_written, "seconds": elapsed}
+
+
+def load_arrays(metadata_id, start, value, estimated=None,
+                batch_size=DEFAULT_BATCH_SIZE, on_conflict=None):
+    """ Load whole series given as arrays. `metadata_id` may be a scalar
+    or an array; `start` may be epoch seconds or numpy datetime64 (UTC);
+    `estimated` defaults to all False. Every metadata id must exist.
+
+    Returns a report shaped like the one from `load_records`.
+    """
+    start = np.asarray(start)
+    if np.issubdtype(start.dtype, np.datetime64):
+        start = start.astype('datetime64[s]').astype(np.int64)
+    start = start.astype(np.int64)
+    n = len(start)
+
+    metadata_id = np.asarray(metadata_id, dtype=np.int64)
+    if metadata_id.ndim == 0:
+        metadata_id = np.repeat(metadata_id, n)
+    value = np.asarray(value, dtype=np.float64)
+    if estimated is None:
+        estimated = np.zeros(n, dtype=bool)
+    estimated = np.asarray(estimated, dtype=bool)
+
+    if not len(metadata_id) == len(value) == len(estimated) == n:
+        raise ValueError("metadata, start, value and estimated must have equal lengths")
+
+    metadata_ids = set(np.unique(metadata_id).tolist())
+    known_ids = set(models.ConsumptionMetadata.objects.filter(
+            pk__in=metadata_ids).values_list('pk', flat=True))
+    if metadata_ids - known_ids:
+        raise ValueError("unknown metadata: {}".format(
+                ", ".join(str(i) for i in sorted(metadata_ids - known_ids))))
+
+    t0 = time.time()
+    report = {"n_records": 0, "n_written": 0, "seconds": 0.0, "batches": []}
+    for i in range(0, n, batch_size):
+        batch = slice(i, i + batch_size)
+        batch_report = load_arrays_batch(metadata_id[batch], start[batch],
+                value[batch], estimated[batch], on_conflict=on_conflict)
+        report["n_records"] += batch_report["n_records"]
+        report["n_written"] += batch_report["n_written"]
+        report["batches"].append(batch_report)
+    report["seconds"] = time.time() - t0
+    return report
+
+
+def _parse_csv_row(row, metadata_id=None):
+    metadata = (row.get('metadata') or '').strip() or metadata_id
+    if metadata is None:
+        raise ValueError("missing metadata")
+    try:
+        metadata = int(metadata)
+    except ValueError:
+        raise ValueError("invalid metadata: {!r}".format(metadata))
+
+    start = parse_datetime((row.get('start') or '').strip())
+    if start is None:
+        raise ValueError("invalid start: {!r}".format(row.get('start')))
+
+    value = (row.get('value') or '').strip()
+    try:
+        value = float(value) if value else None
+    except ValueError:
+        raise ValueError("invalid value: {!r}".format(value))
+
+    estimated = (row.get('estimated') or '').strip().lower()
+    if estimated in TRUE_STRINGS:
+        estimated = True
+    elif estimated in FALSE_STRINGS:
+        estimated = False
+    else:
+        raise ValueError("invalid estimated: {!r}".format(estimated))
+
+    return {"metadata_id": metadata, "start": start, "value": value,
+            "estimated": estimated}
+
+
+def _numbered_rows(rows):
+    """ (line, row) pairs. A csv reader's `line_num` is the last line of the
+    row just read, which stays right when a quoted field spans lines;
+    other iterables are numbered from 2, after the header.
+    """
+    if hasattr(rows, 'line_num'):
+        for row in rows:
+            yield rows.line_num, row
+    else:
+        for line, row in enumerate(rows, start=2):
+            yield line, row
+
+
+def load_csv_rows(rows, metadata_id=None, chunk_size=DEFAULT_BATCH_SIZE,
+                  on_conflict=None):
+    """ Validate and load an iterable of CSV row dicts chunk by chunk, so
+    only one chunk is held in memory at a time.
+
+    Rows need `start`, `value` and `estimated` columns and either a
+    `metadata` column or a default `metadata_id`. Invalid rows are skipped
+    and reported by line number (the first MAX_REJECTED_ROWS of them).
+    See `load_batch` for `on_conflict`.
+    """
+    t0 = time.time()
+    report = {"n_records": 0, "n_written": 0, "n_rejected": 0,
+              "seconds": 0.0, "chunks": [], "rejected": []}
+
+    def reject(line, error):
+        report["n_rejected"] += 1
+        if len(report["rejected"]) < MAX_REJECTED_ROWS:
+            report["rejected"].append({"line": line, "error": error})
+
+    for chunk in batches(_numbered_rows(rows), chunk_size):
+        parsed = []
+        for line, row in chunk:
+            try:
+                parsed.append((line, _parse_csv_row(row, metadata_id)))
+            except ValueError as e:
+                reject(line, str(e))
+
+        known_ids = set(models.ConsumptionMetadata.objects.filter(
+                pk__in=set(r["metadata_id"] for _, r in parsed))
+                .values_list('pk', flat=True))
+        valid = []
+        for line, record in parsed:
+            if record["metadata_id"] in known_ids:
+                valid.append(record)
+            else:
+                reject(line, "unknown metadata: {}".format(record["metadata_id"]))
+
+        if valid:
+            chunk_report = load_batch(valid, on_conflict=on_conflict)
+        else:
+            chunk_report = {"n_records": 0, "n_written": 0, "seconds": 0.0}
+        chunk_report["n_rejected"] = len(chunk) - len(valid)
+        report["n_records"] += chunk_report["n_records"]
+        report["n_written"] += chunk_report["n_written"]
+        report["chunks"].append(chunk_report)
+
+    report["seconds"] = time.time() - t0
+    return report
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from datastore import benchmark
+
+import json
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Times the meter, block summaries and API reads on generated projects '
+            'and temperatures, printing the results as JSON. Nothing is kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=10)
+        parser.add_argument('--years', type=int, default=2,
+                help='Years of consumption per project (default: 2).')
+        parser.add_argument('--frequency', choices=sorted(benchmark.FREQUENCIES),
+                default='daily')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', metavar='PATH',
+                help='Write the JSON results to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+
+        results = None
+        try:
+            with transaction.atomic():
+                results = benchmark.run_benchmark(options["projects"], options["years"],
+                        options["frequency"], options["repeat"], options["seed"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            print(output)
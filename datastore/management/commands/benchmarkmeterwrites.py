@@ -0,0 +1,90 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from datastore.models import (ConsumptionMetadata, DailyUsageBaseline,
+        DailyUsageReporting, MeterRun, MeterRunOutput, MonthlyAverageUsageBaseline,
+        MonthlyAverageUsageReporting, Project)
+
+from datetime import date, timedelta
+import json
+import time
+
+import numpy as np
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _save_row_by_row(output):
+    """ How Project.run_meter persisted its output before bulk writes.
+    """
+    meter_run = output.meter_run
+    meter_run.save()
+    for d, baseline, reporting in zip(output.daily_dates, output.daily_baseline, output.daily_reporting):
+        DailyUsageBaseline(meter_run=meter_run, value=baseline, date=d).save()
+        DailyUsageReporting(meter_run=meter_run, value=reporting, date=d).save()
+    for d, baseline, reporting in zip(output.monthly_dates, output.monthly_baseline, output.monthly_reporting):
+        MonthlyAverageUsageBaseline(meter_run=meter_run, value=baseline, date=d).save()
+        MonthlyAverageUsageReporting(meter_run=meter_run, value=reporting, date=d).save()
+
+
+class Command(BaseCommand):
+    help = 'Times writing one project\'s meter output row by row and in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1826,
+                help='Length of the daily output series (default: five years).')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+
+        results = None
+        try:
+            with transaction.atomic():
+                results = self.benchmark(options["days"], options["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        print(json.dumps(results, indent=2))
+
+    def benchmark(self, n_days, repeat):
+        user = User.objects.create_user('meter-write-benchmark')
+        project = Project.objects.create(project_owner=user.projectowner,
+                project_id="METER_WRITE_BENCHMARK")
+        consumption_metadata = ConsumptionMetadata.objects.create(
+                project=project, fuel_type="E", energy_unit="KWH")
+
+        rng = np.random.RandomState(0)
+        daily_dates = [date(2010, 1, 1) + timedelta(days=i) for i in range(n_days)]
+        monthly_dates = sorted(set(d.replace(day=1) for d in daily_dates))
+
+        def make_output():
+            output = MeterRunOutput(MeterRun(project=project,
+                    consumption_metadata=consumption_metadata))
+            output.daily_dates = daily_dates
+            output.daily_baseline = list(rng.rand(n_days))
+            output.daily_reporting = list(rng.rand(n_days))
+            output.monthly_dates = monthly_dates
+            output.monthly_baseline = list(rng.rand(len(monthly_dates)))
+            output.monthly_reporting = list(rng.rand(len(monthly_dates)))
+            return output
+
+        timings = {"row_by_row": [], "bulk": []}
+        for _ in range(repeat):
+            for name, save in (("row_by_row", _save_row_by_row),
+                               ("bulk", lambda output: output.save())):
+                output = make_output()
+                t0 = time.time()
+                with transaction.atomic():
+                    save(output)
+                timings[name].append(time.time() - t0)
+
+        return {
+            "n_days": n_days,
+            "n_rows": 2 * (n_days + len(monthly_dates)) + 1,
+            "row_by_row_seconds": min(timings["row_by_row"]),
+            "bulk_seconds": min(timings["bulk"]),
+            "speedup": min(timings["row_by_row"]) / min(timings["bulk"]),
+        }
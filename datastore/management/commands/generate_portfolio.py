@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from datastore.models import Project
+from datastore import portfolio
+
+import time
+
+
+class Command(BaseCommand):
+    help = ('Fills the datastore with a seeded synthetic portfolio (projects, attributes, '
+            'blocks, consumption, weather, meter runs and summaries) for load testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=1000)
+        parser.add_argument('--years', type=int, default=2,
+                help='Years of consumption per project (default: 2).')
+        parser.add_argument('--frequency', choices=sorted(portfolio.FREQUENCIES),
+                default='daily')
+        parser.add_argument('--owners', type=int, default=5)
+        parser.add_argument('--blocks', type=int, default=20)
+        parser.add_argument('--stations', type=int, default=100,
+                help='Number of weather stations projects are spread over (default: 100).')
+        parser.add_argument('--meter-run-fraction', type=float, default=0.9,
+                help='Share of consumption metadata with a meter run (default: 0.9).')
+        parser.add_argument('--packed-fraction', type=float, default=0.1,
+                help='Share of consumption stored as packed series (default: 0.1).')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                help='Projects written per transaction (default: 500).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix',
+                help='Project id prefix (default: PORTFOLIO-<seed>-).')
+
+    def handle(self, *args, **options):
+
+        generator = portfolio.PortfolioGenerator(options["projects"],
+                years=options["years"], frequency=options["frequency"],
+                n_owners=options["owners"], n_blocks=options["blocks"],
+                n_stations=options["stations"],
+                meter_run_fraction=options["meter_run_fraction"],
+                packed_fraction=options["packed_fraction"],
+                chunk_size=options["chunk_size"], seed=options["seed"],
+                prefix=options["prefix"], report=self.report)
+
+        if Project.objects.filter(project_id__startswith=generator.prefix).exists():
+            raise CommandError("Projects prefixed {} already exist; pass another "
+                    "--prefix or --seed.".format(generator.prefix))
+
+        started = time.time()
+        counts = generator.generate()
+        for name, n in counts.items():
+            print("{:>12,d} {}".format(n, name))
+        print("Generated in {:.1f}s.".format(time.time() - started))
+
+    def report(self, n, n_projects, seconds):
+        print("{}/{} projects ({:.1f}s)".format(n, n_projects, seconds))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from datastore.models import MeterBatch
+from datastore import runner
+
+class Command(BaseCommand):
+    help = ('Claims and runs projects from a meter batch until none are left. '
+            'Any number of workers, on any number of hosts, may share a batch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_id', type=int)
+        parser.add_argument('--processes', type=int, default=1,
+                help='Number of worker processes on this host (default: 1).')
+        parser.add_argument('--timeout', type=int, default=None,
+                help='Give up on a project after this many seconds (default: '
+                     'an equal share of the lease, so no project outlives it).')
+        parser.add_argument('--claim-size', type=int, default=1,
+                help='Number of projects to claim at a time (default: 1).')
+        parser.add_argument('--lease', type=int, default=runner.DEFAULT_LEASE_SECONDS,
+                help='Seconds after which projects claimed by a worker that has '
+                     'not finished them may be claimed by another '
+                     '(default: %(default)s).')
+        parser.add_argument('--max-attempts', type=int, default=runner.DEFAULT_MAX_ATTEMPTS,
+                help='Mark a project failed once this many workers have '
+                     'abandoned it (default: %(default)s).')
+
+    def handle(self, *args, **options):
+
+        batch = MeterBatch.objects.get(pk=options["batch_id"])
+        kwargs = {
+            "claim_size": options["claim_size"],
+            "lease_seconds": options["lease"],
+            "max_attempts": options["max_attempts"],
+            "timeout": options["timeout"],
+        }
+        if options["processes"] > 1:
+            summary = runner.work_batch_in_processes(batch.pk, options["processes"], **kwargs)
+        else:
+            summary = runner.work_batch(batch.pk, report=runner.print_result, **kwargs)
+        print(runner.format_summary(summary))
+
+        # only the worker that finishes the batch computes the block summary
+        if summary["finished_batch"]:
+            print("Meter batch {} finished.".format(batch.pk))
+            if batch.project_block is not None:
+                print("Computing project block summary timeseries.")
+                batch.project_block.compute_summary_timeseries()
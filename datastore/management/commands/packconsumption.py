@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from datastore.models import ConsumptionMetadata
+
+class Command(BaseCommand):
+    help = 'Moves consumption records into (or out of) packed series storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('metadata_ids', nargs='*', type=int,
+                help='ConsumptionMetadata ids; defaults to all.')
+        parser.add_argument('--unpack', action='store_true',
+                help='Expand packed series back into individual records.')
+
+    def handle(self, *args, **options):
+
+        consumption_metadatas = ConsumptionMetadata.objects.all()
+        if options["metadata_ids"]:
+            consumption_metadatas = consumption_metadatas.filter(pk__in=options["metadata_ids"])
+
+        for consumption_metadata in consumption_metadatas:
+            if options["unpack"]:
+                print("Unpacking {}".format(consumption_metadata))
+                consumption_metadata.unpack()
+            else:
+                print("Packing {}".format(consumption_metadata))
+                consumption_metadata.pack()
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.dateparse import parse_date
+from django.utils.timezone import now
+
+from datastore import partitions
+
+class Command(BaseCommand):
+    help = 'Creates future consumption record partitions and detaches old ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', choices=partitions.INTERVALS,
+                default=getattr(settings, 'CONSUMPTION_RECORD_PARTITION_INTERVAL', None),
+                help='Partition size; defaults to CONSUMPTION_RECORD_PARTITION_INTERVAL, '
+                     'then to that of the existing partitions.')
+        parser.add_argument('--ahead', type=int, default=3,
+                help='Number of future intervals to create partitions for.')
+        parser.add_argument('--convert', action='store_true',
+                help='Convert the records table to a partitioned table first.')
+        parser.add_argument('--detach-before', dest='detach_before',
+                help='Detach partitions ending on or before this date (YYYY-MM-DD).')
+        parser.add_argument('--drop', action='store_true',
+                help='Drop detached partitions instead of keeping them as tables.')
+
+    def handle(self, *args, **options):
+
+        interval = options["interval"]
+        if not partitions.supported(connection):
+            raise CommandError("Partitioning requires PostgreSQL 11 or later.")
+
+        with connection.cursor() as cursor:
+            partitioned = partitions.is_partitioned(cursor)
+            existing_interval = partitions.partition_interval(cursor) if partitioned else None
+        if interval is None:
+            interval = existing_interval
+        if interval is None:
+            raise CommandError("No partition interval given or configured.")
+        if existing_interval not in (None, interval):
+            raise CommandError("Records are partitioned by {0}; pass --interval {0} "
+                    "(or unpartition and convert again to change it).".format(existing_interval))
+        if not partitioned:
+            if not options["convert"]:
+                raise CommandError("Records table is not partitioned; pass --convert.")
+            print("Partitioning consumption records by {}".format(interval))
+            partitions.partition_table(connection, interval)
+
+        start = now().date()
+        end = start
+        for _ in range(options["ahead"]):
+            end = partitions.next_bound(interval, end)
+        for name in partitions.create_partitions(connection, interval, start, end):
+            print("Created partition {}".format(name))
+
+        if options["detach_before"]:
+            before = parse_date(options["detach_before"])
+            if before is None:
+                raise CommandError("--detach-before must be a YYYY-MM-DD date.")
+            for name in partitions.detach_partitions(connection, before, drop=options["drop"]):
+                print("{} partition {}".format("Dropped" if options["drop"] else "Detached", name))
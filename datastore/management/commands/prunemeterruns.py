@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from datastore import retention
+
+class Command(BaseCommand):
+    help = 'Deletes superseded meter runs and their usage rows in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-last', type=int,
+                default=settings.METER_RUN_RETENTION_KEEP_LAST,
+                help='Runs to keep per consumption metadata; defaults to '
+                     'METER_RUN_RETENTION_KEEP_LAST.')
+        parser.add_argument('--max-age-days', type=int,
+                default=settings.METER_RUN_RETENTION_MAX_AGE_DAYS,
+                help='Also keep runs added within this many days; defaults to '
+                     'METER_RUN_RETENTION_MAX_AGE_DAYS.')
+        parser.add_argument('--batch-size', type=int, default=retention.DEFAULT_BATCH_SIZE,
+                help='Meter runs deleted per transaction.')
+        parser.add_argument('--sleep', type=float, default=0,
+                help='Seconds to pause between batches.')
+        parser.add_argument('--dry-run', action='store_true',
+                help='Count the runs that would be deleted, deleting nothing.')
+
+    def handle(self, *args, **options):
+
+        if options["keep_last"] < 1:
+            raise CommandError("--keep-last must be at least 1.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        summary = retention.prune_meter_runs(keep_last=options["keep_last"],
+                max_age_days=options["max_age_days"], batch_size=options["batch_size"],
+                sleep=options["sleep"], dry_run=options["dry_run"])
+
+        if summary["dry_run"]:
+            print("Would delete {n_meter_runs} meter runs.".format(**summary))
+        else:
+            print("Deleted {n_meter_runs} meter runs and {n_output_rows} usage rows "
+                  "in {n_batches} batches ({seconds:.1f}s).".format(**summary))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from datastore.models import Project
+from datastore.weather import resolve_project_stations
+from datastore import runner
+
+from collections import Counter
+
+class Command(BaseCommand):
+    help = 'Resolves and stores the nearest weather station of every project.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                help='Resolve projects whose station is already stored, too.')
+
+    def handle(self, *args, **options):
+
+        stations = {}
+        for chunk in runner.iter_chunks(Project.objects.all()):
+            stations.update(resolve_project_stations(chunk, force=options["force"]))
+
+        counts = Counter(stations.values())
+        print("Resolved {} projects to {} weather stations ({} without a station).".format(
+                len(stations), len(counts) - (None in counts), counts.get(None, 0)))
@@ -1,11 +1,50 @@
 from django.core.management.base import BaseCommand
-from datastore.models import Project
+from datastore.models import MeterBatch, Project
+from datastore import runner
 
 class Command(BaseCommand):
     help = 'Runs the meter for all projects.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                help='Number of worker processes (default: 1, run in this process).')
+        parser.add_argument('--timeout', type=int, default=None,
+                help='Give up on a project after this many seconds.')
+        parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                help='Replace each worker process after this many projects, '
+                     'bounding its memory.')
+        parser.add_argument('--by-station', action='store_true',
+                help='Group projects by weather station, loading temperatures '
+                     'once per group.')
+        parser.add_argument('--stale-only', action='store_true',
+                help='Only run projects whose consumption data, periods or '
+                     'location changed since their latest meter run.')
+        parser.add_argument('--resume', type=int, metavar='BATCH_ID',
+                help='Continue the unfinished projects of an earlier batch.')
+        parser.add_argument('--retry-failed', action='store_true',
+                help='With --resume, also rerun projects that failed.')
+        parser.add_argument('--enqueue', action='store_true',
+                help='Only create the batch, for meterworker processes to run.')
+
     def handle(self, *args, **options):
 
-        for project in Project.objects.all():
-            print("Running meter for {}".format(project))
-            project.run_meter()
+        if options["resume"] is not None:
+            batch = MeterBatch.objects.get(pk=options["resume"])
+            print("Resuming meter batch {}.".format(batch.pk))
+        else:
+            if options["stale_only"]:
+                project_pks = runner.stale_project_pks(Project.objects.order_by('pk'))
+                print("{} projects have changed inputs.".format(len(project_pks)))
+            else:
+                project_pks = Project.objects.order_by('pk').values_list('pk', flat=True)
+            batch = MeterBatch.start(project_pks, 'runmeter')
+            print("Started meter batch {}.".format(batch.pk))
+            if options["enqueue"]:
+                print("Run it with: ./manage.py meterworker {}".format(batch.pk))
+                return
+
+        summary = runner.run_batch(batch, retry_failed=options["retry_failed"],
+                workers=options["workers"], timeout=options["timeout"],
+                by_station=options["by_station"], report=runner.print_result,
+                max_tasks_per_child=options["max_tasks_per_child"])
+        print(runner.format_summary(summary))
@@ -1,23 +1,79 @@
-from django.core.management.base import BaseCommand
-from datastore.models import ProjectBlock
+from django.core.management.base import BaseCommand, CommandError
+from datastore.models import MeterBatch, ProjectBlock
+from datastore import runner
+from datastore import tasks
 
 class Command(BaseCommand):
     help = 'Runs the meter for all projects in a particular block.'
 
     def add_arguments(self, parser):
-        parser.add_argument('block_id', type=int)
+        parser.add_argument('block_id', type=int, nargs='?')
+        parser.add_argument('--workers', type=int, default=1,
+                help='Number of worker processes (default: 1, run in this process).')
+        parser.add_argument('--timeout', type=int, default=None,
+                help='Give up on a project after this many seconds.')
+        parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                help='Replace each worker process after this many projects, '
+                     'bounding its memory.')
+        parser.add_argument('--by-station', action='store_true',
+                help='Group projects by weather station, loading temperatures '
+                     'once per group.')
+        parser.add_argument('--stale-only', action='store_true',
+                help='Only run projects whose consumption data, periods or '
+                     'location changed since their latest meter run.')
+        parser.add_argument('--celery', action='store_true',
+                help='Queue one task per project on the celery workers, '
+                     'computing the block summary once all have finished.')
+        parser.add_argument('--resume', type=int, metavar='BATCH_ID',
+                help='Continue the unfinished projects of an earlier batch.')
+        parser.add_argument('--retry-failed', action='store_true',
+                help='With --resume, also rerun projects that failed.')
+        parser.add_argument('--enqueue', action='store_true',
+                help='Only create the batch, for meterworker processes to run.')
 
     def handle(self, *args, **options):
 
-        project_block = ProjectBlock.objects.get(id=options["block_id"])
+        if options["resume"] is not None:
+            batch = MeterBatch.objects.get(pk=options["resume"])
+            project_block = batch.project_block
+            print("Resuming meter batch {} for {}.".format(batch.pk, project_block))
+        elif options["block_id"] is None:
+            raise CommandError("A block_id or --resume BATCH_ID is required.")
+        else:
+            project_block = ProjectBlock.objects.get(id=options["block_id"])
 
-        projects = project_block.projects.all()
+            if options["celery"]:
+                for option in ("by_station", "enqueue", "max_tasks_per_child"):
+                    if options[option]:
+                        raise CommandError("--{} does not apply with --celery.".format(
+                                option.replace("_", "-")))
+                if options["workers"] != 1:
+                    raise CommandError("--workers does not apply with --celery.")
+                task_id = tasks.run_block_meters.delay(project_block.pk,
+                        timeout=options["timeout"], stale_only=options["stale_only"]).id
+                print("Queued meter runs for {} (task {}).".format(project_block, task_id))
+                return
 
-        print("Running meter for {}".format(project_block, len(projects)))
+            if options["stale_only"]:
+                project_pks = runner.stale_project_pks(project_block.projects.order_by('pk'))
+                print("{} projects have changed inputs.".format(len(project_pks)))
+            else:
+                project_pks = list(project_block.projects.order_by('pk').values_list('pk', flat=True))
 
-        for project in projects:
-            print("Running meter for {}".format(project))
-            project.run_meter()
+            print("Running meter for {}".format(project_block, len(project_pks)))
+            batch = MeterBatch.start(project_pks, 'runmeterblock',
+                    project_block=project_block)
+            print("Started meter batch {}.".format(batch.pk))
+            if options["enqueue"]:
+                print("Run it with: ./manage.py meterworker {}".format(batch.pk))
+                return
 
-        print("Computing project block summary timeseries.")
-        project_block.compute_summary_timeseries()
+        summary = runner.run_batch(batch, retry_failed=options["retry_failed"],
+                workers=options["workers"], timeout=options["timeout"],
+                by_station=options["by_station"], report=runner.print_result,
+                max_tasks_per_child=options["max_tasks_per_child"])
+        print(runner.format_summary(summary))
+
+        if project_block is not None:
+            print("Computing project block summary timeseries.")
+            project_block.compute_summary_timeseries()
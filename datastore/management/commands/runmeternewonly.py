@@ -1,14 +1,46 @@
 from django.core.management.base import BaseCommand
-from datastore.models import Project
+from django.db.models import Count
+from datastore.models import MeterBatch, Project
+from datastore import runner
 
 class Command(BaseCommand):
     help = 'Runs the meter for all projects without.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                help='Number of worker processes (default: 1, run in this process).')
+        parser.add_argument('--timeout', type=int, default=None,
+                help='Give up on a project after this many seconds.')
+        parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                help='Replace each worker process after this many projects, '
+                     'bounding its memory.')
+        parser.add_argument('--by-station', action='store_true',
+                help='Group projects by weather station, loading temperatures '
+                     'once per group.')
+        parser.add_argument('--resume', type=int, metavar='BATCH_ID',
+                help='Continue the unfinished projects of an earlier batch.')
+        parser.add_argument('--retry-failed', action='store_true',
+                help='With --resume, also rerun projects that failed.')
+
     def handle(self, *args, **options):
 
-        for project in Project.objects.all():
-            if len(project.meterrun_set.all()) == 0:
-                print("Running meter for {}".format(project))
-                project.run_meter()
-            else:
-                print("Skipping meter for {}".format(project))
+        if options["resume"] is not None:
+            batch = MeterBatch.objects.get(pk=options["resume"])
+            print("Resuming meter batch {}.".format(batch.pk))
+        else:
+            project_pks = []
+            projects = Project.objects.annotate(n_meter_runs=Count('meterrun'))
+            for chunk in runner.iter_chunks(projects):
+                for project in chunk:
+                    if project.n_meter_runs == 0:
+                        project_pks.append(project.pk)
+                    else:
+                        print("Skipping meter for {}".format(project))
+            batch = MeterBatch.start(project_pks, 'runmeternewonly')
+            print("Started meter batch {}.".format(batch.pk))
+
+        summary = runner.run_batch(batch, retry_failed=options["retry_failed"],
+                workers=options["workers"], timeout=options["timeout"],
+                by_station=options["by_station"], report=runner.print_result,
+                max_tasks_per_child=options["max_tasks_per_child"])
+        print(runner.format_summary(summary))
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0020_auto_20160219_2044'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumptionSeries',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('n_records', models.IntegerField(default=0)),
+                ('start', models.BinaryField(default=b'')),
+                ('value', models.BinaryField(default=b'')),
+                ('estimated', models.BinaryField(default=b'')),
+                ('added', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('metadata', models.OneToOneField(related_name='series', to='datastore.ConsumptionMetadata')),
+            ],
+        ),
+    ]
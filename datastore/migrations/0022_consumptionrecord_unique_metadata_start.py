@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0021_consumptionseries'),
+    ]
+
+    operations = [
+        # keep the most recently inserted record for each (metadata, start)
+        migrations.RunSQL(
+            '''
+            DELETE FROM datastore_consumptionrecord AS a
+            USING datastore_consumptionrecord AS b
+            WHERE a.metadata_id = b.metadata_id
+              AND a.start = b.start
+              AND a.id < b.id
+            ''',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='consumptionrecord',
+            unique_together=set([('metadata', 'start')]),
+        ),
+    ]
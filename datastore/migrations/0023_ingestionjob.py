@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0022_consumptionrecord_unique_metadata_start'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=10, choices=[('RECORDS', 'Consumption records'), ('METADATA', 'Consumption metadata with records')])),
+                ('status', models.CharField(default='PENDING', max_length=10, choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCESS', 'Success'), ('FAILURE', 'Failure')])),
+                ('on_conflict', models.CharField(max_length=10, null=True, blank=True)),
+                ('payload', models.TextField(null=True, blank=True)),
+                ('n_records', models.IntegerField(default=0)),
+                ('n_written', models.IntegerField(default=0)),
+                ('errors', models.TextField(null=True, blank=True)),
+                ('started', models.DateTimeField(null=True, blank=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+                ('added', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
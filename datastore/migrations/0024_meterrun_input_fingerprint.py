@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0023_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meterrun',
+            name='input_fingerprint',
+            field=models.CharField(max_length=40, null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0024_meterrun_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTemperature',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('station', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+                ('temp_c', models.FloatField(null=True, blank=True)),
+                ('fetched', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailytemperature',
+            unique_together=set([('station', 'date')]),
+        ),
+    ]
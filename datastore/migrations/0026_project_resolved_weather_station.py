@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0025_dailytemperature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='resolved_weather_station',
+            field=models.CharField(max_length=10, null=True, blank=True),
+        ),
+    ]
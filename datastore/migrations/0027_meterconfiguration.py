@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0026_project_resolved_weather_station'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterConfiguration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('hash', models.CharField(unique=True, max_length=40)),
+                ('serialization', models.TextField()),
+                ('added', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='meterrun',
+            name='configuration',
+            field=models.ForeignKey(blank=True, to='datastore.MeterConfiguration', null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations
+
+
+def collapse_serializations(apps, schema_editor):
+    MeterRun = apps.get_model('datastore', 'MeterRun')
+    MeterConfiguration = apps.get_model('datastore', 'MeterConfiguration')
+    serializations = MeterRun.objects.exclude(serialization=None) \
+            .values_list('serialization', flat=True).distinct()
+    for serialization in serializations.iterator():
+        digest = hashlib.sha1(serialization.encode('utf-8')).hexdigest()
+        configuration, created = MeterConfiguration.objects.get_or_create(
+                hash=digest, defaults={'serialization': serialization})
+        MeterRun.objects.filter(serialization=serialization) \
+                .update(configuration=configuration)
+
+
+def expand_serializations(apps, schema_editor):
+    MeterRun = apps.get_model('datastore', 'MeterRun')
+    MeterConfiguration = apps.get_model('datastore', 'MeterConfiguration')
+    for configuration in MeterConfiguration.objects.iterator():
+        MeterRun.objects.filter(configuration=configuration) \
+                .update(serialization=configuration.serialization)
+
+
+class Migration(migrations.Migration):
+    """ Point every meter run at the MeterConfiguration of its
+    serialization. Kept apart from the schema changes on either side, as
+    PostgreSQL cannot alter datastore_meterrun in the transaction that
+    updated its foreign keys.
+    """
+
+    dependencies = [
+        ('datastore', '0027_meterconfiguration'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_serializations, expand_serializations),
+    ]
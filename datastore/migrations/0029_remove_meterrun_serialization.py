@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0028_meterrun_configuration_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='meterrun',
+            name='serialization',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0029_remove_meterrun_serialization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterBatch',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('command', models.CharField(max_length=255)),
+                ('added', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+                ('project_block', models.ForeignKey(blank=True, to='datastore.ProjectBlock', null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MeterBatchItem',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('status', models.CharField(default='PENDING', max_length=10, choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')])),
+                ('error', models.TextField(null=True, blank=True)),
+                ('n_meter_runs', models.IntegerField(default=0)),
+                ('started', models.DateTimeField(null=True, blank=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+                ('seconds', models.FloatField(null=True, blank=True)),
+                ('batch', models.ForeignKey(related_name='items', to='datastore.MeterBatch')),
+                ('project', models.ForeignKey(to='datastore.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='meterbatchitem',
+            unique_together=set([('batch', 'project')]),
+        ),
+    ]
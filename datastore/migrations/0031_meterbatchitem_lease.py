@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0030_meterbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meterbatchitem',
+            name='worker',
+            field=models.CharField(max_length=255, null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='meterbatchitem',
+            name='lease_expires',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='meterbatchitem',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='meterbatchitem',
+            index_together=set([('batch', 'status')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0031_meterbatchitem_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meterrun',
+            name='timings_json',
+            field=models.TextField(null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0032_meterrun_timings_json'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='meterrun',
+            index_together=set([('consumption_metadata', 'added')]),
+        ),
+    ]
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, Max
 from django.contrib.auth.models import User
-from django.utils.timezone import now
+from django.utils.timezone import now, utc
 from django.utils.encoding import python_2_unicode_compatible
-from django.db.models.signals import post_save, post_init
+from django.db.models.signals import post_save, post_init, pre_save
 from django.dispatch import receiver
 
 from eemeter.evaluation import Period
@@ -15,12 +16,20 @@ from eemeter.config.yaml_parser import dump
 from eemeter.models.temperature_sensitivity import AverageDailyTemperatureSensitivityModel
 
 from warnings import warn
-from datetime import timedelta, datetime
+from datetime import datetime
+import calendar
+import hashlib
+import logging
 import numpy as np
+import pandas as pd
 import json
 from collections import defaultdict
 import itertools
 
+from .timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
 FUEL_TYPE_CHOICES = [
     ('E', 'electricity'),
     ('NG', 'natural_gas'),
@@ -46,6 +55,14 @@ def _json_clean(value):
     else:
         return value
 
+def _to_epoch(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+def _from_epoch(seconds):
+    return datetime.fromtimestamp(int(seconds), utc)
+
+RECORD_ARRAY_DTYPE = [('start', 'i8'), ('value', 'f8'), ('estimated', '?')]
+
 
 @python_2_unicode_compatible
 class ProjectOwner(models.Model):
@@ -68,9 +85,14 @@ class Project(models.Model):
     weather_station = models.CharField(max_length=10, blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # nearest weather station to the location above; '' if there is none,
+    # None until resolved (see datastore.weather)
+    resolved_weather_station = models.CharField(max_length=10, blank=True, null=True)
     added = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    LOCATION_FIELDS = ('zipcode', 'weather_station', 'latitude', 'longitude')
+
     def __str__(self):
         return u'Project {}'.format(self.project_id)
 
@@ -89,28 +111,161 @@ class Project(models.Model):
         else:
             return None
 
-    def eemeter_project(self):
+    def eemeter_location(self):
+        from .weather import ResolvedLocation
+
+        station = self.resolve_weather_station()
+        if station is not None:
+            return ResolvedLocation(station, self.lat_lng, self.zipcode)
         if self.lat_lng is not None:
-            location = Location(lat_lng=self.lat_lng)
+            return Location(lat_lng=self.lat_lng)
         elif self.weather_station is not None:
-            location = Location(station=self.weather_station)
+            return Location(station=self.weather_station)
         else:
-            location = Location(zipcode=self.zipcode)
+            return Location(zipcode=self.zipcode)
+
+    def resolve_weather_station(self):
+        """ The weather station eemeter would use for this project, or
+        None if its location cannot be resolved. Resolved once and stored.
+        """
+        from .weather import resolve_project_stations
+
+        return resolve_project_stations([self])[self.pk]
+
+    def eemeter_project(self, weather_source=None, baseline_period=None,
+            reporting_period=None, weather_normal_source=None):
+        """ Build the eemeter project. Unless a `weather_source` and
+        `weather_normal_source` are given, temperatures come from the shared
+        `datastore.weather` cache and normals from its normal source. The
+        project's own periods are used unless others are given.
+        """
+        from .weather import get_cache
+
+        location = self.eemeter_location()
         consumption = [cm.eemeter_consumption_data() for cm in self.consumptionmetadata_set.all()]
         consumption_metadata_ids = [cm.id for cm in self.consumptionmetadata_set.all()]
 
-        project = EEMeterProject(location, consumption, self.baseline_period, self.reporting_period)
+        # temperatures are shared with other projects on the same station
+        if weather_source is None and location.station is not None:
+            weather_source = get_cache().weather_source(location.station)
+        if weather_normal_source is None and location.station is not None:
+            weather_normal_source = get_cache().weather_normal_source(location.station)
+
+        project = EEMeterProject(location, consumption,
+                baseline_period or self.baseline_period,
+                reporting_period or self.reporting_period,
+                weather_source=weather_source,
+                weather_normal_source=weather_normal_source)
         return project, consumption_metadata_ids
 
-    def run_meter(self, meter_type='residential', start_date=None, end_date=None, n_days=None):
-        """ If possible, run the meter specified by meter_type.
+    @staticmethod
+    def input_fingerprints(projects):
+        """ Map project pk to a hash of the inputs run_meter reads: the
+        project periods and location and, for each consumption metadata,
+        its record count, latest record start and last update.
+        """
+        metadata = defaultdict(list)
+        rows = ConsumptionMetadata.objects.filter(project__in=projects) \
+                .annotate(n_records=Count('records'), max_start=Max('records__start')) \
+                .order_by('pk') \
+                .values_list('project_id', 'pk', 'fuel_type', 'energy_unit',
+                        'updated', 'n_records', 'max_start',
+                        'series__n_records', 'series__updated')
+        for row in rows:
+            metadata[row[0]].append(row[1:])
+
+        fingerprints = {}
+        for project in projects:
+            inputs = [
+                project.baseline_period_start, project.baseline_period_end,
+                project.reporting_period_start, project.reporting_period_end,
+                project.zipcode, project.weather_station,
+                project.latitude, project.longitude,
+                metadata[project.pk],
+            ]
+            fingerprints[project.pk] = hashlib.sha1(
+                    json.dumps(inputs, default=str).encode('utf-8')).hexdigest()
+        return fingerprints
+
+    def input_fingerprint(self):
+        return Project.input_fingerprints([self])[self.pk]
+
+    def run_meter(self, meter_type='residential', start_date=None, end_date=None, n_days=None,
+            weather_source=None, weather_normal_source=None):
+        """ If possible, run the meter specified by meter_type. A
+        `weather_source` and `weather_normal_source` may be passed to share
+        temperatures and normals between runs.
+
+        The time and queries spent in each stage are logged and stored as
+        `timings_json` on each meter run.
+        """
+        timer = StageTimer()
+        with timer.stage("fingerprint"):
+            input_fingerprint = self.input_fingerprint()
+
+        evaluation = self._evaluate_meter(timer, meter_type, start_date, end_date,
+                weather_source, weather_normal_source=weather_normal_source)
+        if evaluation is None:
+            return
+        meter, outputs = evaluation
+
+        with timer.stage("configuration"):
+            configuration = MeterConfiguration.for_serialization(dump(meter.meter))
+        for output in outputs:
+            output.meter_run.configuration = configuration
+            output.meter_run.input_fingerprint = input_fingerprint
+
+        # persist everything in one transaction with a constant number of
+        # statements per meter run
+        meter_runs = []
+        with transaction.atomic():
+            with timer.stage("save"):
+                for output in outputs:
+                    output.save()
+                    meter_runs.append(output.meter_run)
+            timer.count("meter_runs", len(meter_runs))
+
+            timings_json = timer.to_json()
+            MeterRun.objects.filter(pk__in=[meter_run.pk for meter_run in meter_runs]) \
+                    .update(timings_json=timings_json)
+            for meter_run in meter_runs:
+                meter_run.timings_json = timings_json
+
+        logger.info("Ran meter for project id=%s: %s", self.project_id, timings_json)
+        return meter_runs
+
+    def evaluate_meter(self, meter_type='residential', start_date=None, end_date=None,
+            baseline_period=None, reporting_period=None, weather_source=None,
+            weather_normal_source=None):
+        """ Run the meter as `run_meter` does, optionally over other
+        baseline and reporting periods, but save nothing beyond the shared
+        weather station and temperature caches. Returns the unsaved
+        MeterRunOutputs, one per consumption metadata, or None if the
+        eemeter project cannot be built.
         """
+        timer = StageTimer()
+        evaluation = self._evaluate_meter(timer, meter_type, start_date, end_date,
+                weather_source, baseline_period, reporting_period, weather_normal_source)
+        if evaluation is None:
+            return
+        meter, outputs = evaluation
+        timings_json = timer.to_json()
+        for output in outputs:
+            output.meter_run.timings_json = timings_json
+        return outputs
+
+    def _evaluate_meter(self, timer, meter_type, start_date, end_date, weather_source,
+            baseline_period=None, reporting_period=None, weather_normal_source=None):
         try:
-            project, cm_ids = self.eemeter_project()
+            with timer.stage("load_records"):
+                project, cm_ids = self.eemeter_project(weather_source,
+                        baseline_period, reporting_period, weather_normal_source)
         except ValueError:
             message = "Cannot create eemeter project; skipping project id={}.".format(self.project_id)
             warn(message)
             return
+        timer.count("records", sum(len(consumption_data.data)
+                for consumption_data in project.consumption))
 
         if meter_type == "residential":
             meter = DefaultResidentialMeter()
@@ -134,9 +289,15 @@ class Project(models.Model):
 
         daily_evaluation_period = Period(start_date, end_date)
 
-        meter_results = meter.evaluate(DataCollection(project=project))
+        # fetch temperatures up front, so the evaluation and transforms
+        # below read them from memory
+        with timer.stage("weather"):
+            project.weather_source._fetch_period(daily_evaluation_period)
 
-        meter_runs = []
+        with timer.stage("evaluate"):
+            meter_results = meter.evaluate(DataCollection(project=project))
+
+        outputs = []
         for consumption_data, cm_id in zip(project.consumption, cm_ids):
 
             fuel_type_tag = consumption_data.fuel_type
@@ -197,8 +358,7 @@ class Project(models.Model):
                 model_parameters_reporting = model.param_type(model_parameter_dict_reporting)
 
             meter_run = MeterRun(project=self,
-                    consumption_metadata=ConsumptionMetadata.objects.get(pk=cm_id),
-                    serialization=dump(meter.meter),
+                    consumption_metadata_id=cm_id,
                     annual_usage_baseline=annual_usage_baseline,
                     annual_usage_reporting=annual_usage_reporting,
                     gross_savings=gross_savings,
@@ -209,54 +369,25 @@ class Project(models.Model):
                     cvrmse_baseline=cvrmse_baseline,
                     cvrmse_reporting=cvrmse_reporting)
 
-            meter_run.save()
-            meter_runs.append(meter_run)
-
             # record time series of usage for baseline and reporting
-            avg_temps = project.weather_source.daily_temperatures(
-                    daily_evaluation_period, meter.temperature_unit_str)
-
-            values_baseline = model.transform(avg_temps, model_parameters_baseline)
-            values_reporting = model.transform(avg_temps, model_parameters_reporting)
-
-            month_names = [daily_evaluation_period.start.strftime("%Y-%m")]
-
-            month_groups_baseline = defaultdict(list)
-            month_groups_reporting = defaultdict(list)
+            with timer.stage("weather"):
+                avg_temps = project.weather_source.daily_temperatures(
+                        daily_evaluation_period, meter.temperature_unit_str)
 
-            for value_baseline, value_reporting, days in zip(values_baseline, values_reporting, range(daily_evaluation_period.timedelta.days)):
-                date = daily_evaluation_period.start + timedelta(days=days)
+            with timer.stage("transform"):
+                values_baseline = model.transform(avg_temps, model_parameters_baseline)
+                values_reporting = model.transform(avg_temps, model_parameters_reporting)
 
-                daily_usage_baseline = DailyUsageBaseline(meter_run=meter_run, value=value_baseline, date=date)
-                daily_usage_baseline.save()
+            with timer.stage("set_usage"):
+                output = MeterRunOutput(meter_run)
+                output.set_usage(daily_evaluation_period.start,
+                        daily_evaluation_period.timedelta.days,
+                        values_baseline, values_reporting)
+            outputs.append(output)
+            timer.count("output_rows", 2 * (len(output.daily_dates) + len(output.monthly_dates)))
 
-                daily_usage_reporting = DailyUsageReporting(meter_run=meter_run, value=value_reporting, date=date)
-                daily_usage_reporting.save()
+        return meter, outputs
 
-                # track monthly usage as well
-                current_month = date.strftime("%Y-%m")
-                if not current_month == month_names[-1]:
-                    month_names.append(current_month)
-
-                month_groups_baseline[current_month].append(value_baseline)
-                month_groups_reporting[current_month].append(value_reporting)
-
-            for month_name in month_names:
-                baseline_values = month_groups_baseline[month_name]
-                reporting_values = month_groups_reporting[month_name]
-
-                monthly_average_baseline = 0 if baseline_values == [] else np.nanmean(baseline_values)
-                monthly_average_reporting = 0 if reporting_values == [] else np.nanmean(reporting_values)
-
-                dt = datetime.strptime(month_name, "%Y-%m")
-                monthly_average_usage_baseline = MonthlyAverageUsageBaseline(meter_run=meter_run, value=monthly_average_baseline, date=dt)
-                monthly_average_usage_baseline.save()
-
-                monthly_average_usage_reporting = MonthlyAverageUsageReporting(meter_run=meter_run, value=monthly_average_reporting, date=dt)
-                monthly_average_usage_reporting.save()
-
-        return meter_runs
-    
     @staticmethod
     def recent_meter_runs(project_pks=[]):
 
@@ -370,7 +501,9 @@ class ProjectBlock(models.Model):
 
     def compute_summary_timeseries(self):
         """ Compute aggregate timeseries for all projects in project block.
+        Logs and returns the time and queries spent in each stage.
         """
+        timer = StageTimer()
         data_by_fuel_type = defaultdict(lambda: {
             "baseline_by_month": defaultdict(list),
             "baseline_by_date": defaultdict(list),
@@ -381,14 +514,36 @@ class ProjectBlock(models.Model):
             "n_completed_projects_by_date": defaultdict(lambda: 0),
         })
 
-        for project in self.projects.all():
-            for meter_run in project.recent_meter_runs():
-
+        with timer.stage("load_meter_runs"):
+            projects = dict((project.pk, project) for project in self.projects.all())
+            # the latest meter run for each consumption metadata
+            meter_runs = MeterRun.objects.filter(project__in=list(projects)) \
+                    .select_related('consumption_metadata') \
+                    .order_by('consumption_metadata', '-added', '-pk')
+            if connection.vendor == 'postgresql':
+                meter_runs = meter_runs.distinct('consumption_metadata')
+            else:
+                latest_pks = {}
+                for metadata_pk, pk in meter_runs.values_list('consumption_metadata_id', 'pk'):
+                    latest_pks.setdefault(metadata_pk, pk)
+                meter_runs = meter_runs.filter(pk__in=list(latest_pks.values()))
+            latest_meter_runs = dict((meter_run.consumption_metadata_id, meter_run)
+                    for meter_run in meter_runs)
+        timer.count("projects", len(projects))
+        timer.count("meter_runs", len(latest_meter_runs))
+
+        for consumption_metadata_id in sorted(latest_meter_runs):
+            meter_run = latest_meter_runs[consumption_metadata_id]
+            project = projects[meter_run.project_id]
+
+            with timer.stage("load_usage"):
                 fuel_type = meter_run.consumption_metadata.fuel_type
-                dailyusagebaseline_set = meter_run.dailyusagebaseline_set.all()
-                dailyusagereporting_set = meter_run.dailyusagereporting_set.all()
-                assert len(dailyusagebaseline_set) == len(dailyusagereporting_set)
+                dailyusagebaseline_set = list(meter_run.dailyusagebaseline_set.all())
+                dailyusagereporting_set = list(meter_run.dailyusagereporting_set.all())
+            assert len(dailyusagebaseline_set) == len(dailyusagereporting_set)
+            timer.count("usage_rows", 2 * len(dailyusagebaseline_set))
 
+            with timer.stage("aggregate"):
                 fuel_type_data = data_by_fuel_type[fuel_type]
                 baseline_by_month = fuel_type_data["baseline_by_month"]
                 baseline_by_date = fuel_type_data["baseline_by_date"]
@@ -434,28 +589,34 @@ class ProjectBlock(models.Model):
             date_labels = sorted(baseline_by_date.keys())
             month_labels = sorted(baseline_by_month.keys())
 
-            fuel_type_summary = FuelTypeSummary(project_block=self,
-                    fuel_type=fuel_type)
-            fuel_type_summary.save()
-
-            for date in date_labels:
-                DailyUsageSummaryBaseline(fuel_type_summary=fuel_type_summary,
-                        value=np.nansum(baseline_by_date[date]), date=date).save()
-                DailyUsageSummaryActual(fuel_type_summary=fuel_type_summary,
-                        value=np.nansum(actual_by_date[date]), date=date,
-                        n_projects=n_completed_projects_by_date[date]).save()
-                DailyUsageSummaryReporting(fuel_type_summary=fuel_type_summary,
-                        value=np.nansum(reporting_by_date[date]), date=date).save()
-
-            for month in month_labels:
-                date = datetime.strptime(month, "%Y-%m").date()
-                MonthlyUsageSummaryBaseline(fuel_type_summary=fuel_type_summary,
-                        value=np.nansum(baseline_by_month[month]), date=date).save()
-                MonthlyUsageSummaryActual(fuel_type_summary=fuel_type_summary,
-                        value=np.nansum(actual_by_month[month]), date=date,
-                        n_projects=n_completed_projects_by_date[date]).save()
-                MonthlyUsageSummaryReporting(fuel_type_summary=fuel_type_summary,
-                        value=np.nansum(reporting_by_month[month]), date=date).save()
+            with timer.stage("save"):
+                fuel_type_summary = FuelTypeSummary(project_block=self,
+                        fuel_type=fuel_type)
+                fuel_type_summary.save()
+
+                for date in date_labels:
+                    DailyUsageSummaryBaseline(fuel_type_summary=fuel_type_summary,
+                            value=np.nansum(baseline_by_date[date]), date=date).save()
+                    DailyUsageSummaryActual(fuel_type_summary=fuel_type_summary,
+                            value=np.nansum(actual_by_date[date]), date=date,
+                            n_projects=n_completed_projects_by_date[date]).save()
+                    DailyUsageSummaryReporting(fuel_type_summary=fuel_type_summary,
+                            value=np.nansum(reporting_by_date[date]), date=date).save()
+
+                for month in month_labels:
+                    date = datetime.strptime(month, "%Y-%m").date()
+                    MonthlyUsageSummaryBaseline(fuel_type_summary=fuel_type_summary,
+                            value=np.nansum(baseline_by_month[month]), date=date).save()
+                    MonthlyUsageSummaryActual(fuel_type_summary=fuel_type_summary,
+                            value=np.nansum(actual_by_month[month]), date=date,
+                            n_projects=n_completed_projects_by_date[date]).save()
+                    MonthlyUsageSummaryReporting(fuel_type_summary=fuel_type_summary,
+                            value=np.nansum(reporting_by_month[month]), date=date).save()
+            timer.count("summary_rows", 3 * (len(date_labels) + len(month_labels)))
+
+        timings = timer.as_dict()
+        logger.info("Computed summary timeseries for %s: %s", self, json.dumps(timings))
+        return timings
 
     def recent_summaries(self):
         fuel_types = set([fts['fuel_type'] for fts in self.fueltypesummary_set.values('fuel_type')])
@@ -470,17 +631,94 @@ class ConsumptionMetadata(models.Model):
     added = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    @property
+    def packed(self):
+        try:
+            self.series
+        except ConsumptionSeries.DoesNotExist:
+            return False
+        return True
+
+    def record_arrays(self):
+        """ Return (start, value, estimated) arrays of epoch seconds,
+        float64 values (NaN if missing) and booleans, ordered by start.
+        """
+        if self.packed:
+            return self.series.to_arrays()
+        return self._row_arrays()
+
+    def _row_arrays(self, fetch_size=10000):
+        if connection.vendor != 'postgresql':
+            rows = list(self.records.order_by('start')
+                    .values_list('start', 'value', 'estimated'))
+            return (np.array([_to_epoch(start) for start, value, estimated in rows],
+                            dtype=np.int64),
+                    np.array([np.nan if value is None else value
+                            for start, value, estimated in rows], dtype=np.float64),
+                    np.array([estimated for start, value, estimated in rows], dtype=bool))
+
+        # Epochs and NaNs are produced in SQL so rows convert to a
+        # structured array without instantiating any models.
+        chunks = []
+        with connection.cursor() as cursor:
+            cursor.execute("""
+              SELECT EXTRACT(EPOCH FROM start)::bigint,
+                COALESCE(value, 'NaN'::float8),
+                estimated
+              FROM {}
+              WHERE metadata_id = %s
+              ORDER BY start
+            """.format(ConsumptionRecord._meta.db_table), [self.pk])
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=RECORD_ARRAY_DTYPE))
+        rows = np.concatenate(chunks) if chunks else np.array([], dtype=RECORD_ARRAY_DTYPE)
+        return rows['start'], rows['value'], rows['estimated']
+
+    def pack(self):
+        """ Move this metadata's records into packed `ConsumptionSeries`
+        storage. Missing values are stored as NaN.
+        """
+        with transaction.atomic():
+            start, value, estimated = self._row_arrays()
+            series, created = ConsumptionSeries.objects.get_or_create(metadata=self)
+            series.merge(start, value, estimated)
+            series.save()
+            self.records.all().delete()
+        return series
+
+    def unpack(self):
+        """ Move packed records back into individual `ConsumptionRecord` rows.
+        """
+        if not self.packed:
+            return
+        with transaction.atomic():
+            ConsumptionRecord.objects.bulk_create(self.series.records())
+            self.series.delete()
+            self.__dict__.pop('_series_cache', None)
+
     def eemeter_consumption_data(self):
-        records = self.records.all()
-        records = [r.eemeter_record() for r in records]
-        fuel_type = dict(FUEL_TYPE_CHOICES)[self.fuel_type]
-        unit_name = dict(ENERGY_UNIT_CHOICES)[self.energy_unit]
-        consumption_data = EEMeterConsumptionData(records, fuel_type=fuel_type,
-                unit_name=unit_name, record_type="arbitrary_start")
-        return consumption_data
+        """ Build eemeter ConsumptionData directly from columnar record
+        arrays, bypassing per-record dicts. As in eemeter's arbitrary_start
+        import, records are ordered by start and the last one only marks
+        the end of the one before it, so its value is NaN.
+        """
+        start, value, estimated = self.record_arrays()
+        order = np.argsort(start, kind='mergesort')
+        value = np.array(value[order], dtype=float)
+        if len(value):
+            value[-1] = np.nan
+        index = pd.DatetimeIndex(pd.to_datetime(start[order], unit='s')).tz_localize('UTC')
+        return EEMeterConsumptionData(None,
+                fuel_type=dict(FUEL_TYPE_CHOICES)[self.fuel_type],
+                unit_name=dict(ENERGY_UNIT_CHOICES)[self.energy_unit],
+                data=pd.Series(value, index=index),
+                estimated=pd.Series(np.asarray(estimated[order], dtype=bool), index=index))
 
     def __str__(self):
-        n = len(self.records.all())
+        n = self.series.n_records if self.packed else len(self.records.all())
         return u'ConsumptionMetadata(fuel_type={}, energy_unit={}, n={})'.format(self.fuel_type, self.energy_unit, n)
 
 
@@ -496,11 +734,308 @@ class ConsumptionRecord(models.Model):
 
     class Meta:
         ordering = ['start']
+        unique_together = (('metadata', 'start'),)
 
     def eemeter_record(self):
         return {"start": self.start, "value": self.value, "estimated": self.estimated }
 
 
+@python_2_unicode_compatible
+class ConsumptionSeries(models.Model):
+    """ Packed storage for all records of one ConsumptionMetadata: start
+    times as little-endian int64 epoch seconds, values as float64 and the
+    estimated flags as a bitmap.
+    """
+    metadata = models.OneToOneField(ConsumptionMetadata, related_name="series")
+    n_records = models.IntegerField(default=0)
+    start = models.BinaryField(default=b'')
+    value = models.BinaryField(default=b'')
+    estimated = models.BinaryField(default=b'')
+    added = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return u'ConsumptionSeries(metadata={}, n={})'.format(self.metadata_id, self.n_records)
+
+    def to_arrays(self):
+        start = np.frombuffer(self.start, dtype='<i8').astype(np.int64)
+        value = np.frombuffer(self.value, dtype='<f8').astype(np.float64)
+        estimated = np.unpackbits(np.frombuffer(self.estimated, dtype=np.uint8))
+        return start, value, estimated[:self.n_records].astype(bool)
+
+    def set_arrays(self, start, value, estimated):
+        self.n_records = len(start)
+        self.start = np.asarray(start, dtype='<i8').tobytes()
+        self.value = np.asarray(value, dtype='<f8').tobytes()
+        self.estimated = np.packbits(np.asarray(estimated, dtype=bool)).tobytes()
+
+    def merge(self, start, value, estimated, overwrite=True):
+        """ Merge new readings into the series, keyed on start. Readings
+        at an existing start replace it if `overwrite`, else are ignored.
+        Returns the number of readings written.
+        """
+        new = (np.asarray(start, dtype=np.int64),
+               np.asarray(value, dtype=np.float64),
+               np.asarray(estimated, dtype=bool))
+        old = self.to_arrays()
+        first, second = (new, old) if overwrite else (old, new)
+        merged = [np.concatenate([a, b]) for a, b in zip(first, second)]
+        # np.unique keeps the first occurrence of each start, sorted
+        _, index = np.unique(merged[0], return_index=True)
+        self.set_arrays(*[a[index] for a in merged])
+        if overwrite:
+            return len(np.unique(new[0]))
+        return len(index) - len(old[0])
+
+    def records(self, start=None, start_after=None, start_before=None):
+        """ Unsaved ConsumptionRecord instances for the packed readings,
+        optionally only those at `start`, at or after `start_after` and
+        before `start_before`.
+        """
+        starts, values, estimated = self.to_arrays()
+        keep = np.ones(len(starts), dtype=bool)
+        if start is not None:
+            keep &= starts == _to_epoch(start)
+        if start_after is not None:
+            keep &= starts >= _to_epoch(start_after)
+        if start_before is not None:
+            keep &= starts < _to_epoch(start_before)
+        return [ConsumptionRecord(metadata_id=self.metadata_id,
+                    start=_from_epoch(s),
+                    value=None if np.isnan(v) else float(v),
+                    estimated=bool(e))
+                for s, v, e in zip(starts[keep], values[keep], estimated[keep])]
+
+
+@python_2_unicode_compatible
+class IngestionJob(models.Model):
+    """ A consumption data upload queued for background processing.
+    """
+    KIND_CHOICES = (
+        ('RECORDS', 'Consumption records'),
+        ('METADATA', 'Consumption metadata with records'),
+    )
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCESS', 'Success'),
+        ('FAILURE', 'Failure'),
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    on_conflict = models.CharField(max_length=10, blank=True, null=True)
+    payload = models.TextField(blank=True, null=True)
+    n_records = models.IntegerField(default=0)
+    n_written = models.IntegerField(default=0)
+    errors = models.TextField(blank=True, null=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    added = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return u'IngestionJob(id={}, kind={}, status={})'.format(self.id, self.kind, self.status)
+
+    def error_list(self):
+        if self.errors is None:
+            return []
+        return json.loads(self.errors)
+
+    @property
+    def seconds(self):
+        if self.started is None or self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+    @property
+    def records_per_second(self):
+        seconds = self.seconds
+        if not seconds:
+            return None
+        return self.n_records / seconds
+
+
+@python_2_unicode_compatible
+class MeterBatch(models.Model):
+    """ A checkpointed run of the meter over a set of projects, so that an
+    interrupted run can be resumed where it stopped.
+    """
+    command = models.CharField(max_length=255)
+    project_block = models.ForeignKey('ProjectBlock', blank=True, null=True)
+    added = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return u'MeterBatch(id={}, command={})'.format(self.id, self.command)
+
+    @classmethod
+    def start(cls, project_pks, command, project_block=None):
+        with transaction.atomic():
+            batch = cls.objects.create(command=command, project_block=project_block)
+            MeterBatchItem.objects.bulk_create([
+                MeterBatchItem(batch=batch, project_id=pk) for pk in project_pks],
+                batch_size=1000)
+        return batch
+
+    def unfinished_project_pks(self, retry_failed=False):
+        statuses = ['PENDING', 'RUNNING']
+        if retry_failed:
+            statuses.append('FAILED')
+        return list(self.items.filter(status__in=statuses)
+                .order_by('project').values_list('project_id', flat=True))
+
+    def progress(self):
+        """ Number of items in each status. """
+        counts = dict((status, 0) for status, name in MeterBatchItem.STATUS_CHOICES)
+        for row in self.items.values('status').annotate(n=Count('id')):
+            counts[row['status']] = row['n']
+        return counts
+
+
+@python_2_unicode_compatible
+class MeterBatchItem(models.Model):
+    """ The status of one project within a MeterBatch. """
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+    batch = models.ForeignKey(MeterBatch, related_name='items')
+    project = models.ForeignKey('Project')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    error = models.TextField(blank=True, null=True)
+    n_meter_runs = models.IntegerField(default=0)
+    # set while claimed by a queue worker (see runner.claim_batch_items)
+    worker = models.CharField(max_length=255, blank=True, null=True)
+    lease_expires = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    seconds = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        unique_together = (('batch', 'project'),)
+        index_together = (('batch', 'status'),)
+
+    def __str__(self):
+        return u'MeterBatchItem(batch={}, project={}, status={})'.format(self.batch_id, self.project_id, self.status)
+
+
+@python_2_unicode_compatible
+class DailyTemperature(models.Model):
+    """ Cached average daily temperature (degrees C) at a weather station.
+    See `datastore.weather`.
+    """
+    station = models.CharField(max_length=10)
+    date = models.DateField()
+    temp_c = models.FloatField(blank=True, null=True)
+    fetched = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('station', 'date'),)
+
+    def __str__(self):
+        return u'DailyTemperature(station={}, date={}, temp_c={})'.format(self.station, self.date, self.temp_c)
+
+
+class MeterRunOutput(object):
+    """ An unsaved MeterRun with its daily and monthly usage series,
+    written with one bulk insert per output table.
+    """
+
+    def __init__(self, meter_run):
+        self.meter_run = meter_run
+        self.daily_dates = []
+        self.daily_baseline = []
+        self.daily_reporting = []
+        self.monthly_dates = []
+        self.monthly_baseline = []
+        self.monthly_reporting = []
+
+    def save(self):
+        meter_run = self.meter_run
+        meter_run.save()
+        DailyUsageBaseline.objects.bulk_create([
+            DailyUsageBaseline(meter_run=meter_run, value=value, date=date)
+            for date, value in zip(self.daily_dates, self.daily_baseline)])
+        DailyUsageReporting.objects.bulk_create([
+            DailyUsageReporting(meter_run=meter_run, value=value, date=date)
+            for date, value in zip(self.daily_dates, self.daily_reporting)])
+        MonthlyAverageUsageBaseline.objects.bulk_create([
+            MonthlyAverageUsageBaseline(meter_run=meter_run, value=value, date=date)
+            for date, value in zip(self.monthly_dates, self.monthly_baseline)])
+        MonthlyAverageUsageReporting.objects.bulk_create([
+            MonthlyAverageUsageReporting(meter_run=meter_run, value=value, date=date)
+            for date, value in zip(self.monthly_dates, self.monthly_reporting)])
+
+    def set_usage(self, start, n_days, values_baseline, values_reporting):
+        """ Set the daily series for up to `n_days` days from `start` and
+        their monthly averages. The month of `start` is always included,
+        averaging to 0 if it has no days.
+        """
+        values_baseline = np.asarray(values_baseline, dtype=float)
+        values_reporting = np.asarray(values_reporting, dtype=float)
+        n = max(min(len(values_baseline), len(values_reporting), n_days), 0)
+
+        dates = pd.date_range(start, periods=n, freq='D')
+        self.daily_dates = list(dates.to_pydatetime())
+        self.daily_baseline = list(values_baseline[:n])
+        self.daily_reporting = list(values_reporting[:n])
+
+        self.monthly_dates = [datetime(start.year, start.month, 1)]
+        self.monthly_baseline = [0]
+        self.monthly_reporting = [0]
+        if n == 0:
+            return
+
+        # dates are consecutive, so each month is one contiguous slice
+        months = np.asarray(dates.year * 12 + dates.month - 1)
+        bounds = np.flatnonzero(np.diff(months)) + 1
+        lowers = np.concatenate([[0], bounds])
+        uppers = np.concatenate([bounds, [n]])
+
+        self.monthly_dates = [datetime(int(m) // 12, int(m) % 12 + 1, 1)
+                for m in months[lowers]]
+        self.monthly_baseline = [np.nanmean(values_baseline[lower:upper])
+                for lower, upper in zip(lowers, uppers)]
+        self.monthly_reporting = [np.nanmean(values_reporting[lower:upper])
+                for lower, upper in zip(lowers, uppers)]
+
+
+@python_2_unicode_compatible
+class MeterConfiguration(models.Model):
+    """ A meter serialization, stored once and shared by every MeterRun
+    that used it. Keyed by the SHA-1 of the serialization.
+    """
+    hash = models.CharField(max_length=40, unique=True)
+    serialization = models.TextField()
+    added = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return u'MeterConfiguration(hash={})'.format(self.hash)
+
+    @staticmethod
+    def hash_serialization(serialization):
+        return hashlib.sha1(serialization.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def for_serialization(cls, serialization):
+        """ The configuration for `serialization`, created if new. """
+        digest = cls.hash_serialization(serialization)
+        try:
+            return cls.objects.get(hash=digest)
+        except cls.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic():
+                return cls.objects.create(hash=digest, serialization=serialization)
+        except IntegrityError:
+            # created concurrently by another run
+            return cls.objects.get(hash=digest)
+
+
 @python_2_unicode_compatible
 class MeterRun(models.Model):
     METER_TYPE_CHOICES = (
@@ -511,7 +1046,7 @@ class MeterRun(models.Model):
     )
     project = models.ForeignKey(Project)
     consumption_metadata = models.ForeignKey(ConsumptionMetadata)
-    serialization = models.CharField(max_length=100000, blank=True, null=True)
+    configuration = models.ForeignKey(MeterConfiguration, blank=True, null=True)
     annual_usage_baseline = models.FloatField(blank=True, null=True)
     annual_usage_reporting = models.FloatField(blank=True, null=True)
     gross_savings = models.FloatField(blank=True, null=True)
@@ -521,12 +1056,26 @@ class MeterRun(models.Model):
     model_parameter_json_reporting = models.CharField(max_length=10000, blank=True, null=True)
     cvrmse_baseline = models.FloatField(blank=True, null=True)
     cvrmse_reporting = models.FloatField(blank=True, null=True)
+    input_fingerprint = models.CharField(max_length=40, blank=True, null=True)
+    # seconds, queries and counts per stage of the Project.run_meter call
+    # that produced this run (shared by the runs it produced)
+    timings_json = models.TextField(blank=True, null=True)
     added = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # latest runs per metadata, for reads and datastore.retention
+        index_together = (('consumption_metadata', 'added'),)
+
     def __str__(self):
         return u'MeterRun(project_id={}, valid={})'.format(self.project.project_id, self.valid_meter_run())
 
+    @property
+    def serialization(self):
+        if self.configuration_id is None:
+            return None
+        return self.configuration.serialization
+
     def annual_usage_baseline_clean(self):
         return _json_clean(self.annual_usage_baseline)
 
@@ -722,6 +1271,18 @@ class MonthlyUsageSummaryReporting(models.Model):
 #         instance.compute_summary_timeseries()
 #         instance.__projects = instance.projects
 
+@receiver(post_init, sender=Project)
+def project_remember_location(sender, instance, **kwargs):
+    # read through __dict__ so that deferred fields are not loaded
+    instance._location = tuple(instance.__dict__.get(f) for f in Project.LOCATION_FIELDS)
+
+@receiver(pre_save, sender=Project)
+def project_invalidate_weather_station(sender, instance, **kwargs):
+    location = tuple(instance.__dict__.get(f) for f in Project.LOCATION_FIELDS)
+    if location != instance._location:
+        instance.resolved_weather_station = None
+        instance._location = location
+
 @receiver(post_save, sender=User)
 def create_project_owner(sender, instance, **kwargs):
     project_owner, created = ProjectOwner.objects.get_or_create(user=instance)
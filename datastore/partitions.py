@@ -0,0 +1,253 @@
+"""Declarative range partitioning of the consumption record table by start.
+
+Requires PostgreSQL 11 or later. Partitions are named
+``datastore_consumptionrecord_pYYYY`` (yearly) or
+``datastore_consumptionrecord_pYYYY_MM`` (monthly); rows outside every
+partition land in ``datastore_consumptionrecord_default``.
+"""
+from __future__ import absolute_import
+
+import re
+from datetime import date
+
+from django.db import transaction
+
+TABLE = 'datastore_consumptionrecord'
+UNPARTITIONED_TABLE = 'datastore_consumptionrecord_unpartitioned'
+DEFAULT_PARTITION = 'datastore_consumptionrecord_default'
+SEQUENCE = 'datastore_consumptionrecord_id_seq'
+
+INTERVALS = ('month', 'year')
+
+MIN_SERVER_VERSION = 110000
+
+PARTITION_NAME_RE = re.compile(r'^{}_p(\d{{4}})(?:_(\d{{2}}))?$'.format(TABLE))
+
+TABLE_DEFINITION = '''
+  CREATE TABLE {table} (
+    id integer NOT NULL DEFAULT nextval('{sequence}'),
+    start timestamp with time zone NOT NULL,
+    value double precision NULL,
+    estimated boolean NOT NULL,
+    metadata_id integer NOT NULL,
+    CONSTRAINT {foreign_key} FOREIGN KEY (metadata_id)
+      REFERENCES datastore_consumptionmetadata (id) DEFERRABLE INITIALLY DEFERRED,
+    CONSTRAINT {primary_key} PRIMARY KEY (id{primary_key_extra}),
+    CONSTRAINT {unique} UNIQUE (metadata_id, start)
+  ) {partition_clause}
+'''
+
+
+def supported(connection):
+    return connection.vendor == 'postgresql' and \
+        connection.pg_version >= MIN_SERVER_VERSION
+
+
+def is_partitioned(cursor):
+    cursor.execute('''
+      SELECT count(*)
+      FROM pg_partitioned_table
+      JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid
+      WHERE pg_class.relname = %s
+    ''', [TABLE])
+    return cursor.fetchone()[0] > 0
+
+
+def next_bound(interval, d):
+    if interval == 'year':
+        return date(d.year + 1, 1, 1)
+    if d.month == 12:
+        return date(d.year + 1, 1, 1)
+    return date(d.year, d.month + 1, 1)
+
+
+def _floor(interval, d):
+    return date(d.year, 1 if interval == 'year' else d.month, 1)
+
+
+def partition_name(interval, lower):
+    if interval == 'year':
+        return '{}_p{:04d}'.format(TABLE, lower.year)
+    return '{}_p{:04d}_{:02d}'.format(TABLE, lower.year, lower.month)
+
+
+def partition_bounds(interval, start, end):
+    """ (name, lower, upper) for every partition covering [start, end].
+    """
+    if interval not in INTERVALS:
+        raise ValueError("interval must be one of {}".format(INTERVALS))
+    bounds = []
+    lower = _floor(interval, start)
+    while lower <= end:
+        upper = next_bound(interval, lower)
+        bounds.append((partition_name(interval, lower), lower, upper))
+        lower = upper
+    return bounds
+
+
+def existing_partitions(cursor):
+    """ (name, lower, upper) of attached range partitions, parsed from
+    their names.
+    """
+    cursor.execute('''
+      SELECT child.relname
+      FROM pg_inherits
+      JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+      JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+      WHERE parent.relname = %s
+    ''', [TABLE])
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if match is None:
+            continue
+        year, month = int(match.group(1)), match.group(2)
+        if month is None:
+            lower = date(year, 1, 1)
+            upper = next_bound('year', lower)
+        else:
+            lower = date(year, int(month), 1)
+            upper = next_bound('month', lower)
+        partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def partition_interval(cursor):
+    """ The interval of the latest attached partition, or None if there
+    are none.
+    """
+    partitions = existing_partitions(cursor)
+    if not partitions:
+        return None
+    name, lower, upper = partitions[-1]
+    return 'year' if upper == next_bound('year', lower) else 'month'
+
+
+def create_partition(cursor, name, lower, upper):
+    """ Create one partition, first moving any rows for its range out of
+    the default partition (PostgreSQL refuses to attach over them).
+    """
+    cursor.execute('''
+      CREATE TEMPORARY TABLE consumptionrecord_moving ON COMMIT DROP AS
+      SELECT * FROM {default} WHERE start >= %s AND start < %s
+    '''.format(default=DEFAULT_PARTITION), [lower, upper])
+    cursor.execute('''
+      DELETE FROM {default} WHERE start >= %s AND start < %s
+    '''.format(default=DEFAULT_PARTITION), [lower, upper])
+    cursor.execute('''
+      CREATE TABLE {name} PARTITION OF {table}
+      FOR VALUES FROM (%s) TO (%s)
+    '''.format(name=name, table=TABLE), [lower, upper])
+    cursor.execute('''
+      INSERT INTO {table} (id, start, value, estimated, metadata_id)
+      SELECT id, start, value, estimated, metadata_id
+      FROM consumptionrecord_moving
+    '''.format(table=TABLE))
+    cursor.execute('DROP TABLE consumptionrecord_moving')
+
+
+def create_partitions(connection, interval, start, end):
+    """ Create any missing partitions covering [start, end]. Returns the
+    names of the partitions created. Raises ValueError if `interval` is
+    not the one the table was partitioned by, as their ranges would
+    overlap.
+    """
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        existing_interval = partition_interval(cursor)
+        if existing_interval not in (None, interval):
+            raise ValueError("records are partitioned by {}, not {}".format(
+                    existing_interval, interval))
+        existing = set(p[0] for p in existing_partitions(cursor))
+        for name, lower, upper in partition_bounds(interval, start, end):
+            if name not in existing:
+                create_partition(cursor, name, lower, upper)
+                created.append(name)
+    return created
+
+
+def detach_partitions(connection, before, drop=False):
+    """ Detach (and optionally drop) every partition whose range ends on or
+    before `before`. Returns the names of the affected partitions.
+    """
+    detached = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, lower, upper in existing_partitions(cursor):
+            if upper > before:
+                continue
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(TABLE, name))
+            if drop:
+                cursor.execute('DROP TABLE {}'.format(name))
+            detached.append(name)
+    return detached
+
+
+def constraint_names(cursor, table=TABLE):
+    """ Names of the table's primary key, unique and foreign key
+    constraints, keyed 'p', 'u' and 'f'.
+    """
+    cursor.execute("""
+      SELECT contype, conname FROM pg_constraint
+      WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+    """, [table])
+    return dict(cursor.fetchall())
+
+
+def _swap_table(cursor, partition_clause, primary_key_extra):
+    """ Move the current table aside and create its replacement, keeping
+    the id sequence and the constraint names Django's migrations gave it.
+    """
+    names = constraint_names(cursor)
+    cursor.execute('ALTER TABLE {} RENAME TO {}'.format(TABLE, UNPARTITIONED_TABLE))
+    cursor.execute('ALTER SEQUENCE {} OWNED BY NONE'.format(SEQUENCE))
+    # free up the constraint names for the new table
+    for conname in names.values():
+        cursor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}_old'.format(
+                UNPARTITIONED_TABLE, conname, conname))
+    cursor.execute(TABLE_DEFINITION.format(table=TABLE, sequence=SEQUENCE,
+            primary_key_extra=primary_key_extra, partition_clause=partition_clause,
+            primary_key=names.get('p', TABLE + '_pkey'),
+            unique=names.get('u', TABLE + '_metadata_id_start_key'),
+            foreign_key=names.get('f', TABLE + '_metadata_id_fkey')))
+    cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(SEQUENCE, TABLE))
+
+
+def partition_table(connection, interval):
+    """ Convert the records table into one range-partitioned on start,
+    with partitions covering the existing data and a default partition.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        cursor.execute('SELECT min(start), max(start) FROM {}'.format(TABLE))
+        start, end = cursor.fetchone()
+
+        _swap_table(cursor, 'PARTITION BY RANGE (start)', ', start')
+        cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+                DEFAULT_PARTITION, TABLE))
+        if start is not None:
+            for name, lower, upper in partition_bounds(interval, start.date(), end.date()):
+                cursor.execute('''
+                  CREATE TABLE {name} PARTITION OF {table}
+                  FOR VALUES FROM (%s) TO (%s)
+                '''.format(name=name, table=TABLE), [lower, upper])
+
+        cursor.execute('''
+          INSERT INTO {table} (id, start, value, estimated, metadata_id)
+          SELECT id, start, value, estimated, metadata_id FROM {old}
+        '''.format(table=TABLE, old=UNPARTITIONED_TABLE))
+        cursor.execute('DROP TABLE {}'.format(UNPARTITIONED_TABLE))
+
+
+def unpartition_table(connection):
+    """ Convert a partitioned records table back into a plain table.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return
+        _swap_table(cursor, '', '')
+        cursor.execute('''
+          INSERT INTO {table} (id, start, value, estimated, metadata_id)
+          SELECT id, start, value, estimated, metadata_id FROM {old}
+        '''.format(table=TABLE, old=UNPARTITIONED_TABLE))
+        cursor.execute('DROP TABLE {} CASCADE'.format(UNPARTITIONED_TABLE))
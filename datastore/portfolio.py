@@ -0,0 +1,502 @@
+"""Generate a synthetic, production-sized portfolio for load tests and
+query-plan work.
+
+Every datastore model is filled: owners, projects with attributes and
+blocks, consumption (as records, or packed series for a fraction of
+metadata), cached weather under synthetic station ids, meter runs with
+their daily and monthly output, block summaries, a meter batch and
+ingestion jobs. Draws come from one seeded generator, projects are written
+in chunks, and large tables are written with ``COPY`` on PostgreSQL
+(``bulk_create`` elsewhere).
+"""
+from __future__ import absolute_import, division
+
+import json
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytz
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import six
+from django.utils.timezone import now
+
+from eemeter.config.yaml_parser import dump
+from eemeter.meter import DefaultResidentialMeter
+
+from . import ingest
+from .models import (ConsumptionMetadata, ConsumptionRecord, ConsumptionSeries,
+        DailyTemperature, DailyUsageBaseline, DailyUsageReporting,
+        DailyUsageSummaryActual, DailyUsageSummaryBaseline, DailyUsageSummaryReporting,
+        FuelTypeSummary, IngestionJob, MeterBatch, MeterBatchItem, MeterConfiguration,
+        MeterRun, MonthlyAverageUsageBaseline, MonthlyAverageUsageReporting,
+        MonthlyUsageSummaryActual, MonthlyUsageSummaryBaseline,
+        MonthlyUsageSummaryReporting, Project, ProjectAttribute, ProjectAttributeKey,
+        ProjectBlock)
+from .weather import StationIndex, synthetic_fetch
+
+START = datetime(2012, 1, 1, tzinfo=pytz.UTC)
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+FREQUENCIES = {
+    "daily": 24,
+    "hourly": 1,
+}
+
+ATTRIBUTE_KEYS = [
+    # name, display name, data type
+    ("project_cost", "Project Cost", "FLOAT"),
+    ("contractor", "Contractor", "CHAR"),
+    ("n_measures", "Number of Measures", "INTEGER"),
+    ("completion_date", "Completion Date", "DATE"),
+    ("audit_datetime", "Audit Time", "DATETIME"),
+    ("rebate_claimed", "Rebate Claimed", "BOOLEAN"),
+]
+
+# share of projects with natural gas as well as electricity
+GAS_FRACTION = 0.6
+
+# consumption is written whenever this many records are buffered
+RECORD_FLUSH_SIZE = 1000000
+
+COPY_BATCH_SIZE = 100000
+
+# prepended to the GSOD station ids of generated projects, so their
+# synthetic temperatures never land in the cache of a real station
+STATION_PREFIX = "SYN"
+
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        return ingest._copy_float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def copy_rows(model, columns, rows, batch_size=COPY_BATCH_SIZE):
+    """ Insert `rows`, tuples of values for the field attnames `columns`,
+    with COPY on PostgreSQL or bulk_create elsewhere. Values must not
+    contain tabs or newlines. Returns the number of rows written.
+    """
+    n = 0
+    for batch in ingest.batches(rows, batch_size):
+        if connection.vendor == 'postgresql':
+            buf = six.StringIO()
+            for row in batch:
+                buf.write(u'\t'.join(_copy_value(value) for value in row))
+                buf.write(u'\n')
+            buf.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_from(buf, model._meta.db_table, columns=columns)
+        else:
+            model.objects.bulk_create([model(**dict(zip(columns, row))) for row in batch])
+        n += len(batch)
+    return n
+
+
+def _daily_model(fuel_type, rng):
+    """ Temperature sensitivity parameters for one meter, named as in
+    eemeter's AverageDailyTemperatureSensitivityModel.
+    """
+    if fuel_type == "E":
+        return OrderedDict([
+            ("base_daily_consumption", rng.uniform(8, 30)),
+            ("heating_slope", rng.uniform(0.2, 1.5)),
+            ("heating_balance_temperature", rng.uniform(12, 18)),
+            ("cooling_slope", rng.uniform(0.5, 3.0)),
+            ("cooling_balance_temperature", rng.uniform(20, 25)),
+        ])
+    return OrderedDict([
+        ("base_daily_consumption", rng.uniform(0.2, 1.0)),
+        ("heating_slope", rng.uniform(0.1, 0.4)),
+        ("heating_balance_temperature", rng.uniform(12, 18)),
+    ])
+
+
+def _predict(params, temps):
+    usage = params["base_daily_consumption"] + params["heating_slope"] * \
+            np.maximum(params["heating_balance_temperature"] - temps, 0)
+    if "cooling_slope" in params:
+        usage += params["cooling_slope"] * \
+                np.maximum(temps - params["cooling_balance_temperature"], 0)
+    return usage
+
+
+class PortfolioGenerator(object):
+    """ Writes a portfolio of `n_projects` projects in chunks; see
+    `generate`. `counts` tallies the rows written per model.
+    """
+
+    def __init__(self, n_projects, years=2, frequency="daily", n_owners=5, n_blocks=20,
+            n_stations=100, meter_run_fraction=0.9, packed_fraction=0.1,
+            chunk_size=500, seed=0, prefix=None, report=None):
+        self.n_projects = n_projects
+        self.hours = FREQUENCIES[frequency]
+        self.n_owners = n_owners
+        self.n_blocks = n_blocks
+        self.n_stations = n_stations
+        self.meter_run_fraction = meter_run_fraction
+        self.packed_fraction = packed_fraction
+        self.chunk_size = chunk_size
+        self.prefix = prefix or "PORTFOLIO-{}-".format(seed)
+        self.report = report
+        self.rng = np.random.RandomState(seed)
+        self.fetch = synthetic_fetch(seed)
+        self.counts = OrderedDict()
+        # the share of projects in each block
+        self.block_fractions = self.rng.uniform(0.01, 0.3, n_blocks)
+
+        end = START.replace(year=START.year + years)
+        self.n_days = (end - START).days
+        self.dates = [START.date() + timedelta(days=i) for i in range(self.n_days)]
+        self.month_starts = np.array([i for i, d in enumerate(self.dates) if d.day == 1])
+        self.month_lengths = np.diff(np.append(self.month_starts, self.n_days))
+        self.record_starts = int((START - EPOCH).total_seconds()) + 3600 * self.hours \
+                * np.arange(self.n_days * 24 // self.hours, dtype=np.int64)
+        hour = np.arange(24)
+        profile = 1 + 0.5 * np.sin(2 * np.pi * (hour - 9) / 24)
+        self.hourly_profile = profile / profile.sum()
+
+        self._temps = {}
+        self._records = []
+        self._n_buffered = 0
+
+    def _count(self, model, n):
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + n
+
+    def _station_temps(self, station):
+        if station not in self._temps:
+            temps = []
+            for year in range(START.year, START.year + self.n_days // 365 + 1):
+                temps.extend(t for d, t in sorted(self.fetch(station, year).items()))
+            self._temps[station] = np.array(temps[:self.n_days])
+        return self._temps[station]
+
+    def setup(self):
+        rng = self.rng
+        self.owners = []
+        for i in range(self.n_owners):
+            user = User.objects.create_user("{}owner-{}".format(self.prefix, i).lower())
+            self.owners.append(user.projectowner)
+        self._count(User, self.n_owners)
+
+        self.attribute_keys = []
+        for name, display_name, data_type in ATTRIBUTE_KEYS:
+            key, created = ProjectAttributeKey.objects.get_or_create(name=name,
+                    data_type=data_type, defaults={"display_name": display_name})
+            self.attribute_keys.append(key)
+        self.contractors = ["Contractor {:02d}".format(i) for i in range(25)]
+
+        index = StationIndex()
+        picked = rng.choice(len(index.stations), min(self.n_stations, len(index.stations)),
+                replace=False)
+        self.stations = [(STATION_PREFIX + index.stations[i], index.lats[i], index.lngs[i])
+                for i in picked]
+        # a few stations cover most projects, as in real portfolios
+        weights = rng.lognormal(0, 1, len(self.stations))
+        self.station_weights = weights / weights.sum()
+
+        self.blocks = [ProjectBlock.objects.create(name="{}block-{}".format(self.prefix, i))
+                for i in range(self.n_blocks)]
+        self._count(ProjectBlock, self.n_blocks)
+        self.block_sums = dict(((i, fuel_type, series), np.zeros(self.n_days))
+                for i in range(self.n_blocks) for fuel_type in ("E", "NG")
+                for series in ("baseline", "reporting", "actual", "n_completed"))
+
+        self.configuration = MeterConfiguration.for_serialization(
+                dump(DefaultResidentialMeter().meter))
+        self.batch = MeterBatch.objects.create(command="generate_portfolio")
+        self._count(MeterBatch, 1)
+
+    def _create_projects(self, first, n):
+        rng = self.rng
+        station_index = rng.choice(len(self.stations), n, p=self.station_weights)
+        baseline_end = rng.randint(int(self.n_days * 0.3), int(self.n_days * 0.6), n)
+        reporting_start = baseline_end + rng.randint(14, 90, n)
+        projects = []
+        for i in range(n):
+            station, lat, lng = self.stations[station_index[i]]
+            projects.append(Project(
+                project_owner=self.owners[rng.randint(len(self.owners))],
+                project_id="{}{:07d}".format(self.prefix, first + i),
+                baseline_period_start=START,
+                baseline_period_end=START + timedelta(days=int(baseline_end[i])),
+                reporting_period_start=START + timedelta(days=int(reporting_start[i])),
+                reporting_period_end=START + timedelta(days=self.n_days),
+                latitude=float(lat + rng.normal(0, 0.05)),
+                longitude=float(lng + rng.normal(0, 0.05)),
+                resolved_weather_station=station))
+        Project.objects.bulk_create(projects)
+        self._count(Project, n)
+
+        pks = dict(Project.objects.filter(project_id__in=[p.project_id for p in projects])
+                .values_list('project_id', 'pk'))
+        for project in projects:
+            project.pk = pks[project.project_id]
+        return projects
+
+    def _create_attributes(self, projects):
+        rng = self.rng
+        attributes = []
+        for project in projects:
+            for key in self.attribute_keys:
+                if rng.rand() > 0.9:
+                    continue
+                attribute = ProjectAttribute(project_id=project.pk, key=key)
+                if key.data_type == "FLOAT":
+                    attribute.float_value = float(np.round(rng.lognormal(9, 0.6), 2))
+                elif key.data_type == "CHAR":
+                    attribute.char_value = self.contractors[rng.randint(len(self.contractors))]
+                elif key.data_type == "INTEGER":
+                    attribute.integer_value = int(rng.poisson(3) + 1)
+                elif key.data_type == "DATE":
+                    attribute.date_value = project.reporting_period_start.date()
+                elif key.data_type == "DATETIME":
+                    attribute.datetime_value = project.baseline_period_start \
+                            + timedelta(days=int(rng.randint(0, 60)), hours=int(rng.randint(8, 18)))
+                else:
+                    attribute.boolean_value = bool(rng.rand() < 0.4)
+                attributes.append(attribute)
+        ProjectAttribute.objects.bulk_create(attributes, batch_size=10000)
+        self._count(ProjectAttribute, len(attributes))
+
+    def _create_metadata(self, projects):
+        metadata = []
+        for project in projects:
+            metadata.append(ConsumptionMetadata(project_id=project.pk,
+                    fuel_type="E", energy_unit="KWH"))
+            if self.rng.rand() < GAS_FRACTION:
+                metadata.append(ConsumptionMetadata(project_id=project.pk,
+                        fuel_type="NG", energy_unit="THM"))
+        ConsumptionMetadata.objects.bulk_create(metadata, batch_size=10000)
+        self._count(ConsumptionMetadata, len(metadata))
+
+        pks = dict(((project_id, fuel_type), pk) for pk, project_id, fuel_type in
+                ConsumptionMetadata.objects.filter(project__in=[p.pk for p in projects])
+                .values_list('pk', 'project_id', 'fuel_type'))
+        for m in metadata:
+            m.pk = pks[(m.project_id, m.fuel_type)]
+        return metadata
+
+    def _buffer_records(self, metadata_id, usage):
+        rng = self.rng
+        if self.hours == 24:
+            values = usage.copy()
+        else:
+            values = np.outer(usage, self.hourly_profile).ravel()
+        values[rng.rand(len(values)) < 0.01] = np.nan
+        estimated = rng.rand(len(values)) < 0.02
+
+        if rng.rand() < self.packed_fraction:
+            series = ConsumptionSeries(metadata_id=metadata_id)
+            series.set_arrays(self.record_starts, values, estimated)
+            self._records.append(series)
+        else:
+            self._records.append((np.repeat(metadata_id, len(values)),
+                    self.record_starts, values, estimated))
+        self._n_buffered += len(values)
+        if self._n_buffered >= RECORD_FLUSH_SIZE:
+            self._flush_records()
+
+    def _flush_records(self):
+        series = [r for r in self._records if isinstance(r, ConsumptionSeries)]
+        arrays = [r for r in self._records if not isinstance(r, ConsumptionSeries)]
+        self._records = []
+        self._n_buffered = 0
+
+        started = now()
+        if series:
+            ConsumptionSeries.objects.bulk_create(series)
+            self._count(ConsumptionSeries, len(series))
+        if arrays:
+            metadata_id, start, value, estimated = [np.concatenate(a) for a in zip(*arrays)]
+            report = ingest.load_arrays(metadata_id, start, value, estimated,
+                    batch_size=COPY_BATCH_SIZE)
+            self._count(ConsumptionRecord, report["n_written"])
+            IngestionJob.objects.create(kind="RECORDS", status="SUCCESS",
+                    n_records=report["n_records"], n_written=report["n_written"],
+                    started=started, finished=now())
+            self._count(IngestionJob, 1)
+
+    def _meter_output(self, metadata, projects, project_blocks):
+        """ Consumption, meter runs and their daily and monthly output for
+        the metadata of one chunk, adding each run to its blocks' sums.
+        `projects` maps pk to project.
+        """
+        rng = self.rng
+        days = np.arange(self.n_days)
+        meter_runs, outputs = [], []
+        for m in metadata:
+            project = projects[m.project_id]
+            temps = self._station_temps(project.resolved_weather_station)
+            params = _daily_model(m.fuel_type, rng)
+            savings = float(np.clip(rng.normal(0.12, 0.07), -0.05, 0.4))
+            reporting_params = OrderedDict(params)
+            for name in params:
+                if name.endswith("slope") or name.startswith("base"):
+                    reporting_params[name] *= 1 - savings
+            baseline = _predict(params, temps)
+            reporting = _predict(reporting_params, temps)
+            reporting_start = int((project.reporting_period_start - START).days)
+            sigma = rng.uniform(0.05, 0.25)
+            usage = np.where(days >= reporting_start, reporting, baseline) \
+                    * np.exp(rng.normal(0, sigma, self.n_days))
+            self._buffer_records(m.pk, usage)
+
+            if rng.rand() >= self.meter_run_fraction:
+                continue
+            annual_baseline = float(np.mean(baseline) * 365)
+            annual_reporting = float(np.mean(reporting) * 365)
+            meter_runs.append(MeterRun(project_id=m.project_id, consumption_metadata_id=m.pk,
+                    configuration=self.configuration,
+                    meter_type="DFLT_RES_" + m.fuel_type,
+                    annual_usage_baseline=annual_baseline,
+                    annual_usage_reporting=annual_reporting,
+                    annual_savings=annual_baseline - annual_reporting,
+                    gross_savings=float(np.sum((baseline - usage)[reporting_start:])),
+                    model_parameter_json_baseline=json.dumps(params),
+                    model_parameter_json_reporting=json.dumps(reporting_params),
+                    cvrmse_baseline=float(sigma * rng.uniform(0.9, 1.1)),
+                    cvrmse_reporting=float(sigma * rng.uniform(0.9, 1.1))))
+            outputs.append((m.pk, baseline, reporting))
+
+            completed = (days > reporting_start).astype(float)
+            for block_i in project_blocks[m.project_id]:
+                sums = self.block_sums
+                sums[(block_i, m.fuel_type, "baseline")] += baseline
+                sums[(block_i, m.fuel_type, "reporting")] += reporting
+                sums[(block_i, m.fuel_type, "actual")] += np.where(completed, reporting, baseline)
+                sums[(block_i, m.fuel_type, "n_completed")] += completed
+
+        MeterRun.objects.bulk_create(meter_runs, batch_size=10000)
+        self._count(MeterRun, len(meter_runs))
+        run_pks = dict(MeterRun.objects.filter(
+                consumption_metadata__in=[pk for pk, b, r in outputs])
+                .values_list('consumption_metadata_id', 'pk'))
+
+        def daily(index):
+            for metadata_id, baseline, reporting in outputs:
+                run_pk = run_pks[metadata_id]
+                for d, value in zip(self.dates, (baseline, reporting)[index].tolist()):
+                    yield (run_pk, value, d)
+
+        def monthly(index):
+            for metadata_id, baseline, reporting in outputs:
+                values = np.add.reduceat((baseline, reporting)[index], self.month_starts) \
+                        / self.month_lengths
+                for i, value in zip(self.month_starts, values.tolist()):
+                    yield (run_pks[metadata_id], value, self.dates[i])
+
+        columns = ('meter_run_id', 'value', 'date')
+        for model, rows in ((DailyUsageBaseline, daily(0)), (DailyUsageReporting, daily(1)),
+                (MonthlyAverageUsageBaseline, monthly(0)),
+                (MonthlyAverageUsageReporting, monthly(1))):
+            self._count(model, copy_rows(model, columns, rows))
+        return meter_runs
+
+    def _create_batch_items(self, projects, meter_runs):
+        rng = self.rng
+        n_runs = {}
+        for meter_run in meter_runs:
+            n_runs[meter_run.project_id] = n_runs.get(meter_run.project_id, 0) + 1
+        started = now()
+        items = []
+        for project in projects:
+            seconds = float(rng.lognormal(0.7, 0.5))
+            done = project.pk in n_runs
+            items.append(MeterBatchItem(batch=self.batch, project_id=project.pk,
+                    status="DONE" if done else "FAILED",
+                    error=None if done else "Synthetic failure",
+                    n_meter_runs=n_runs.get(project.pk, 0), attempts=1,
+                    started=started, finished=started + timedelta(seconds=seconds),
+                    seconds=seconds))
+        MeterBatchItem.objects.bulk_create(items, batch_size=10000)
+        self._count(MeterBatchItem, len(items))
+
+    def generate_chunk(self, first, n):
+        projects = self._create_projects(first, n)
+        self._create_attributes(projects)
+
+        membership = self.rng.rand(n, self.n_blocks) < self.block_fractions
+        Through = ProjectBlock.projects.through
+        Through.objects.bulk_create([
+            Through(projectblock_id=self.blocks[block_i].pk, project_id=projects[i].pk)
+            for i, block_i in zip(*np.nonzero(membership))], batch_size=10000)
+        self._count(Through, int(membership.sum()))
+        project_blocks = dict((project.pk, np.flatnonzero(membership[i]).tolist())
+                for i, project in enumerate(projects))
+
+        metadata = self._create_metadata(projects)
+        meter_runs = self._meter_output(metadata,
+                dict((project.pk, project) for project in projects), project_blocks)
+        self._flush_records()
+        self._create_batch_items(projects, meter_runs)
+
+    def finish(self):
+        fetched = now()
+        rows = []
+        for station in sorted(self._temps):
+            for d, temp in zip(self.dates, self._temps[station].tolist()):
+                rows.append((station, d, temp, fetched))
+        self._count(DailyTemperature, copy_rows(DailyTemperature,
+                ('station', 'date', 'temp_c', 'fetched'), rows))
+
+        summaries = 0
+        for block_i, block in enumerate(self.blocks):
+            for fuel_type in ("E", "NG"):
+                sums = dict((series, self.block_sums[(block_i, fuel_type, series)])
+                        for series in ("baseline", "reporting", "actual", "n_completed"))
+                if not sums["baseline"].any():
+                    continue
+                summary = FuelTypeSummary.objects.create(project_block=block, fuel_type=fuel_type)
+                summaries += 1
+                n_completed = sums["n_completed"].astype(int).tolist()
+                for model, series in ((DailyUsageSummaryBaseline, "baseline"),
+                        (DailyUsageSummaryReporting, "reporting")):
+                    self._count(model, copy_rows(model, ('fuel_type_summary_id', 'value', 'date'),
+                            ((summary.pk, v, d) for d, v in zip(self.dates, sums[series].tolist()))))
+                self._count(DailyUsageSummaryActual, copy_rows(DailyUsageSummaryActual,
+                        ('fuel_type_summary_id', 'value', 'date', 'n_projects'),
+                        ((summary.pk, v, d, c) for d, v, c in
+                            zip(self.dates, sums["actual"].tolist(), n_completed))))
+
+                month_dates = [self.dates[i] for i in self.month_starts]
+                monthly = dict((series, np.add.reduceat(sums[series], self.month_starts).tolist())
+                        for series in ("baseline", "reporting", "actual"))
+                for model, series in ((MonthlyUsageSummaryBaseline, "baseline"),
+                        (MonthlyUsageSummaryReporting, "reporting")):
+                    self._count(model, copy_rows(model, ('fuel_type_summary_id', 'value', 'date'),
+                            ((summary.pk, v, d) for d, v in zip(month_dates, monthly[series]))))
+                self._count(MonthlyUsageSummaryActual, copy_rows(MonthlyUsageSummaryActual,
+                        ('fuel_type_summary_id', 'value', 'date', 'n_projects'),
+                        ((summary.pk, v, d, n_completed[i]) for d, v, i in
+                            zip(month_dates, monthly["actual"], self.month_starts))))
+        self._count(FuelTypeSummary, summaries)
+
+        self.batch.finished = now()
+        self.batch.save()
+
+    def generate(self):
+        """ Write the whole portfolio, one transaction per chunk of
+        projects. Returns the row counts per model.
+        """
+        started = time.time()
+        with transaction.atomic():
+            self.setup()
+        for first in range(0, self.n_projects, self.chunk_size):
+            n = min(self.chunk_size, self.n_projects - first)
+            with transaction.atomic():
+                self.generate_chunk(first, n)
+            if self.report is not None:
+                self.report(first + n, self.n_projects, time.time() - started)
+        with transaction.atomic():
+            self.finish()
+        return self.counts
@@ -0,0 +1,125 @@
+"""Pruning of superseded meter runs.
+
+Only the latest MeterRun of each consumption metadata is read, but every
+run adds hundreds of daily and monthly usage rows. Runs outside the
+retention policy are deleted here in small batches, each its own short
+transaction, so the output tables are never locked for long.
+"""
+from __future__ import absolute_import
+
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.utils.timezone import now
+
+from . import ingest
+from .models import (ConsumptionMetadata, DailyUsageBaseline, DailyUsageReporting,
+        MeterRun, MonthlyAverageUsageBaseline, MonthlyAverageUsageReporting)
+
+DEFAULT_BATCH_SIZE = 100
+
+# deleted before their meter runs, so no cascade needs collecting
+OUTPUT_MODELS = (
+    DailyUsageBaseline,
+    DailyUsageReporting,
+    MonthlyAverageUsageBaseline,
+    MonthlyAverageUsageReporting,
+)
+
+# consumption metadata whose runs are examined at a time
+METADATA_CHUNK_SIZE = 1000
+
+
+def _metadata_pk_chunks(chunk_size=METADATA_CHUNK_SIZE):
+    last_pk = None
+    while True:
+        metadata = ConsumptionMetadata.objects.order_by('pk')
+        if last_pk is not None:
+            metadata = metadata.filter(pk__gt=last_pk)
+        pks = list(metadata.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def prunable_meter_run_pks(keep_last=1, max_age_days=None):
+    """ Yield lists of the pks of meter runs outside the retention policy:
+    runs that are not among the latest `keep_last` of their consumption
+    metadata and, if `max_age_days` is given, are older than that. The
+    latest run of each metadata is always kept.
+    """
+    keep_last = max(keep_last, 1)
+    cutoff = None
+    if max_age_days is not None:
+        cutoff = now() - timedelta(days=max_age_days)
+
+    for metadata_pks in _metadata_pk_chunks():
+        rows = MeterRun.objects.filter(consumption_metadata_id__in=metadata_pks) \
+                .order_by('consumption_metadata', '-added', '-pk') \
+                .values_list('pk', 'consumption_metadata_id', 'added')
+        newer = defaultdict(int)
+        prunable = []
+        for pk, metadata_pk, added in rows:
+            newer[metadata_pk] += 1
+            if newer[metadata_pk] <= keep_last:
+                continue
+            if cutoff is not None and added >= cutoff:
+                continue
+            prunable.append(pk)
+        if prunable:
+            yield prunable
+
+
+def _delete_where_in(cursor, connection, model, column, pks):
+    cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            connection.ops.quote_name(column),
+            ', '.join(['%s'] * len(pks))), pks)
+    return cursor.rowcount
+
+
+def delete_meter_runs(meter_run_pks):
+    """ Delete meter runs and their usage rows in one transaction, with one
+    statement per table. Returns the number of usage rows deleted.
+    """
+    connection = connections[MeterRun.objects.db]
+    n_output_rows = 0
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            for model in OUTPUT_MODELS:
+                n_output_rows += _delete_where_in(cursor, connection, model,
+                        'meter_run_id', meter_run_pks)
+            _delete_where_in(cursor, connection, MeterRun, 'id', meter_run_pks)
+    return n_output_rows
+
+
+def prune_meter_runs(keep_last=1, max_age_days=None, batch_size=DEFAULT_BATCH_SIZE,
+        sleep=0, dry_run=False, report=None):
+    """ Delete the meter runs outside the retention policy (see
+    `prunable_meter_run_pks`), `batch_size` runs per transaction, pausing
+    `sleep` seconds between batches to leave room for other writers.
+    `report` is called with the running summary after each batch. With
+    `dry_run`, runs are counted but not deleted.
+    """
+    summary = {
+        "n_meter_runs": 0,
+        "n_output_rows": 0,
+        "n_batches": 0,
+        "dry_run": dry_run,
+    }
+    started = time.time()
+    for prunable in prunable_meter_run_pks(keep_last, max_age_days):
+        for meter_run_pks in ingest.batches(prunable, batch_size):
+            if summary["n_batches"] and sleep and not dry_run:
+                time.sleep(sleep)
+            if not dry_run:
+                summary["n_output_rows"] += delete_meter_runs(meter_run_pks)
+            summary["n_meter_runs"] += len(meter_run_pks)
+            summary["n_batches"] += 1
+            if report is not None:
+                report(summary)
+    summary["seconds"] = time.time() - started
+    return summary
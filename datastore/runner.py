@@ -0,0 +1,502 @@
+"""Run the meter for many projects, optionally across a pool of worker
+processes, or as one of any number of queue workers sharing a MeterBatch.
+"""
+from __future__ import absolute_import, print_function
+
+import gc
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import socket
+import sys
+import time
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+
+from django import db
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.query import QuerySet
+from django.utils.timezone import now
+
+from . import ingest
+from .models import MeterBatch, MeterBatchItem, MeterRun, Project
+from .weather import get_cache, resolve_project_stations
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectTimeout(Exception):
+    pass
+
+
+# MeterBatchItem status for each run_project result status; LOST results,
+# whose item went to another worker, are not recorded
+ITEM_STATUSES = {
+    "SUCCESS": "DONE",
+    "SKIPPED": "DONE",
+    "TIMEOUT": "FAILED",
+    "FAILURE": "FAILED",
+}
+
+RESULT_STATUSES = ("SUCCESS", "SKIPPED", "TIMEOUT", "FAILURE", "LOST")
+
+DEFAULT_LEASE_SECONDS = 3600
+
+# projects loaded at a time when walking the whole portfolio
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MAX_ATTEMPTS = 3
+
+# time a worker's lease outlasts the timeouts of the projects it claimed
+LEASE_MARGIN_SECONDS = 60
+
+# claims the next pending (or abandoned) items of a batch, skipping rows
+# other workers hold locks on rather than waiting for them
+CLAIM_SQL = '''
+  UPDATE {table}
+  SET status = 'RUNNING', worker = %s, lease_expires = %s, attempts = attempts + 1
+  WHERE id IN (
+    SELECT id FROM {table}
+    WHERE batch_id = %s AND attempts < %s
+      AND (status = 'PENDING' OR (status = 'RUNNING' AND lease_expires < %s))
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING project_id
+'''
+
+
+def _raise_timeout(signum, frame):
+    raise ProjectTimeout()
+
+
+def _init_worker():
+    # leave keyboard interrupts to the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def iter_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield the objects of `queryset` in lists of at most `chunk_size`,
+    in pk order, with one query (plus any prefetches) per chunk. Unlike
+    iterating the queryset, or `.iterator()`, which still fetches every row
+    from the database driver, only one chunk is held in memory at a time.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def _project_chunks(projects, chunk_size):
+    if isinstance(projects, QuerySet):
+        return iter_chunks(projects, chunk_size)
+    return ingest.batches(projects, chunk_size)
+
+
+def stale_project_pks(projects, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Pks of the projects whose input fingerprint differs from that of
+    their latest meter run, or which have never been run. Projects are
+    fingerprinted `chunk_size` at a time.
+    """
+    stale = []
+    for chunk in _project_chunks(projects, chunk_size):
+        fingerprints = Project.input_fingerprints(chunk)
+        latest = {}
+        for project_pk, fingerprint in MeterRun.objects \
+                .filter(project__in=chunk).order_by('project', '-added') \
+                .values_list('project_id', 'input_fingerprint'):
+            latest.setdefault(project_pk, fingerprint)
+        stale.extend(project.pk for project in chunk
+                if latest.get(project.pk) != fingerprints[project.pk])
+    return stale
+
+
+def station_groups(project_pks, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Group projects by resolved weather station, as a list of
+    (station, [project pk, ...]) ordered by station. Projects whose station
+    cannot be resolved are grouped last under None.
+    """
+    groups = defaultdict(list)
+    for pks in ingest.batches(sorted(project_pks), chunk_size):
+        projects = list(Project.objects.filter(pk__in=pks).order_by('pk'))
+        stations = resolve_project_stations(projects)
+        for project in projects:
+            groups[stations[project.pk]].append(project.pk)
+    return sorted(groups.items(), key=lambda group: (group[0] is None, group[0]))
+
+
+def peak_rss_mb():
+    """ Peak resident set size, in MB, of this process and of its
+    terminated child processes (the largest of them, not their sum).
+    """
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def release_memory():
+    """ Free what one project's meter run left behind: reference cycles
+    (pandas and eemeter objects have plenty) and, with DEBUG, the query log.
+    """
+    db.reset_queries()
+    gc.collect()
+
+
+def _checkpoint(batch_pk, project_pk, lease=None, **fields):
+    """ Update the project's batch item, only while `lease`, a (worker,
+    lease_expires) claim, still holds it if given. Returns whether the
+    item was updated.
+    """
+    items = MeterBatchItem.objects.filter(batch_id=batch_pk, project_id=project_pk)
+    if lease is not None:
+        worker, lease_expires = lease
+        items = items.filter(worker=worker, lease_expires=lease_expires)
+    try:
+        return items.update(**fields) > 0
+    except db.DatabaseError:
+        # an interrupted run may have left the connection unusable
+        db.connection.close()
+        return items.update(**fields) > 0
+
+
+def run_project(project_pk, timeout=None, run_kwargs=None, weather_source=None,
+        batch_pk=None, weather_normal_source=None, lease=None):
+    """ Run the meter for one project, returning a result dict. Errors and
+    timeouts are caught and reported rather than raised. With `batch_pk`,
+    progress is checkpointed on the project's MeterBatchItem; with a queue
+    worker's `lease` (see `_checkpoint`), only while the lease holds it.
+    The result is LOST if the item was reclaimed by another worker.
+    """
+    result = {
+        "project": project_pk,
+        "status": "SUCCESS",
+        "n_meter_runs": 0,
+        "error": None,
+    }
+    if batch_pk is not None:
+        if not _checkpoint(batch_pk, project_pk, lease, status='RUNNING', started=now()) \
+                and lease is not None:
+            result.update(status="LOST", seconds=0.0,
+                    error="Lease lost before the project started")
+            return result
+    started = time.time()
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    try:
+        project = Project.objects.get(pk=project_pk)
+        result["project_id"] = project.project_id
+        meter_runs = project.run_meter(weather_source=weather_source,
+                weather_normal_source=weather_normal_source, **(run_kwargs or {}))
+        if meter_runs is None:
+            result["status"] = "SKIPPED"
+        else:
+            result["n_meter_runs"] = len(meter_runs)
+    except ProjectTimeout:
+        result["status"] = "TIMEOUT"
+        result["error"] = "Timed out after {}s".format(timeout)
+    except Exception:
+        result["status"] = "FAILURE"
+        result["error"] = traceback.format_exc()
+    finally:
+        if timeout:
+            signal.alarm(0)
+        # drop this frame's references so release_memory can free them
+        project = meter_runs = None
+    result["seconds"] = time.time() - started
+    release_memory()
+
+    if batch_pk is not None:
+        if not _checkpoint(batch_pk, project_pk, lease,
+                status=ITEM_STATUSES[result["status"]], error=result["error"],
+                n_meter_runs=result["n_meter_runs"], finished=now(),
+                seconds=result["seconds"], lease_expires=None) and lease is not None:
+            result["status"] = "LOST"
+            result["error"] = "Lease lost before the result was recorded"
+    return result
+
+
+def run_station_group(station, project_pks, timeout=None, run_kwargs=None,
+        batch_pk=None):
+    """ Run the meter for projects sharing a weather station against one
+    in-memory temperature series and one set of normals, loaded once for
+    the whole group.
+    """
+    weather_source = weather_normal_source = None
+    if station is not None:
+        weather_source = get_cache().weather_source(station)
+        weather_normal_source = get_cache().weather_normal_source(station)
+    return [run_project(pk, timeout, run_kwargs, weather_source, batch_pk,
+                weather_normal_source)
+            for pk in project_pks]
+
+
+def _run_project_in_worker(args):
+    result = run_project(*args)
+    if result["status"] in ("TIMEOUT", "FAILURE"):
+        # the connection may have been interrupted mid-query; start afresh
+        db.connection.close()
+    return result
+
+
+def _run_station_group_in_worker(args):
+    results = run_station_group(*args)
+    if any(result["status"] in ("TIMEOUT", "FAILURE") for result in results):
+        db.connection.close()
+    return results
+
+
+def _flatten(groups):
+    for results in groups:
+        for result in results:
+            yield result
+
+
+def format_result(result, i, n):
+    position = "{}/{}".format(i, n) if n is not None else str(i)
+    line = "[{}] project {} {} in {:.1f}s".format(position,
+            result.get("project_id", result["project"]), result["status"],
+            result["seconds"])
+    if result["error"]:
+        line = "{}\n{}".format(line, result["error"].rstrip())
+    return line
+
+
+def print_result(result, i, n):
+    print(format_result(result, i, n))
+
+
+def run_projects(project_pks, workers=1, timeout=None, run_kwargs=None, report=None,
+        by_station=False, batch_pk=None, max_tasks_per_child=None):
+    """ Run the meter for each project, with `workers` processes if more
+    than one. With `by_station`, projects are grouped by weather station
+    and each group runs in one process against shared temperatures.
+    Workers are replaced after `max_tasks_per_child` projects (or groups)
+    if given, returning their memory to the system.
+    `report` is called with (result, i, n) as each project finishes.
+    Returns a summary with status counts, throughput and peak memory.
+    """
+    project_pks = list(project_pks)
+    n = len(project_pks)
+    counts = dict((status, 0) for status in RESULT_STATUSES)
+    started = time.time()
+
+    if by_station:
+        groups = station_groups(project_pks)
+        n = sum(len(pks) for station, pks in groups)
+        logger.info("Running %d projects on %d weather stations", n, len(groups))
+        args = [(station, pks, timeout, run_kwargs, batch_pk) for station, pks in groups]
+        run, run_in_worker = run_station_group, _run_station_group_in_worker
+    else:
+        args = [(pk, timeout, run_kwargs, None, batch_pk) for pk in project_pks]
+        run, run_in_worker = run_project, _run_project_in_worker
+
+    def collect(results):
+        if by_station:
+            results = _flatten(results)
+        for i, result in enumerate(results, 1):
+            counts[result["status"]] += 1
+            if result["status"] in ("TIMEOUT", "FAILURE"):
+                logger.error(format_result(result, i, n))
+            if report is not None:
+                report(result, i, n)
+
+    if workers > 1:
+        # forked workers must not share the parent's database connections;
+        # close them so each process opens its own
+        for connection in db.connections.all():
+            connection.close()
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                maxtasksperchild=max_tasks_per_child)
+        try:
+            collect(pool.imap_unordered(run_in_worker, args))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        collect(run(*a) for a in args)
+
+    return _summary(n, workers, time.time() - started, counts)
+
+
+def _summary(n, workers, seconds, counts):
+    summary = {
+        "n_projects": n,
+        "workers": workers,
+        "seconds": seconds,
+        "projects_per_minute": n / seconds * 60 if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    summary.update(("n_" + status.lower(), count) for status, count in counts.items())
+    return summary
+
+
+def _finish_if_done(batch):
+    """ Mark the batch finished if no items are left, returning whether
+    this call did so (only one of several concurrent callers will).
+    """
+    progress = batch.progress()
+    if progress['PENDING'] or progress['RUNNING']:
+        return False
+    finished = now()
+    if not MeterBatch.objects.filter(pk=batch.pk, finished__isnull=True) \
+            .update(finished=finished):
+        return False
+    batch.finished = finished
+    return True
+
+
+def run_batch(batch, retry_failed=False, **kwargs):
+    """ Run the unfinished projects of a MeterBatch (see `run_projects`
+    for keyword arguments), marking it finished once none are left.
+    """
+    summary = run_projects(batch.unfinished_project_pks(retry_failed),
+            batch_pk=batch.pk, **kwargs)
+    _finish_if_done(batch)
+    summary["batch"] = batch.pk
+    return summary
+
+
+def default_worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def claim_batch_items(batch_pk, worker, n=1, lease_seconds=DEFAULT_LEASE_SECONDS,
+        max_attempts=DEFAULT_MAX_ATTEMPTS, lease_expires=None):
+    """ Claim up to `n` items of a batch for `worker`, returning their
+    project pks. Pending items are claimed first come first served, as are
+    running items whose lease has expired (their worker is presumed dead).
+    Items abandoned `max_attempts` times are marked failed instead. The
+    lease expires `lease_seconds` from now, or at `lease_expires`.
+
+    On PostgreSQL (9.5+) concurrent claims skip each other's locked rows,
+    so no item is handed to two live workers.
+    """
+    claimed_at = now()
+    if lease_expires is None:
+        lease_expires = claimed_at + timedelta(seconds=lease_seconds)
+    items = MeterBatchItem.objects.filter(batch_id=batch_pk)
+    items.filter(status='RUNNING', lease_expires__lt=claimed_at,
+            attempts__gte=max_attempts).update(status='FAILED', lease_expires=None,
+            finished=claimed_at,
+            error="Abandoned by its worker {} times".format(max_attempts))
+
+    connection = db.connections[MeterBatchItem.objects.db]
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(CLAIM_SQL.format(table=MeterBatchItem._meta.db_table),
+                        [worker, lease_expires, batch_pk, max_attempts, claimed_at, n])
+                return sorted(row[0] for row in cursor.fetchall())
+
+        # elsewhere, rely on the database serializing writers
+        claimable = items.select_for_update() \
+                .filter(attempts__lt=max_attempts) \
+                .filter(Q(status='PENDING') |
+                        Q(status='RUNNING', lease_expires__lt=claimed_at)) \
+                .order_by('id')
+        ids, project_pks = [], []
+        for item_id, project_pk in claimable.values_list('id', 'project_id')[:n]:
+            ids.append(item_id)
+            project_pks.append(project_pk)
+        MeterBatchItem.objects.filter(id__in=ids).update(status='RUNNING',
+                worker=worker, lease_expires=lease_expires, attempts=F('attempts') + 1)
+        return sorted(project_pks)
+
+
+def work_batch(batch_pk, worker=None, claim_size=1, lease_seconds=DEFAULT_LEASE_SECONDS,
+        max_attempts=DEFAULT_MAX_ATTEMPTS, timeout=None, run_kwargs=None, report=None):
+    """ Claim and run items of a batch until none are left to claim. Any
+    number of workers, on any number of hosts, may work the same batch.
+    `report` is called with (result, i, None) as each project finishes.
+    Returns a summary as for `run_projects`.
+
+    A live worker must not lose its items to another, so projects always
+    time out before their lease expires: without a `timeout`, each gets
+    an equal share of the lease, less a minute. Should a worker still lose
+    one (e.g. while suspended), the item is left to its new worker and the
+    result counted as LOST.
+    """
+    worker = worker or default_worker_name()
+    if not timeout:
+        timeout = max((lease_seconds - LEASE_MARGIN_SECONDS) // claim_size, 1)
+    if lease_seconds < timeout * claim_size + LEASE_MARGIN_SECONDS:
+        lease_seconds = timeout * claim_size + LEASE_MARGIN_SECONDS
+    counts = dict((status, 0) for status in RESULT_STATUSES)
+    started = time.time()
+    i = 0
+    while True:
+        lease_expires = now() + timedelta(seconds=lease_seconds)
+        project_pks = claim_batch_items(batch_pk, worker, claim_size,
+                max_attempts=max_attempts, lease_expires=lease_expires)
+        if not project_pks:
+            break
+        for project_pk in project_pks:
+            result = run_project(project_pk, timeout, run_kwargs, batch_pk=batch_pk,
+                    lease=(worker, lease_expires))
+            i += 1
+            counts[result["status"]] += 1
+            if result["status"] in ("TIMEOUT", "FAILURE", "LOST"):
+                logger.error(format_result(result, i, None))
+            if report is not None:
+                report(result, i, None)
+
+    finished_batch = _finish_if_done(MeterBatch.objects.get(pk=batch_pk))
+    summary = _summary(i, 1, time.time() - started, counts)
+    summary["batch"] = batch_pk
+    summary["worker"] = worker
+    summary["finished_batch"] = finished_batch
+    return summary
+
+
+def _work_batch_in_worker(kwargs):
+    kwargs["worker"] = default_worker_name()
+    return work_batch(report=print_result, **kwargs)
+
+
+def work_batch_in_processes(batch_pk, processes, **kwargs):
+    """ Run `processes` queue workers on this host (see `work_batch` for
+    keyword arguments), returning their combined summary.
+    """
+    started = time.time()
+    for connection in db.connections.all():
+        connection.close()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        summaries = pool.map(_work_batch_in_worker,
+                [dict(kwargs, batch_pk=batch_pk) for _ in range(processes)])
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    counts = dict((status, sum(summary["n_" + status.lower()] for summary in summaries))
+            for status in RESULT_STATUSES)
+    summary = _summary(sum(summary["n_projects"] for summary in summaries), processes,
+            time.time() - started, counts)
+    summary["batch"] = batch_pk
+    summary["finished_batch"] = any(s["finished_batch"] for s in summaries)
+    return summary
+
+
+def format_summary(summary):
+    lost = ", {n_lost} lost to other workers" if summary.get("n_lost") else ""
+    return ("Ran {n_projects} projects with {workers} worker(s) in {seconds:.1f}s "
+            "({projects_per_minute:.1f} projects/min): {n_success} succeeded, "
+            "{n_skipped} skipped, {n_failure} failed, {n_timeout} timed out" + lost + "; "
+            "peak memory {peak_rss_mb:.0f} MB.").format(
+                    **dict(summary, projects_per_minute=summary["projects_per_minute"] or 0))
\ No newline at end of file
@@ -8,6 +8,9 @@ from rest_framework_bulk import (
 from rest_framework.relations import PKOnlyObject
 from rest_framework.fields import SkipField
 
+from django.db import transaction
+
+from . import ingest
 from . import models
 
 
@@ -95,6 +98,7 @@ class MeterRunSerializer(serializers.ModelSerializer):
             'model_parameter_json_reporting',
             'cvrmse_baseline',
             'cvrmse_reporting',
+            'timings_json',
             'dailyusagebaseline_set',
             'dailyusagereporting_set',
             'fuel_type',
@@ -199,17 +203,82 @@ class ConsumptionMetadataSerializer(serializers.ModelSerializer):
         fields = ('id', 'fuel_type', 'energy_unit', 'records', 'project')
 
     def create(self, validated_data):
+        """ Create the metadata and load its records, keeping the load's
+        report as `ingest_report`.
+        """
         records_data = validated_data.pop('records')
 
-        consumption_metadata = \
-                models.ConsumptionMetadata.objects.create(**validated_data)
+        with transaction.atomic():
+            consumption_metadata = \
+                    models.ConsumptionMetadata.objects.create(**validated_data)
 
-        for record_data in records_data:
-            models.ConsumptionRecord.objects.create(metadata=consumption_metadata,
-                    **record_data)
+            self.ingest_report = ingest.load_records(
+                    (dict(record_data, metadata=consumption_metadata)
+                        for record_data in records_data), on_conflict='update')
 
         return consumption_metadata
 
+    def to_representation(self, instance):
+        ret = super(ConsumptionMetadataSerializer, self).to_representation(instance)
+        if instance.packed:
+            ret['records'] = ConsumptionRecordSerializer(
+                    instance.series.records(), many=True).data
+        return ret
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    error_list = serializers.ReadOnlyField()
+
+    class Meta:
+        model = models.IngestionJob
+        fields = (
+            'id',
+            'kind',
+            'status',
+            'n_records',
+            'n_written',
+            'error_list',
+            'started',
+            'finished',
+            'seconds',
+            'records_per_second',
+        )
+
+
+class MeterBatchSerializer(serializers.ModelSerializer):
+    progress = serializers.ReadOnlyField()
+
+    class Meta:
+        model = models.MeterBatch
+        fields = (
+            'id',
+            'command',
+            'project_block',
+            'progress',
+            'added',
+            'updated',
+            'finished',
+        )
+
+
+class MeterBatchItemSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.MeterBatchItem
+        fields = (
+            'id',
+            'batch',
+            'project',
+            'status',
+            'error',
+            'n_meter_runs',
+            'worker',
+            'attempts',
+            'started',
+            'finished',
+            'seconds',
+        )
+
 
 class MonthlyUsageSummaryBaselineSerializer(serializers.ModelSerializer):
 
@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+
+import json
+import logging
+
+from django.utils.timezone import now
+
+from celery import chord, group
+
+from oeem_energy_datastore.celery import app
+
+from . import ingest
+from . import models
+from . import runner
+from . import serializers
+
+logger = logging.getLogger(__name__)
+
+
+def _save_progress(job):
+    job.save(update_fields=['n_records', 'n_written'])
+
+
+def _ingest_records(job, data):
+    serializer = serializers.ConsumptionRecordSerializer(data=data, many=True)
+    serializer.child.validators = []
+    if not serializer.is_valid():
+        return [{"index": i, "errors": e}
+                for i, e in enumerate(serializer.errors) if e]
+
+    # each batch commits on its own, so pollers see the job's progress
+    def progress(report):
+        job.n_records = report["n_records"]
+        job.n_written = report["n_written"]
+        _save_progress(job)
+
+    ingest.load_records(serializer.validated_data, on_conflict=job.on_conflict,
+            progress=progress)
+    return []
+
+
+def _ingest_metadata(job, data):
+    if isinstance(data, dict):
+        data = [data]
+
+    errors = []
+    for i, item in enumerate(data):
+        serializer = serializers.ConsumptionMetadataSerializer(data=item)
+        if not serializer.is_valid():
+            errors.append({"index": i, "errors": serializer.errors})
+            continue
+        serializer.save()
+        job.n_records += serializer.ingest_report["n_records"]
+        job.n_written += serializer.ingest_report["n_written"]
+        _save_progress(job)
+    return errors
+
+
+@app.task
+def run_ingestion_job(job_id):
+    """ Write the payload of an IngestionJob, recording rows written,
+    errors and timing on the job. The counts are saved after each batch
+    of records (or each metadata), so they can be polled while the job
+    runs; batches written before a failure stay committed.
+    """
+    job = models.IngestionJob.objects.get(pk=job_id)
+    job.status = 'RUNNING'
+    job.started = now()
+    job.save()
+
+    try:
+        data = json.loads(job.payload)
+        if job.kind == 'RECORDS':
+            errors = _ingest_records(job, data)
+        else:
+            errors = _ingest_metadata(job, data)
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job_id)
+        errors = [{"errors": str(e)}]
+
+    job.status = 'FAILURE' if errors else 'SUCCESS'
+    job.errors = json.dumps(errors) if errors else None
+    job.payload = None
+    job.finished = now()
+    job.save()
+    logger.info("Ingestion job %s wrote %d of %d records in %.3fs",
+            job_id, job.n_written, job.n_records, job.seconds)
+    return job.status
+
+
+@app.task
+def run_project_meter(project_pk, run_kwargs=None, timeout=None):
+    """ Run the meter for one project, giving up after `timeout` seconds.
+    Returns a result dict as from `runner.run_project`; failures and
+    timeouts are reported there rather than raised.
+    """
+    result = runner.run_project(project_pk, timeout=timeout, run_kwargs=run_kwargs)
+    if result["status"] == "FAILURE":
+        logger.error(runner.format_result(result, 1, 1))
+    return result
+
+
+@app.task
+def compute_block_summary(results, block_pk):
+    """ Chord callback: recompute the block's summary timeseries once all
+    of its projects have been metered.
+    """
+    project_block = models.ProjectBlock.objects.get(pk=block_pk)
+    project_block.compute_summary_timeseries()
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info("Computed summary timeseries for block %s after %d projects: %s",
+            block_pk, len(results), counts)
+    return counts
+
+
+@app.task
+def run_block_meters(block_pk, run_kwargs=None, timeout=None, stale_only=False):
+    """ Fan a ProjectBlock out into one `run_project_meter` task per project
+    (only those with changed inputs if `stale_only`), each timing out after
+    `timeout` seconds, with `compute_block_summary` as the chord callback.
+    """
+    project_block = models.ProjectBlock.objects.get(pk=block_pk)
+    projects = project_block.projects.order_by('pk')
+    if stale_only:
+        project_pks = runner.stale_project_pks(projects)
+    else:
+        project_pks = list(projects.values_list('pk', flat=True))
+    if not project_pks:
+        return compute_block_summary.delay([], block_pk).id
+    header = group([run_project_meter.s(pk, run_kwargs, timeout) for pk in project_pks])
+    return chord(header)(compute_block_summary.s(block_pk)).id
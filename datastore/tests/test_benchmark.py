@@ -0,0 +1,32 @@
+from django.test import TestCase
+
+from .. import benchmark
+
+import os
+import unittest
+
+import pytest
+
+
+@pytest.mark.benchmark
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"),
+        "set RUN_BENCHMARKS=1 to run the meter pipeline benchmarks")
+class MeterBenchmarkTestCase(TestCase):
+
+    def check_results(self, results, n_projects):
+        assert results["run_meter"]["n"] == n_projects
+        assert results["run_meter"]["n_meter_runs"] == n_projects
+        assert "evaluate" in results["run_meter"]["stages"]
+        assert results["compute_summary_timeseries"]["counts"]["meter_runs"] == n_projects
+        for name, read in results["api"].items():
+            assert read["status_code"] == 200, name
+
+    def test_daily(self):
+        results = benchmark.run_benchmark(n_projects=2, years=2, frequency="daily", repeat=1)
+        assert results["generate"]["n_records"] == 2 * 730
+        self.check_results(results, 2)
+
+    def test_hourly(self):
+        results = benchmark.run_benchmark(n_projects=1, years=1, frequency="hourly", repeat=1)
+        assert results["generate"]["n_records"] == 365 * 24
+        self.check_results(results, 1)
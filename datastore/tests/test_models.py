@@ -1,13 +1,27 @@
-from django.test import TestCase
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 
+from .. import ingest
 from .. import models
+from .. import partitions
+from .. import portfolio
+from .. import retention
+from .. import runner
+from .. import tasks
+from .. import weather
 
 import eemeter.consumption
 import eemeter.project
 import eemeter.evaluation
+import eemeter.location
 
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+import numpy as np
 import pytz
 
 class ProjectOwnerTestCase(TestCase):
@@ -93,6 +107,83 @@ class ProjectTestCase(TestCase):
         self.empty_project.run_meter()
         self.complete_project.run_meter()
 
+    def test_input_fingerprint(self):
+        consumption_metadata = models.ConsumptionMetadata.objects.create(
+            project=self.complete_project,
+            fuel_type="E",
+            energy_unit="KWH",
+        )
+        fingerprint = self.complete_project.input_fingerprint()
+        assert len(fingerprint) == 40
+        assert fingerprint != self.empty_project.input_fingerprint()
+        assert runner.stale_project_pks([self.complete_project]) == [self.complete_project.pk]
+
+        models.MeterRun.objects.create(
+            project=self.complete_project,
+            consumption_metadata=consumption_metadata,
+            input_fingerprint=fingerprint,
+        )
+        assert runner.stale_project_pks([self.complete_project]) == []
+
+        models.ConsumptionRecord.objects.create(
+            metadata=consumption_metadata,
+            start=datetime(2011, 1, 1, tzinfo=pytz.UTC),
+            value=1.0,
+            estimated=False,
+        )
+        assert self.complete_project.input_fingerprint() != fingerprint
+        assert runner.stale_project_pks([self.complete_project]) == [self.complete_project.pk]
+
+    def test_run_projects(self):
+        results = []
+        summary = runner.run_projects([self.empty_project.pk, 0],
+                report=lambda result, i, n: results.append(result))
+        assert [r["status"] for r in results] == ["SKIPPED", "FAILURE"]
+        assert "DoesNotExist" in results[1]["error"]
+        assert summary["n_projects"] == 2
+        assert summary["n_skipped"] == 1
+        assert summary["n_failure"] == 1
+        assert summary["projects_per_minute"] > 0
+        assert summary["peak_rss_mb"] > 0
+
+    def test_iter_chunks(self):
+        projects = models.Project.objects.filter(
+                pk__in=[self.empty_project.pk, self.complete_project.pk])
+        chunks = list(runner.iter_chunks(projects, chunk_size=1))
+        assert [[p.pk for p in chunk] for chunk in chunks] == \
+                [[pk] for pk in sorted([self.empty_project.pk, self.complete_project.pk])]
+
+        assert sorted(runner.stale_project_pks(projects, chunk_size=1)) == \
+                sorted([self.empty_project.pk, self.complete_project.pk])
+
+    def test_resolve_weather_station(self):
+        station = self.complete_project.resolve_weather_station()
+        assert station == eemeter.location.Location(lat_lng=(0, 0)).station
+
+        project = models.Project.objects.get(pk=self.complete_project.pk)
+        assert project.resolved_weather_station == station
+        assert project.eemeter_location().station == station
+
+        assert self.empty_project.resolve_weather_station() is None
+        project = models.Project.objects.get(pk=self.empty_project.pk)
+        assert project.resolved_weather_station == ""
+
+        project.zipcode = "91104"
+        project.save()
+        assert project.resolved_weather_station is None
+        assert project.resolve_weather_station() == eemeter.location.Location(zipcode="91104").station
+
+    def test_station_groups(self):
+        groups = runner.station_groups([self.empty_project.pk, self.complete_project.pk])
+        assert len(groups) == 2
+        assert groups[0] == (self.complete_project.resolve_weather_station(),
+                [self.complete_project.pk])
+        assert groups[1] == (None, [self.empty_project.pk])
+
+        summary = runner.run_projects([self.empty_project.pk], by_station=True)
+        assert summary["n_projects"] == 1
+        assert summary["n_skipped"] == 1
+
     def test_recent_meter_runs(self):
         meter_runs = self.empty_project.recent_meter_runs()
         assert meter_runs == []
@@ -218,6 +309,40 @@ class ProjectBlockTestCase(TestCase):
     def test_run_meters(self):
         self.project_block.run_meters()
 
+    def test_meter_tasks(self):
+        results = [tasks.run_project_meter(project.pk)
+                for project in self.project_block.projects.all()]
+        assert [r["status"] for r in results] == ["SKIPPED", "SKIPPED"]
+
+        counts = tasks.compute_block_summary(results, self.project_block.pk)
+        assert counts == {"SKIPPED": 2}
+
+        with self.assertRaises(CommandError):
+            call_command('runmeterblock', self.project_block.pk, celery=True, by_station=True)
+
+    @override_settings(DEBUG=True)
+    def test_compute_summary_timeseries(self):
+        project = self.project_block.projects.get(project_id="PROJECTID_4")
+        project.reporting_period_start = datetime(2012, 1, 2, tzinfo=pytz.UTC)
+        project.save()
+        consumption_metadata = models.ConsumptionMetadata.objects.create(
+            project=project, fuel_type="E", energy_unit="KWH")
+        meter_run = models.MeterRun.objects.create(project=project,
+            consumption_metadata=consumption_metadata)
+        output = models.MeterRunOutput(meter_run)
+        output.set_usage(datetime(2012, 1, 1), 3, [1., 2., 3.], [4., 5., 6.])
+        output.save()
+
+        timings = self.project_block.compute_summary_timeseries()
+        assert list(timings["stages"]) == ["load_meter_runs", "load_usage", "aggregate", "save"]
+        assert timings["counts"] == {"projects": 2, "meter_runs": 1, "usage_rows": 6,
+                "summary_rows": 12}
+        assert timings["stages"]["save"]["queries"] > 0
+
+        summary = self.project_block.recent_summaries()[0]
+        assert [d.value for d in summary.dailyusagesummaryactual_set.order_by('date')] == \
+                [1., 2., 6.]
+
     def test_recent_summaries(self):
         recent_summaries = self.project_block.recent_summaries()
 
@@ -251,6 +376,83 @@ class ConsumptionMetadataTestCase(TestCase):
         consumption_data = self.consumptionmetadata.eemeter_consumption_data()
         assert isinstance(consumption_data, eemeter.consumption.ConsumptionData)
 
+    def test_eemeter_consumption_data_values(self):
+        for day, value in [(3, 2.5), (2, None), (1, 1.5)]:
+            models.ConsumptionRecord.objects.create(
+                metadata=self.consumptionmetadata,
+                start=datetime(2011, 1, day, tzinfo=pytz.UTC),
+                value=value,
+                estimated=day == 2,
+            )
+
+        consumption_data = self.consumptionmetadata.eemeter_consumption_data()
+        assert consumption_data.data.index[0] == datetime(2011, 1, 1, tzinfo=pytz.UTC)
+        assert consumption_data.data.values[0] == 1.5
+        assert np.isnan(consumption_data.data.values[1])
+        # the last record only marks the end of the one before it
+        assert np.isnan(consumption_data.data.values[2])
+        assert list(consumption_data.estimated.values) == [False, True, False]
+
+        records = [r.eemeter_record() for r in self.consumptionmetadata.records.all()]
+        expected = eemeter.consumption.ConsumptionData(records, fuel_type="electricity",
+                unit_name="kWh", record_type="arbitrary_start")
+        assert list(consumption_data.data.index) == list(expected.data.index)
+        np.testing.assert_array_equal(consumption_data.data.values,
+                expected.data.values.astype(float))
+
+    def test_pack_unpack(self):
+        for day, value in [(2, None), (1, 1.5)]:
+            models.ConsumptionRecord.objects.create(
+                metadata=self.consumptionmetadata,
+                start=datetime(2011, 1, day, tzinfo=pytz.UTC),
+                value=value,
+                estimated=day == 2,
+            )
+
+        series = self.consumptionmetadata.pack()
+        assert series.n_records == 2
+        assert self.consumptionmetadata.records.count() == 0
+
+        start, value, estimated = self.consumptionmetadata.record_arrays()
+        assert list(value[:1]) == [1.5]
+        assert list(estimated) == [False, True]
+
+        records = series.records()
+        assert records[0].start == datetime(2011, 1, 1, tzinfo=pytz.UTC)
+        assert records[1].value is None
+
+        self.consumptionmetadata.unpack()
+        assert not self.consumptionmetadata.packed
+        assert self.consumptionmetadata.records.count() == 2
+
+    def test_load_batch_packed_on_conflict(self):
+        self.consumptionmetadata.pack()
+        record = {
+            "metadata_id": self.consumptionmetadata.pk,
+            "start": datetime(2011, 1, 1, tzinfo=pytz.UTC),
+            "value": 1.0,
+            "estimated": False,
+        }
+        assert ingest.load_batch([record])["n_written"] == 1
+        assert ingest.load_batch([dict(record, value=2.0)], on_conflict='ignore')["n_written"] == 0
+        assert ingest.load_batch([dict(record, value=3.0)], on_conflict='update')["n_written"] == 1
+        series = models.ConsumptionSeries.objects.get(metadata=self.consumptionmetadata)
+        assert list(series.to_arrays()[1]) == [3.0]
+
+
+    def test_load_records_progress(self):
+        records = [{
+            "metadata_id": self.consumptionmetadata.pk,
+            "start": datetime(2011, 1, day, tzinfo=pytz.UTC),
+            "value": float(day),
+            "estimated": False,
+        } for day in range(1, 6)]
+        written = []
+        report = ingest.load_records(records, batch_size=2,
+                progress=lambda report: written.append(report["n_written"]))
+        assert written == [2, 4, 5]
+        assert report["n_written"] == 5
+
 
 class ConsumptionRecordTestCase(TestCase):
 
@@ -326,3 +528,316 @@ class MeterRunTestCase(TestCase):
 
     def test_valid_meter_run(self):
         assert self.meterrun.valid_meter_run() == False
+
+    def test_configuration(self):
+        assert self.meterrun.serialization is None
+
+        configuration = models.MeterConfiguration.for_serialization(u"meter: {}")
+        assert configuration.hash == models.MeterConfiguration.hash_serialization(u"meter: {}")
+        assert models.MeterConfiguration.for_serialization(u"meter: {}") == configuration
+        assert models.MeterConfiguration.objects.count() == 1
+
+        self.meterrun.configuration = configuration
+        self.meterrun.save()
+        assert models.MeterRun.objects.get(pk=self.meterrun.pk).serialization == u"meter: {}"
+
+    def test_output_set_usage(self):
+        start = datetime(2011, 1, 30, 6, tzinfo=pytz.UTC)
+        baseline = np.arange(40, dtype=float)
+        baseline[[3, 5]] = np.nan
+        reporting = baseline / 2
+
+        output = models.MeterRunOutput(self.meterrun)
+        output.set_usage(start, 35, baseline, reporting)
+        assert output.daily_dates[0] == start
+        assert output.daily_dates[-1] == datetime(2011, 3, 5, 6, tzinfo=pytz.UTC)
+        assert len(output.daily_baseline) == 35
+        assert output.monthly_dates == [
+            datetime(2011, 1, 1), datetime(2011, 2, 1), datetime(2011, 3, 1)]
+        assert output.monthly_baseline[0] == 0.5
+        assert output.monthly_baseline[1] == np.nanmean(list(baseline[2:30]))
+        assert output.monthly_reporting[2] == np.nanmean(list(reporting[30:35]))
+
+        output.set_usage(start, 0, baseline, reporting)
+        assert output.daily_dates == []
+        assert output.monthly_dates == [datetime(2011, 1, 1)]
+        assert output.monthly_baseline == [0]
+
+    def test_output_save(self):
+        output = models.MeterRunOutput(models.MeterRun(
+            project=self.meterrun.project,
+            consumption_metadata=self.meterrun.consumption_metadata,
+        ))
+        output.set_usage(datetime(2011, 1, 30, 12, tzinfo=pytz.UTC), 5,
+                np.arange(5, dtype=float), np.arange(5, dtype=float) / 2)
+        output.save()
+
+        meter_run = output.meter_run
+        assert meter_run.pk is not None
+        daily_baseline = list(meter_run.dailyusagebaseline_set.order_by('date'))
+        assert [d.date for d in daily_baseline] == [date(2011, 1, 30), date(2011, 1, 31),
+                date(2011, 2, 1), date(2011, 2, 2), date(2011, 2, 3)]
+        assert [d.value for d in daily_baseline] == [0.0, 1.0, 2.0, 3.0, 4.0]
+        assert [d.value for d in meter_run.dailyusagereporting_set.order_by('date')] == \
+                [0.0, 0.5, 1.0, 1.5, 2.0]
+
+        monthly_baseline = list(meter_run.monthlyaverageusagebaseline_set.order_by('date'))
+        assert [m.date for m in monthly_baseline] == [date(2011, 1, 1), date(2011, 2, 1)]
+        assert [m.value for m in monthly_baseline] == [0.5, 3.0]
+        assert [m.value for m in meter_run.monthlyaverageusagereporting_set.order_by('date')] == \
+                [0.25, 1.5]
+
+    def test_prune_meter_runs(self):
+        meter_runs = [self.meterrun]
+        for days_ago in (20, 10, 0):
+            output = models.MeterRunOutput(models.MeterRun(
+                project=self.meterrun.project,
+                consumption_metadata=self.meterrun.consumption_metadata,
+            ))
+            output.set_usage(datetime(2011, 1, 1, tzinfo=pytz.UTC), 40,
+                    np.ones(40), np.ones(40))
+            output.save()
+            models.MeterRun.objects.filter(pk=output.meter_run.pk).update(
+                    added=datetime.now(pytz.UTC) - timedelta(days=days_ago))
+            meter_runs.append(output.meter_run)
+        models.MeterRun.objects.filter(pk=self.meterrun.pk).update(
+                added=datetime.now(pytz.UTC) - timedelta(days=30))
+
+        summary = retention.prune_meter_runs(keep_last=1, max_age_days=15,
+                dry_run=True)
+        assert summary["n_meter_runs"] == 2
+        assert models.MeterRun.objects.count() == 4
+
+        summary = retention.prune_meter_runs(keep_last=1, max_age_days=15,
+                batch_size=1)
+        assert summary["n_meter_runs"] == 2
+        assert summary["n_batches"] == 2
+        assert summary["n_output_rows"] == 2 * (2 * 40 + 2 * 2)
+        assert sorted(models.MeterRun.objects.values_list('pk', flat=True)) == \
+                sorted(meter_run.pk for meter_run in meter_runs[2:])
+        assert not models.DailyUsageBaseline.objects \
+                .filter(meter_run_id=meter_runs[1].pk).exists()
+
+        retention.prune_meter_runs(keep_last=1)
+        assert list(models.MeterRun.objects.values_list('pk', flat=True)) == \
+                [meter_runs[-1].pk]
+
+
+class MeterConfigurationMigrationTestCase(TransactionTestCase):
+
+    migrate_from = [('datastore', '0026_project_resolved_weather_station')]
+    migrate_to = [('datastore', '0029_remove_meterrun_serialization')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_collapse_serializations(self):
+        old_apps = self.migrate(self.migrate_from)
+        user = old_apps.get_model('auth', 'User').objects.create(username='migration')
+        owner = old_apps.get_model('datastore', 'ProjectOwner').objects.create(user_id=user.pk)
+        project = old_apps.get_model('datastore', 'Project').objects.create(
+                project_owner=owner, project_id="MIGRATION")
+        metadata = old_apps.get_model('datastore', 'ConsumptionMetadata').objects.create(
+                project=project, fuel_type="E", energy_unit="KWH")
+        MeterRun = old_apps.get_model('datastore', 'MeterRun')
+        for serialization in ("a", "a", "b", None):
+            MeterRun.objects.create(project=project, consumption_metadata=metadata,
+                    serialization=serialization)
+
+        # the data step runs between two schema changes to the populated
+        # meter run table
+        new_apps = self.migrate(self.migrate_to)
+        MeterConfiguration = new_apps.get_model('datastore', 'MeterConfiguration')
+        assert sorted(MeterConfiguration.objects.values_list('serialization', flat=True)) == \
+                ["a", "b"]
+        MeterRun = new_apps.get_model('datastore', 'MeterRun')
+        assert list(MeterRun.objects.order_by('pk')
+                .values_list('configuration__serialization', flat=True)) == ["a", "a", "b", None]
+
+        old_apps = self.migrate(self.migrate_from)
+        MeterRun = old_apps.get_model('datastore', 'MeterRun')
+        assert list(MeterRun.objects.order_by('pk')
+                .values_list('serialization', flat=True)) == ["a", "a", "b", None]
+
+
+class PartitionsTestCase(TestCase):
+
+    def test_partition_bounds(self):
+        bounds = partitions.partition_bounds("month", date(2011, 11, 15), date(2012, 1, 1))
+        assert bounds == [
+            ("datastore_consumptionrecord_p2011_11", date(2011, 11, 1), date(2011, 12, 1)),
+            ("datastore_consumptionrecord_p2011_12", date(2011, 12, 1), date(2012, 1, 1)),
+            ("datastore_consumptionrecord_p2012_01", date(2012, 1, 1), date(2012, 2, 1)),
+        ]
+
+        bounds = partitions.partition_bounds("year", date(2011, 11, 15), date(2012, 1, 1))
+        assert [b[0] for b in bounds] == [
+            "datastore_consumptionrecord_p2011",
+            "datastore_consumptionrecord_p2012",
+        ]
+
+        with self.assertRaises(ValueError):
+            partitions.partition_bounds("week", date(2011, 1, 1), date(2012, 1, 1))
+
+    def test_partitionconsumption_requires_interval(self):
+        with self.assertRaises(CommandError):
+            call_command('partitionconsumption', interval=None)
+
+    def test_partition_table(self):
+        if not partitions.supported(connection):
+            self.skipTest("Partitioning needs PostgreSQL 11 or later.")
+        user = User.objects.create_user('partitions', 'p@example.com', 'password')
+        project = models.Project.objects.create(project_owner=user.projectowner,
+                project_id="PARTITIONS")
+        metadata = models.ConsumptionMetadata.objects.create(project=project,
+                fuel_type="E", energy_unit="KWH")
+        for month in (1, 3):
+            models.ConsumptionRecord.objects.create(metadata=metadata,
+                    start=datetime(2011, month, 1, tzinfo=pytz.UTC), value=1.0,
+                    estimated=False)
+
+        with connection.cursor() as cursor:
+            names = partitions.constraint_names(cursor)
+        partitions.partition_table(connection, "month")
+        with connection.cursor() as cursor:
+            assert partitions.is_partitioned(cursor)
+            assert partitions.constraint_names(cursor) == names
+            assert [p[0] for p in partitions.existing_partitions(cursor)] == [
+                "datastore_consumptionrecord_p2011_01",
+                "datastore_consumptionrecord_p2011_02",
+                "datastore_consumptionrecord_p2011_03",
+            ]
+        assert metadata.records.count() == 2
+
+        created = partitions.create_partitions(connection, "month",
+                date(2011, 3, 1), date(2011, 4, 1))
+        assert created == ["datastore_consumptionrecord_p2011_04"]
+        with connection.cursor() as cursor:
+            assert partitions.partition_interval(cursor) == "month"
+        with self.assertRaises(ValueError):
+            partitions.create_partitions(connection, "year", date(2011, 3, 1), date(2012, 1, 1))
+        with self.assertRaises(CommandError):
+            call_command('partitionconsumption', interval="year")
+        models.ConsumptionRecord.objects.create(metadata=metadata,
+                start=datetime(2011, 4, 2, tzinfo=pytz.UTC), value=2.0, estimated=False)
+
+        detached = partitions.detach_partitions(connection, date(2011, 2, 1), drop=True)
+        assert detached == ["datastore_consumptionrecord_p2011_01"]
+        assert metadata.records.count() == 2
+
+        partitions.unpartition_table(connection)
+        with connection.cursor() as cursor:
+            assert not partitions.is_partitioned(cursor)
+            assert partitions.constraint_names(cursor) == names
+        assert sorted(r.value for r in metadata.records.all()) == [1.0, 2.0]
+
+
+class TemperatureCacheTestCase(TestCase):
+
+    def test_temperatures(self):
+        cache = weather.TemperatureCache(fetch=weather.synthetic_fetch(seed=1))
+        temps = cache.temperatures("722880", [2011, 2012])
+        assert len(temps) == 731
+        assert cache.stats() == {"hits": 0, "misses": 2, "hit_rate": 0.0}
+
+        temps_2012 = cache.temperatures("722880", [2012])
+        assert cache.hits == 1
+        np.testing.assert_allclose(temps_2012.values, temps.loc["2012"].values)
+
+        source = cache.weather_source("722880")
+        period = eemeter.evaluation.Period(datetime(2011, 1, 1), datetime(2011, 1, 11))
+        daily = source.daily_temperatures(period, "degC")
+        np.testing.assert_allclose(daily, temps[:10].values)
+        assert cache.hits == 2
+
+    def test_expiry(self):
+        year = date.today().year
+        cache = weather.TemperatureCache(fetch=weather.synthetic_fetch(),
+                max_age=timedelta(0))
+        cache.temperatures("722880", [year])
+        cache.temperatures("722880", [year])
+        assert cache.misses == 2
+        assert models.DailyTemperature.objects.filter(station="722880").count() in (365, 366)
+
+    def test_late_observations(self):
+        cache = weather.TemperatureCache(fetch=weather.synthetic_fetch(),
+                max_age=timedelta(days=7))
+        cache.temperatures("722880", [2011])
+
+        # fetched days after the year ended: December may still be missing
+        models.DailyTemperature.objects.update(
+                fetched=datetime(2012, 1, 3, tzinfo=pytz.UTC))
+        cache.temperatures("722880", [2011])
+        assert cache.misses == 2
+
+        models.DailyTemperature.objects.update(
+                fetched=datetime(2012, 1, 8, tzinfo=pytz.UTC))
+        cache.temperatures("722880", [2011])
+        assert cache.hits == 1
+
+    def test_synthetic_weather_source(self):
+        cache = weather.TemperatureCache(fetch=weather.synthetic_fetch(seed=1))
+        period = eemeter.evaluation.Period(datetime(2011, 12, 1), datetime(2012, 2, 1))
+        expected = cache.weather_source("722880").daily_temperatures(period, "degC")
+        models.DailyTemperature.objects.all().delete()
+
+        source = weather.SyntheticWeatherSource("722880", seed=1)
+        np.testing.assert_allclose(source.daily_temperatures(period, "degC"), expected)
+        assert not models.DailyTemperature.objects.exists()
+
+    def test_synthetic_weather_normal_source(self):
+        # the tests' cache serves synthetic normals, never TMY3 from NREL
+        source = weather.TemperatureCache().weather_normal_source("722880")
+        assert isinstance(source, weather.SyntheticWeatherNormalSource)
+
+        normals = source.annual_daily_temperatures("degC")[0]
+        assert len(normals) == 365
+        assert not np.isnan(normals).any()
+
+        # any year reads the same typical year, as with TMY3
+        for start in (datetime(2013, 1, 1), datetime(2012, 1, 1, tzinfo=pytz.UTC)):
+            period = eemeter.evaluation.Period(start, start.replace(year=start.year + 1))
+            assert source.hdd(period, "degC", 18.0) > 0
+        period = eemeter.evaluation.Period(datetime(2013, 12, 30), datetime(2014, 1, 2))
+        np.testing.assert_allclose(source.daily_temperatures(period, "degC"),
+                np.concatenate([normals[-2:], normals[:1]]))
+
+class PortfolioTestCase(TestCase):
+
+    def test_generate(self):
+        generator = portfolio.PortfolioGenerator(6, years=1, n_owners=2, n_blocks=2,
+                n_stations=3, meter_run_fraction=1.0, packed_fraction=0.5,
+                chunk_size=4, seed=1)
+        generator.block_fractions = np.array([1.0, 0.5])
+        counts = generator.generate()
+        assert counts["Project"] == 6
+
+        # every model is filled, consumption as records or packed series
+        for model in apps.get_app_config('datastore').get_models():
+            if model not in (models.ConsumptionRecord, models.ConsumptionSeries):
+                assert model.objects.exists(), model.__name__
+        n_metadata = models.ConsumptionMetadata.objects.count()
+        n_unpacked = models.ConsumptionRecord.objects.values('metadata').distinct().count()
+        assert models.ConsumptionSeries.objects.count() + n_unpacked == n_metadata
+        assert models.MeterRun.objects.count() == n_metadata
+
+        # generated weather never shares a station with real projects
+        assert all(station.startswith(portfolio.STATION_PREFIX) for station in
+                models.DailyTemperature.objects.values_list('station', flat=True).distinct())
+
+        # generated block summaries agree with those computed from the runs
+        block = generator.blocks[0]
+        block.compute_summary_timeseries()
+        generated, computed = block.fueltypesummary_set.filter(fuel_type="E").order_by('pk')
+        for attr in ("dailyusagesummaryactual_set", "monthlyusagesummarybaseline_set"):
+            np.testing.assert_allclose(
+                    [s.value for s in getattr(generated, attr).order_by('date')],
+                    [s.value for s in getattr(computed, attr).order_by('date')])
+        assert [s.n_projects for s in generated.dailyusagesummaryactual_set.order_by('date')] == \
+                [s.n_projects for s in computed.dailyusagesummaryactual_set.order_by('date')]
@@ -1,8 +1,13 @@
 from django.test import Client, TestCase, RequestFactory
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.utils.timezone import now, timedelta, make_aware
 
 from .. import models
+from .. import runner
+from .. import tasks
+
+from oeem_energy_datastore.celery import app as celery_app
 
 from oauth2_provider.models import AccessToken
 from oauth2_provider.models import get_application_model
@@ -14,9 +19,12 @@ from eemeter.evaluation import Period
 
 import json
 from datetime import datetime
+from io import BytesIO
+import numpy as np
 from numpy.testing import assert_allclose
 
 import pytest
+import pytz
 
 ApplicationModel = get_application_model()
 
@@ -115,6 +123,229 @@ class ConsumptionMetadataAPITestCase(OAuthTestCase):
         assert response.data['project'] == None
         assert response.data['records'] == []
 
+class ConsumptionRecordAPITestCase(OAuthTestCase):
+
+    def setUp(self):
+        super(ConsumptionRecordAPITestCase, self).setUp()
+        self.consumption_metadata = models.ConsumptionMetadata.objects.create(
+                fuel_type="E", energy_unit="KWH")
+
+    def test_consumption_record_bulk_load(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        records = [{
+            "metadata": self.consumption_metadata.id,
+            "start": "2014-01-0{}T00:00:00+00:00".format(day),
+            "value": float(day),
+            "estimated": False,
+        } for day in range(1, 4)]
+
+        data = json.dumps(records)
+        response = self.client.post('/api/v1/consumption_records/bulk_load/', data, content_type="application/json", **auth_headers)
+        assert response.status_code == 201
+        assert response.data["n_records"] == 3
+        assert len(response.data["batches"]) == 1
+
+        values = [r.value for r in self.consumption_metadata.records.all()]
+        assert values == [1.0, 2.0, 3.0]
+
+    def test_consumption_record_create_packed(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+        self.consumption_metadata.pack()
+        other_metadata = models.ConsumptionMetadata.objects.create(
+                fuel_type="E", energy_unit="KWH")
+        models.ConsumptionRecord.objects.create(metadata=other_metadata,
+                start=datetime(2014, 1, 1, tzinfo=pytz.UTC), value=5.0, estimated=False)
+
+        records = [{
+            "metadata": self.consumption_metadata.id,
+            "start": "2014-01-0{}T00:00:00+00:00".format(day),
+            "value": float(day),
+            "estimated": False,
+        } for day in range(1, 3)]
+        response = self.client.post('/api/v1/consumption_records/', json.dumps(records),
+                content_type="application/json", **auth_headers)
+        assert response.status_code == 201
+        assert not self.consumption_metadata.records.exists()
+        series = models.ConsumptionSeries.objects.get(metadata=self.consumption_metadata)
+        assert list(series.to_arrays()[1]) == [1.0, 2.0]
+
+        # once a series is packed, listing needs a metadata filter
+        response = self.client.get('/api/v1/consumption_records/', **auth_headers)
+        assert response.status_code == 400
+
+        # packed and row records are filtered alike
+        for metadata, query, values in [
+                (self.consumption_metadata.id, "", [1.0, 2.0]),
+                (self.consumption_metadata.id, "&start=2014-01-01T00:00:00Z", [1.0]),
+                (self.consumption_metadata.id, "&start_after=2014-01-02T00:00:00Z", [2.0]),
+                (self.consumption_metadata.id, "&start_before=2014-01-02T00:00:00Z", [1.0]),
+                (self.consumption_metadata.id, "&start=not-a-date", []),
+                (other_metadata.id, "", [5.0]),
+                (other_metadata.id, "&start_after=2014-01-02T00:00:00Z", []),
+                (other_metadata.id, "&start_before=2014-01-02T00:00:00Z", [5.0]),
+                (other_metadata.id, "&start=not-a-date", [])]:
+            response = self.client.get('/api/v1/consumption_records/?metadata={}{}'.format(
+                    metadata, query), **auth_headers)
+            assert response.status_code == 200
+            assert [r["value"] for r in response.data] == values, query
+
+    def test_consumption_record_bulk_load_on_conflict(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        def post(value, on_conflict=None):
+            records = [{
+                "metadata": self.consumption_metadata.id,
+                "start": "2014-01-01T00:00:00+00:00",
+                "value": value,
+                "estimated": False,
+            }]
+            url = '/api/v1/consumption_records/bulk_load/'
+            if on_conflict is not None:
+                url += '?on_conflict={}'.format(on_conflict)
+            return self.client.post(url, json.dumps(records), content_type="application/json", **auth_headers)
+
+        assert post(1.0).status_code == 201
+        assert post(2.0).status_code == 409
+
+        response = post(2.0, "ignore")
+        assert response.status_code == 201
+        assert response.data["n_written"] == 0
+        assert self.consumption_metadata.records.get().value == 1.0
+
+        response = post(3.0, "update")
+        assert response.status_code == 201
+        assert response.data["n_written"] == 1
+        assert self.consumption_metadata.records.get().value == 3.0
+
+        assert post(3.0, "bogus").status_code == 400
+
+    def test_consumption_record_upload_npz(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        buf = BytesIO()
+        np.savez(buf,
+                start=np.array(['2014-01-01', '2014-01-02'], dtype='datetime64[s]'),
+                value=np.array([1.0, np.nan]),
+                estimated=np.array([False, True]))
+
+        url = '/api/v1/consumption_records/upload_npz/?metadata={}'.format(self.consumption_metadata.id)
+        response = self.client.post(url, buf.getvalue(), content_type="application/x-npz", **auth_headers)
+        assert response.status_code == 201
+        assert response.data["n_records"] == 2
+
+        records = self.consumption_metadata.records.all()
+        assert records[0].start == datetime(2014, 1, 1, tzinfo=pytz.UTC)
+        assert records[0].value == 1.0
+        assert records[1].value is None
+        assert records[1].estimated
+
+        response = self.client.post('/api/v1/consumption_records/upload_npz/', buf.getvalue(), content_type="application/x-npz", **auth_headers)
+        assert response.status_code == 400
+
+    def test_ingestion_job(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        records = [{
+            "metadata": self.consumption_metadata.id,
+            "start": "2014-01-01T00:00:00+00:00",
+            "value": 1.0,
+            "estimated": False,
+        }, {
+            "metadata": self.consumption_metadata.id,
+            "start": "not-a-date",
+            "value": 1.0,
+            "estimated": False,
+        }]
+        job = models.IngestionJob.objects.create(kind="RECORDS",
+                payload=json.dumps(records[:1]))
+        assert tasks.run_ingestion_job(job.id) == "SUCCESS"
+
+        response = self.client.get('/api/v1/ingestion_jobs/{}/'.format(job.id), **auth_headers)
+        assert response.status_code == 200
+        assert response.data["status"] == "SUCCESS"
+        assert response.data["n_written"] == 1
+        assert response.data["error_list"] == []
+        assert self.consumption_metadata.records.count() == 1
+
+        job = models.IngestionJob.objects.create(kind="RECORDS",
+                payload=json.dumps(records))
+        assert tasks.run_ingestion_job(job.id) == "FAILURE"
+        job.refresh_from_db()
+        assert job.error_list()[0]["index"] == 1
+        assert job.payload is None
+
+    def test_ingestion_job_async(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+        models.ConsumptionRecord.objects.create(metadata=self.consumption_metadata,
+                start=datetime(2014, 1, 1, tzinfo=pytz.UTC), value=1.0, estimated=False)
+        record = {
+            "metadata": self.consumption_metadata.id,
+            "start": "2014-01-01T00:00:00+00:00",
+            "value": 2.0,
+            "estimated": False,
+        }
+
+        always_eager = celery_app.conf.CELERY_ALWAYS_EAGER
+        celery_app.conf.CELERY_ALWAYS_EAGER = True
+        try:
+            response = self.client.post('/api/v1/consumption_records/?async=True&on_conflict=ignore',
+                    json.dumps([record]), content_type="application/json", **auth_headers)
+        finally:
+            celery_app.conf.CELERY_ALWAYS_EAGER = always_eager
+        assert response.status_code == 202
+
+        job = models.IngestionJob.objects.get(pk=response.data["id"])
+        assert job.kind == "RECORDS"
+        assert job.on_conflict == "ignore"
+        assert job.status == "SUCCESS"
+        assert job.n_written == 0
+        assert self.consumption_metadata.records.get().value == 1.0
+
+    def test_consumption_record_upload_csv(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        data = "\n".join([
+            "start,value,estimated",
+            "2014-01-01T00:00:00+00:00,1.0,false",
+            "not-a-date,2.0,false",
+            "2014-01-03T00:00:00+00:00,,true",
+        ])
+        url = '/api/v1/consumption_records/upload_csv/?metadata={}&chunk_size=2'.format(self.consumption_metadata.id)
+        response = self.client.post(url, data, content_type="text/csv", **auth_headers)
+        assert response.status_code == 201
+        assert response.data["n_records"] == 2
+        assert response.data["n_rejected"] == 1
+        assert len(response.data["chunks"]) == 2
+        assert response.data["rejected"][0]["line"] == 3
+
+        records = self.consumption_metadata.records.all()
+        assert [r.estimated for r in records] == [False, True]
+        assert records[1].value is None
+
+        # rejected rows are reported by the line they end on, even when a
+        # quoted field spans lines, and non-ASCII text is decoded
+        data = u"\n".join([
+            u"start,value,estimated",
+            u"2014-01-05T00:00:00+00:00,1.0,false",
+            u'2014-01-06T00:00:00+00:00,2.0,"multi',
+            u'line"',
+            u"2014-01-07T00:00:00+00:00,3.0,f\u00e4lse",
+            u"2014-01-08T00:00:00+00:00,4.0,true",
+        ]).encode('utf-8')
+        response = self.client.post(url, data, content_type="text/csv; charset=utf-8",
+                **auth_headers)
+        assert response.status_code == 201
+        assert response.data["n_records"] == 2
+        assert [r["line"] for r in response.data["rejected"]] == [4, 5]
+
+        for chunk_size in (0, -1):
+            url = '/api/v1/consumption_records/upload_csv/?metadata={}&chunk_size={}'.format(
+                    self.consumption_metadata.id, chunk_size)
+            response = self.client.post(url, data, content_type="text/csv", **auth_headers)
+            assert response.status_code == 400
+
+
 class ProjectAPITestCase(OAuthTestCase):
 
     def test_project_create_read(self):
@@ -250,3 +481,118 @@ class MeterRunAPITestCase(OAuthTestCase):
             assert type(response.data["annual_savings"]) == float
             assert type(response.data["cvrmse_baseline"]) == float
             assert type(response.data["cvrmse_reporting"]) == float
+
+    def test_project_evaluate(self):
+        """
+        Tests evaluating the meter over other periods without saving.
+        """
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+        cache.clear()
+        n_meter_runs = models.MeterRun.objects.count()
+        n_daily = models.DailyUsageBaseline.objects.count()
+
+        url = '/api/v1/projects/{}/evaluate/?start_date=2011-01-01&end_date=2015-01-01' \
+                '&reporting_period_start={}'.format(self.project.id,
+                (self.project.reporting_period_start + timedelta(days=30)).date().isoformat())
+        response = self.client.get(url, **auth_headers)
+        assert response.status_code == 200
+        assert response.data["cached"] is False
+        assert response.data["parameters"]["reporting_period_start"].startswith(
+                (self.project.reporting_period_start + timedelta(days=30)).date().isoformat())
+        assert len(response.data["results"]) == 2
+        for result in response.data["results"]:
+            assert len(result["daily"]) == 1461
+            assert type(result["annual_usage_baseline"]) == float
+
+        assert models.MeterRun.objects.count() == n_meter_runs
+        assert models.DailyUsageBaseline.objects.count() == n_daily
+
+        response = self.client.get(url, **auth_headers)
+        assert response.data["cached"] is True
+
+        response = self.client.get('/api/v1/projects/{}/evaluate/?baseline_period_end=soon'
+                .format(self.project.id), **auth_headers)
+        assert response.status_code == 400
+
+
+class MeterBatchAPITestCase(OAuthTestCase):
+
+    def test_meter_batch_read(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        projects = [models.Project.objects.create(project_owner=self.project_owner,
+                project_id="BATCH_PROJECT_{}".format(i)) for i in range(2)]
+        batch = models.MeterBatch.start([p.pk for p in projects], "runmeter")
+
+        response = self.client.get('/api/v1/meter_batches/{}/'.format(batch.id), **auth_headers)
+        assert response.status_code == 200
+        assert response.data["progress"] == {"PENDING": 2, "RUNNING": 0, "DONE": 0, "FAILED": 0}
+        assert response.data["finished"] is None
+
+        # as if the first project were interrupted mid-run
+        batch.items.filter(project=projects[0]).update(status="RUNNING")
+        batch.items.filter(project=projects[1]).update(status="DONE")
+        assert batch.unfinished_project_pks() == [projects[0].pk]
+
+        summary = runner.run_batch(batch)
+        assert summary["n_projects"] == 1
+
+        response = self.client.get('/api/v1/meter_batches/{}/'.format(batch.id), **auth_headers)
+        assert response.data["progress"]["DONE"] == 2
+        assert response.data["finished"] is not None
+
+        response = self.client.get('/api/v1/meter_batch_items/?batch={}&status=DONE'.format(batch.id), **auth_headers)
+        assert response.status_code == 200
+        assert len(response.data) == 2
+        item = [i for i in response.data if i["project"] == projects[0].pk][0]
+        assert item["error"] is None
+        assert item["seconds"] is not None
+
+
+    def test_meter_batch_queue(self):
+        auth_headers = { "Authorization": "Bearer " + "tokstr" }
+
+        projects = [models.Project.objects.create(project_owner=self.project_owner,
+                project_id="QUEUE_PROJECT_{}".format(i)) for i in range(3)]
+        batch = models.MeterBatch.start([p.pk for p in projects], "runmeter")
+
+        # workers claim distinct items, in order
+        assert runner.claim_batch_items(batch.pk, "worker-a") == [projects[0].pk]
+        assert runner.claim_batch_items(batch.pk, "worker-b", n=5) == \
+                [projects[1].pk, projects[2].pk]
+        assert runner.claim_batch_items(batch.pk, "worker-c") == []
+
+        # worker-a dies; its lease expires and its item is reclaimed
+        batch.items.filter(worker="worker-a").update(lease_expires=now() - timedelta(seconds=1))
+        assert runner.claim_batch_items(batch.pk, "worker-c") == [projects[0].pk]
+        item = batch.items.get(project=projects[0])
+        assert item.worker == "worker-c"
+        assert item.attempts == 2
+
+        # abandoned too often, it is failed rather than handed out again
+        batch.items.filter(worker="worker-c").update(lease_expires=now() - timedelta(seconds=1))
+        assert runner.claim_batch_items(batch.pk, "worker-d", max_attempts=2) == []
+        assert batch.items.get(project=projects[0]).status == "FAILED"
+
+        batch.items.update(status="PENDING", lease_expires=None, attempts=0)
+        summary = runner.work_batch(batch.pk, worker="worker-e")
+        assert summary["n_projects"] == 3
+        assert summary["finished_batch"] is True
+        assert runner.work_batch(batch.pk)["finished_batch"] is False
+
+        # a worker whose lease was reclaimed leaves the item to its new worker
+        batch.items.update(status="PENDING", lease_expires=None, attempts=0)
+        lease_expires = now() + timedelta(seconds=60)
+        assert runner.claim_batch_items(batch.pk, "worker-f",
+                lease_expires=lease_expires) == [projects[0].pk]
+        batch.items.filter(project=projects[0]).update(worker="worker-g")
+        result = runner.run_project(projects[0].pk, batch_pk=batch.pk,
+                lease=("worker-f", lease_expires))
+        assert result["status"] == "LOST"
+        item = batch.items.get(project=projects[0])
+        assert (item.worker, item.status) == ("worker-g", "RUNNING")
+        batch.items.update(status="DONE", lease_expires=None)
+
+        response = self.client.get('/api/v1/meter_batches/{}/'.format(batch.id), **auth_headers)
+        assert response.data["progress"]["DONE"] == 3
+        assert response.data["finished"] is not None
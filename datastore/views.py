@@ -1,20 +1,37 @@
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissionsOrAnonReadOnly
-from rest_framework.decorators import list_route
+from rest_framework.decorators import detail_route, list_route
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework import filters
 from rest_framework_bulk import BulkModelViewSet
 from rest_framework.parsers import BaseParser
+from rest_framework.exceptions import ParseError, ValidationError
+
+import codecs
+import csv
+import json
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, time
+
+import numpy as np
 
 import django_filters
 
 from oauth2_provider.ext.rest_framework import TokenHasReadWriteScope
 
+from . import evaluation
+from . import ingest
 from . import models
 from . import serializers
+from . import tasks
 from collections import defaultdict
 
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 if settings.DEBUG:
     default_permissions_classes = [DjangoModelPermissionsOrAnonReadOnly]
@@ -31,6 +48,39 @@ def projects_filter(queryset, value):
         project_set = set()
     return queryset.filter(project__in=project_set)
 
+def query_datetime(request, name):
+    """
+    Parse an optional datetime (or date, as midnight UTC) query parameter,
+    raising a ValidationError if it is malformed.
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed = parse_date(value)
+            if parsed is not None:
+                parsed = datetime.combine(parsed, time())
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: "Must be an ISO 8601 date or datetime."})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+def queue_ingestion_job(kind, data, on_conflict=None):
+    """
+    Store an upload as an IngestionJob, queue it on the Celery workers
+    and respond right away with the job for status polling.
+    """
+    job = models.IngestionJob.objects.create(kind=kind,
+            payload=json.dumps(data), on_conflict=on_conflict)
+    tasks.run_ingestion_job.delay(job.pk)
+    serializer = serializers.IngestionJobSerializer(job)
+    return Response(serializer.data, status=202)
+
 
 class ProjectOwnerViewSet(viewsets.ModelViewSet):
 
@@ -39,6 +89,85 @@ class ProjectOwnerViewSet(viewsets.ModelViewSet):
     queryset = models.ProjectOwner.objects.all().order_by('pk')
 
 
+def _decode_csv_value(value):
+    if isinstance(value, list):
+        return [_decode_csv_value(v) for v in value]
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class CSVDictReader(object):
+    """
+    A `csv.DictReader` over a byte stream in `encoding` that yields text
+    rows. On Python 2, where the csv module only reads bytes, lines are
+    re-encoded to UTF-8 for parsing and each field decoded after.
+    """
+
+    def __init__(self, stream, encoding):
+        lines = codecs.getreader(encoding)(stream)
+        if six.PY2:
+            lines = (line.encode('utf-8') for line in lines)
+        self.reader = csv.DictReader(lines)
+
+    @property
+    def line_num(self):
+        return self.reader.line_num
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.reader)
+        if six.PY2:
+            row = dict((_decode_csv_value(key), _decode_csv_value(value))
+                    for key, value in row.items())
+        return row
+
+    next = __next__
+
+
+class ConsumptionRecordCSVParser(BaseParser):
+    """
+    Parses a `text/csv` body lazily into an iterator of row dicts, so that
+    large uploads are never read into memory all at once.
+    """
+
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return CSVDictReader(stream, encoding)
+
+
+class ConsumptionSeriesNPZParser(BaseParser):
+    """
+    Parses a NumPy `.npz` bundle of equal-length `start` (epoch seconds or
+    datetime64), `value`, and optionally `estimated` and `metadata` arrays
+    into a dict of arrays. Large bodies are spooled to a temporary file
+    rather than read into memory, so only the decoded arrays are held.
+    """
+
+    media_type = 'application/x-npz'
+
+    # bytes of the body kept in memory before spooling to disk
+    max_memory_size = 10 * 1024 * 1024
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        with tempfile.SpooledTemporaryFile(max_size=self.max_memory_size) as body:
+            shutil.copyfileobj(stream, body)
+            body.seek(0)
+            try:
+                bundle = np.load(body, allow_pickle=False)
+                try:
+                    return dict((key, bundle[key]) for key in bundle.files)
+                finally:
+                    bundle.close()
+            except (IOError, ValueError, zipfile.BadZipfile) as e:
+                raise ParseError('NPZ parse error - {}'.format(e))
+
+
 class ConsumptionMetadataFilter(django_filters.FilterSet):
 
     fuel_type = django_filters.MultipleChoiceFilter(
@@ -67,14 +196,21 @@ class ConsumptionMetadataViewSet(viewsets.ModelViewSet):
         else:
             return serializers.ConsumptionMetadataSerializer
 
+    def create(self, request, *args, **kwargs):
+        if request.query_params.get("async", "False") == "True":
+            return queue_ingestion_job('METADATA', request.data)
+        return super(ConsumptionMetadataViewSet, self).create(request, *args, **kwargs)
+
 
 class ConsumptionRecordFilter(django_filters.FilterSet):
 
     start = django_filters.IsoDateTimeFilter()
+    start_after = django_filters.IsoDateTimeFilter(name='start', lookup_type='gte')
+    start_before = django_filters.IsoDateTimeFilter(name='start', lookup_type='lt')
 
     class Meta:
         model = models.ConsumptionRecord
-        fields = ['metadata', 'start']
+        fields = ['metadata', 'start', 'start_after', 'start_before']
 
 
 class ConsumptionRecordViewSet(BulkModelViewSet):
@@ -87,6 +223,189 @@ class ConsumptionRecordViewSet(BulkModelViewSet):
     def get_serializer_class(self):
         return serializers.ConsumptionRecordSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        Records of packed metadata are served from their ConsumptionSeries,
+        with the same `start`, `start_after` and `start_before` filters as
+        row records. Once any series is packed, a `metadata` filter is
+        required, so that no request reads every series at once. Packed
+        records have no id, so they cannot be retrieved, updated or deleted
+        one by one.
+        """
+        if 'metadata' not in request.query_params:
+            if models.ConsumptionSeries.objects.exists():
+                raise ValidationError({"metadata": "Required to list records "
+                        "once consumption series are packed."})
+            return super(ConsumptionRecordViewSet, self).list(request, *args, **kwargs)
+
+        try:
+            metadata_id = int(request.query_params['metadata'])
+        except ValueError:
+            metadata_id = None
+        series = None
+        if metadata_id is not None:
+            series = models.ConsumptionSeries.objects.filter(
+                    metadata_id=metadata_id).first()
+        if series is None:
+            return super(ConsumptionRecordViewSet, self).list(request, *args, **kwargs)
+
+        # like the filter set itself, invalid filter values match nothing
+        form = self.filter_class(request.query_params).form
+        records = []
+        if form.is_valid():
+            records = series.records(start=form.cleaned_data.get('start'),
+                    start_after=form.cleaned_data.get('start_after'),
+                    start_before=form.cleaned_data.get('start_before'))
+        serializer = self.get_serializer(records, many=True)
+        return Response(serializer.data)
+
+    def perform_create(self, serializer):
+        """
+        Records for packed metadata are merged into their ConsumptionSeries
+        by `ingest.load_batch` rather than saved as rows.
+        """
+        data = serializer.validated_data
+        records = data if isinstance(data, list) else [data]
+        metadata_ids = set(record['metadata'].pk for record in records)
+        if not models.ConsumptionSeries.objects.filter(
+                metadata_id__in=metadata_ids).exists():
+            return super(ConsumptionRecordViewSet, self).perform_create(serializer)
+
+        ingest.load_batch(records, on_conflict=self.get_on_conflict())
+        instances = [models.ConsumptionRecord(**record) for record in records]
+        serializer.instance = instances if isinstance(data, list) else instances[0]
+
+    def get_on_conflict(self):
+        on_conflict = self.request.query_params.get('on_conflict')
+        if on_conflict is not None and on_conflict not in ingest.ON_CONFLICT_CHOICES:
+            raise ValidationError({"on_conflict": "Must be one of {}.".format(
+                    ", ".join(ingest.ON_CONFLICT_CHOICES))})
+        return on_conflict
+
+    def create(self, request, *args, **kwargs):
+        if request.query_params.get("async", "False") == "True":
+            data = request.data if isinstance(request.data, list) else [request.data]
+            return queue_ingestion_job('RECORDS', data, self.get_on_conflict())
+        return super(ConsumptionRecordViewSet, self).create(request, *args, **kwargs)
+
+    @list_route(methods=['post'])
+    def bulk_load(self, request):
+        """
+        Validate a list of records and write them in set-based batches.
+        Responds with row counts and timings rather than the created records.
+        Pass `on_conflict=ignore` or `on_conflict=update` to skip or overwrite
+        records whose (metadata, start) already exists, and `async=True` to
+        queue the load as an ingestion job.
+        """
+        on_conflict = self.get_on_conflict()
+        if request.query_params.get("async", "False") == "True":
+            return queue_ingestion_job('RECORDS', request.data, on_conflict)
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        # uniqueness is enforced by the database in bulk, not row by row
+        serializer.child.validators = []
+        serializer.is_valid(raise_exception=True)
+        try:
+            with transaction.atomic():
+                report = ingest.load_records(serializer.validated_data,
+                        on_conflict=on_conflict)
+        except IntegrityError:
+            return Response({"detail": "Duplicate (metadata, start) records; "
+                    "retry with on_conflict=ignore or on_conflict=update."}, status=409)
+        return Response(report, status=201)
+
+    @list_route(methods=['post'], parser_classes=[ConsumptionRecordCSVParser])
+    def upload_csv(self, request):
+        """
+        Stream a CSV with `metadata,start,value,estimated` columns into the
+        datastore in fixed-size chunks. The `metadata` column may be omitted
+        in favor of a `metadata` query parameter. Responds with per-chunk
+        progress and a report of rejected rows. Accepts `on_conflict` like
+        `bulk_load`; chunks written before a conflict stay committed.
+        """
+        on_conflict = self.get_on_conflict()
+        try:
+            metadata_id = request.query_params.get('metadata')
+            chunk_size = int(request.query_params.get(
+                    'chunk_size', ingest.DEFAULT_BATCH_SIZE))
+        except ValueError:
+            return Response({"detail": "chunk_size must be an integer."}, status=400)
+        if chunk_size < 1:
+            return Response({"detail": "chunk_size must be at least 1."}, status=400)
+
+        try:
+            report = ingest.load_csv_rows(request.data, metadata_id=metadata_id,
+                    chunk_size=chunk_size, on_conflict=on_conflict)
+        except IntegrityError:
+            return Response({"detail": "Duplicate (metadata, start) records; "
+                    "retry with on_conflict=ignore or on_conflict=update."}, status=409)
+        return Response(report, status=201)
+
+    @list_route(methods=['post'], parser_classes=[ConsumptionSeriesNPZParser])
+    def upload_npz(self, request):
+        """
+        Load whole series from a NumPy `.npz` bundle with `start`, `value`,
+        and optionally `estimated` and `metadata` arrays. The `metadata`
+        array may be replaced by a `metadata` query parameter. Arrays go
+        straight into a binary COPY; accepts `on_conflict` like `bulk_load`.
+        """
+        on_conflict = self.get_on_conflict()
+        arrays = request.data
+        if 'start' not in arrays or 'value' not in arrays:
+            return Response({"detail": "start and value arrays are required."}, status=400)
+
+        metadata = arrays.get('metadata')
+        if metadata is None:
+            try:
+                metadata = int(request.query_params['metadata'])
+            except (KeyError, ValueError):
+                return Response({"detail": "A metadata array or query parameter is required."}, status=400)
+
+        try:
+            with transaction.atomic():
+                report = ingest.load_arrays(metadata, arrays['start'],
+                        arrays['value'], arrays.get('estimated'),
+                        on_conflict=on_conflict)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        except IntegrityError:
+            return Response({"detail": "Duplicate (metadata, start) records; "
+                    "retry with on_conflict=ignore or on_conflict=update."}, status=409)
+        return Response(report, status=201)
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+
+    permission_classes = default_permissions_classes
+    serializer_class = serializers.IngestionJobSerializer
+    queryset = models.IngestionJob.objects.all().order_by('pk')
+
+
+class MeterBatchViewSet(viewsets.ReadOnlyModelViewSet):
+
+    permission_classes = default_permissions_classes
+    serializer_class = serializers.MeterBatchSerializer
+    queryset = models.MeterBatch.objects.all().order_by('pk')
+
+
+class MeterBatchItemFilter(django_filters.FilterSet):
+
+    status = django_filters.MultipleChoiceFilter(
+            choices=models.MeterBatchItem.STATUS_CHOICES)
+
+    class Meta:
+        model = models.MeterBatchItem
+        fields = ['batch', 'project', 'status']
+
+
+class MeterBatchItemViewSet(viewsets.ReadOnlyModelViewSet):
+
+    permission_classes = default_permissions_classes
+    serializer_class = serializers.MeterBatchItemSerializer
+    queryset = models.MeterBatchItem.objects.all().order_by('pk')
+    filter_backends = (filters.DjangoFilterBackend,)
+    filter_class = MeterBatchItemFilter
+
 
 class ProjectFilter(django_filters.FilterSet):
 
@@ -179,6 +498,25 @@ class ProjectViewSet(viewsets.ModelViewSet):
             else:
                 return serializers.ProjectSerializer
 
+    @detail_route(methods=['get'])
+    def evaluate(self, request, pk=None):
+        """
+        Run the meter for this project without saving anything, with any of
+        `baseline_period_start`, `baseline_period_end`,
+        `reporting_period_start` and `reporting_period_end` (and the
+        evaluation's `start_date` and `end_date`) overridden by query
+        parameters. Repeated requests are served from a short-lived cache.
+        """
+        project = self.get_object()
+        parameters = dict((name, query_datetime(request, name))
+                for name in evaluation.PERIOD_FIELDS + ('start_date', 'end_date'))
+        for period in ('baseline_period', 'reporting_period'):
+            start = parameters[period + '_start'] or getattr(project, period + '_start')
+            end = parameters[period + '_end'] or getattr(project, period + '_end')
+            if start is not None and end is not None and start > end:
+                raise ValidationError({period + '_end': "Must not be before the start."})
+        return Response(evaluation.evaluate_project(project, **parameters))
+
 
 class MeterRunFilter(django_filters.FilterSet):
     fuel_type = django_filters.MultipleChoiceFilter(
@@ -212,6 +550,13 @@ class MeterRunViewSet(viewsets.ModelViewSet):
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = MeterRunFilter
 
+    def get_queryset(self):
+        queryset = super(MeterRunViewSet, self).get_queryset()
+        if self.get_serializer_class() is serializers.MeterRunSerializer:
+            # only the full serializer includes the meter serialization
+            queryset = queryset.select_related('configuration')
+        return queryset
+
     def get_serializer_class(self):
         if not hasattr(self.request, 'query_params'):
             return serializers.MeterRunSerializer
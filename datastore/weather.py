@@ -0,0 +1,349 @@
+"""Weather stations and a local cache of daily temperatures shared across
+projects.
+
+Temperatures are stored per station and date in the DailyTemperature table
+and filled a calendar year at a time, so projects on the same station fetch
+each year of data at most once. Cached years expire after
+``WEATHER_CACHE_MAX_AGE_DAYS``, unless they were fetched at least that long
+after they ended, by when late observations have arrived.
+
+Weather normals come from eemeter's TMY3 source, or with the synthetic
+``WEATHER_SOURCE`` from seeded typical years generated in memory.
+
+Each project's nearest station is resolved once and kept in
+``Project.resolved_weather_station``.
+"""
+from __future__ import absolute_import
+
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Min
+from django.utils.timezone import now, utc
+
+from eemeter.location import (Location, _load_station_to_lat_lng_index,
+        haversine, zipcode_to_station)
+from eemeter.evaluation import Period
+from eemeter.weather import NOAAClient, TMY3WeatherSource, WeatherSourceBase
+
+from .models import DailyTemperature, Project
+
+
+class ResolvedLocation(Location):
+    """ An eemeter Location whose station is already known, skipping the
+    nearest-station search.
+    """
+
+    def __init__(self, station, lat_lng=None, zipcode=None):
+        self.lat, self.lng = lat_lng if lat_lng is not None else (None, None)
+        self.zipcode = zipcode
+        self.station = station
+
+
+class StationIndex(object):
+    """ Station coordinates as arrays, for nearest-station lookups. """
+
+    def __init__(self):
+        # in index order, so ties break as in eemeter's lat_lng_to_station
+        stations = list(_load_station_to_lat_lng_index().items())
+        self.stations = [station for station, lat_lng in stations]
+        self.lats = np.array([lat_lng[0] for station, lat_lng in stations], dtype=float)
+        self.lngs = np.array([lat_lng[1] for station, lat_lng in stations], dtype=float)
+
+    def nearest(self, lat, lng):
+        return self.stations[np.argmin(haversine(lat, lng, self.lats, self.lngs))]
+
+    def resolve(self, lat_lng=None, station=None, zipcode=None):
+        """ The station eemeter's Location would pick for these inputs, with
+        the same precedence: lat/lng, then station, then zipcode.
+        """
+        if lat_lng is not None:
+            return self.nearest(*lat_lng)
+        if station is not None:
+            return station
+        if zipcode is not None:
+            return zipcode_to_station(zipcode)
+        return None
+
+
+def resolve_project_stations(projects, force=False):
+    """ Resolve and store the weather station of each project in one pass,
+    skipping those already resolved unless `force`. Returns a dict of
+    project pk to station (None if unresolvable).
+    """
+    index = None
+    stations = {}
+    resolved = defaultdict(list)
+    for project in projects:
+        if project.resolved_weather_station is not None and not force:
+            stations[project.pk] = project.resolved_weather_station or None
+            continue
+        if index is None:
+            index = StationIndex()
+        station = index.resolve(project.lat_lng, project.weather_station, project.zipcode)
+        stations[project.pk] = station
+        project.resolved_weather_station = station or ''
+        resolved[project.resolved_weather_station].append(project.pk)
+
+    # .update() skips the invalidation in Project's pre_save handler
+    for station, pks in resolved.items():
+        Project.objects.filter(pk__in=pks).update(resolved_weather_station=station)
+    return stations
+
+
+def gsod_fetch(station, year):
+    """ Daily average temperatures (degC) for a station-year from NOAA GSOD,
+    as a {date: temp} dict.
+    """
+    return dict((day["date"], day["temp_C"])
+            for day in NOAAClient().get_gsod_data(station, year))
+
+
+def synthetic_fetch(seed=0):
+    """ An offline stand-in for `gsod_fetch`: seasonal temperatures with
+    noise, deterministic for a given seed, station and year.
+    """
+    def fetch(station, year):
+        rng = np.random.RandomState([seed, zlib.crc32(station.encode('utf-8')) & 0x7fffffff, year])
+        days = pd.date_range(date(year, 1, 1), date(year, 12, 31), freq='D')
+        temps = 12 - 10 * np.cos(2 * np.pi * (days.dayofyear - 15) / 365.25) \
+                + rng.normal(0, 3, len(days))
+        return dict(zip(days.date, temps))
+    return fetch
+
+
+FETCHERS = {
+    'gsod': lambda: gsod_fetch,
+    'synthetic': synthetic_fetch,
+}
+
+
+class SyntheticWeatherNormalSource(WeatherSourceBase):
+    """ Seeded synthetic weather normals, in place of eemeter's
+    TMY3WeatherSource (which downloads from NREL): one typical year of
+    `synthetic_fetch` temperatures onto which, as with TMY3, every date is
+    mapped.
+    """
+
+    # dates map onto this year, and periods running into the next year
+    # onto the year after, which repeats it
+    NORMAL_YEAR = 1900
+
+    def __init__(self, station, seed=0):
+        super(SyntheticWeatherNormalSource, self).__init__(station)
+        year = synthetic_fetch(seed)(station, self.NORMAL_YEAR)
+        temps = [t for d, t in sorted(year.items())]
+        index = pd.date_range(date(self.NORMAL_YEAR, 1, 1), periods=2 * len(temps), freq='D')
+        self.tempC = pd.Series(temps * 2, index=index, dtype=float)
+
+    def annual_daily_temperatures(self, unit):
+        period = Period(datetime(self.NORMAL_YEAR, 1, 1), datetime(self.NORMAL_YEAR + 1, 1, 1))
+        return self.daily_temperatures([period], unit)
+
+    def _fetch_period(self, period):
+        pass # generated at init
+
+    def _fetch_datetime(self, dt):
+        pass # generated at init
+
+    def _normalize_datetime(self, dt, year_offset=0):
+        # the normal year has no February 29th
+        day = 28 if (dt.month, dt.day) == (2, 29) else dt.day
+        return datetime(self.NORMAL_YEAR + year_offset, dt.month, day,
+                getattr(dt, 'hour', 0), getattr(dt, 'minute', 0), getattr(dt, 'second', 0))
+
+    def _normalize_period(self, period):
+        return Period(self._normalize_datetime(period.start),
+                self._normalize_datetime(period.end, period.end.year - period.start.year))
+
+    def _period_average_temperature(self, period, unit):
+        return super(SyntheticWeatherNormalSource, self)._period_average_temperature(
+                self._normalize_period(period), unit)
+
+    def _period_daily_temperatures(self, period, unit):
+        return super(SyntheticWeatherNormalSource, self)._period_daily_temperatures(
+                self._normalize_period(period), unit)
+
+    def _period_hourly_temperatures(self, period, unit):
+        return super(SyntheticWeatherNormalSource, self)._period_hourly_temperatures(
+                self._normalize_period(period), unit)
+
+    def datetime_average_temperature(self, dt, unit):
+        return super(SyntheticWeatherNormalSource, self).datetime_average_temperature(
+                self._normalize_datetime(dt), unit)
+
+    def datetime_hourly_temperature(self, dt, unit):
+        return super(SyntheticWeatherNormalSource, self).datetime_hourly_temperature(
+                self._normalize_datetime(dt), unit)
+
+
+# weather normal source for each WEATHER_SOURCE
+NORMAL_SOURCES = {
+    'gsod': TMY3WeatherSource,
+    'synthetic': SyntheticWeatherNormalSource,
+}
+
+
+class TemperatureCache(object):
+    """ Daily temperatures per station, backed by the DailyTemperature
+    table. `fetch(station, year)` fills missing or expired years; `hits`
+    and `misses` count station-years served from and missing from the
+    table. Weather normals come from `normal_source(station)`.
+    """
+
+    def __init__(self, fetch=None, max_age=None, normal_source=None):
+        if fetch is None:
+            fetch = FETCHERS[settings.WEATHER_SOURCE]()
+        if max_age is None:
+            max_age = timedelta(days=settings.WEATHER_CACHE_MAX_AGE_DAYS)
+        if normal_source is None:
+            normal_source = NORMAL_SOURCES[settings.WEATHER_SOURCE]
+        self.fetch = fetch
+        self.max_age = max_age
+        self.normal_source = normal_source
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        n = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / float(n) if n else None,
+        }
+
+    def _fresh_years(self, station, years):
+        cutoff = now() - self.max_age
+        fresh = set()
+        for year in years:
+            fetched = DailyTemperature.objects \
+                    .filter(station=station, date__year=year) \
+                    .aggregate(fetched=Min('fetched'))['fetched']
+            if fetched is None:
+                continue
+            # GSOD observations arrive late, so a year is final only if it
+            # was fetched at least max_age after it ended
+            year_end = datetime(year + 1, 1, 1, tzinfo=utc)
+            if fetched >= year_end + self.max_age or fetched >= cutoff:
+                fresh.add(year)
+        return fresh
+
+    def _store(self, station, year, temps):
+        fetched = now()
+        try:
+            with transaction.atomic():
+                DailyTemperature.objects.filter(station=station,
+                        date__year=year).delete()
+                DailyTemperature.objects.bulk_create([
+                    DailyTemperature(station=station, date=d, fetched=fetched,
+                            temp_c=None if pd.isnull(t) else float(t))
+                    for d, t in sorted(temps.items())])
+        except IntegrityError:
+            # another process stored the same year concurrently
+            pass
+
+    def temperatures(self, station, years):
+        """ Daily temperatures (degC) covering every day of `years`, NaN
+        where no observation exists.
+        """
+        years = sorted(set(years))
+        fresh = self._fresh_years(station, years)
+        for year in years:
+            if year in fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._store(station, year, self.fetch(station, year))
+
+        index = pd.DatetimeIndex([])
+        for year in years:
+            index = index.append(pd.date_range(date(year, 1, 1), date(year, 12, 31), freq='D'))
+        rows = DailyTemperature.objects \
+                .filter(station=station, date__year__in=years) \
+                .values_list('date', 'temp_c')
+        temps = pd.Series(dict(rows), dtype=float)
+        if len(temps):
+            temps.index = pd.DatetimeIndex(temps.index)
+        return temps.reindex(index)
+
+    def clear(self, station=None):
+        rows = DailyTemperature.objects.all()
+        if station is not None:
+            rows = rows.filter(station=station)
+        rows.delete()
+
+    def weather_source(self, station):
+        return CachedWeatherSource(station, self)
+
+    def weather_normal_source(self, station):
+        return self.normal_source(station)
+
+
+class CachedWeatherSource(WeatherSourceBase):
+    """ eemeter weather source reading through a `TemperatureCache`, for
+    `Project(..., weather_source=...)`.
+    """
+
+    def __init__(self, station, cache):
+        super(CachedWeatherSource, self).__init__(station)
+        self.cache = cache
+        self._years = set()
+
+    def _temperatures(self, years):
+        return self.cache.temperatures(self.station, years)
+
+    def _add_years(self, years):
+        years = set(years) - self._years
+        if not years:
+            return
+        temps = self._temperatures(years)
+        self.tempC = pd.concat([self.tempC, temps]).sort_index()
+        self._years |= years
+
+    def _fetch_period(self, period):
+        if period.start is not None and period.end is not None:
+            self._add_years(range(period.start.year, period.end.year + 1))
+        elif period.start is not None:
+            self._add_years([period.start.year])
+        elif period.end is not None:
+            self._add_years([period.end.year])
+
+    def _fetch_datetime(self, dt):
+        self._add_years([dt.year])
+
+
+class SyntheticWeatherSource(CachedWeatherSource):
+    """ Seeded synthetic temperatures (see `synthetic_fetch`) generated in
+    memory, touching neither NOAA nor the database; for benchmarks.
+    """
+
+    def __init__(self, station, seed=0):
+        super(SyntheticWeatherSource, self).__init__(station, None)
+        self.fetch = synthetic_fetch(seed)
+
+    def _temperatures(self, years):
+        temps = {}
+        for year in years:
+            temps.update(self.fetch(self.station, year))
+        temps = pd.Series(temps, dtype=float).sort_index()
+        temps.index = pd.DatetimeIndex(temps.index)
+        return temps
+
+
+_cache = None
+
+
+def get_cache():
+    """ The process-wide TemperatureCache, so counters accumulate across
+    projects.
+    """
+    global _cache
+    if _cache is None:
+        _cache = TemperatureCache()
+    return _cache
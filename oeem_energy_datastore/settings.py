@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 
 import os
+import re
+import sys
 import dj_database_url
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -65,6 +67,32 @@ WSGI_APPLICATION = 'oeem_energy_datastore.wsgi.application'
 
 DATABASES = {'default': dj_database_url.config()}
 
+# default interval, 'month' or 'year', of the partitionconsumption command,
+# which range-partitions consumption records by start (PostgreSQL 11+)
+CONSUMPTION_RECORD_PARTITION_INTERVAL = os.environ.get("CONSUMPTION_RECORD_PARTITION_INTERVAL")
+
+# cached daily temperatures are refetched after this many days, unless their
+# year had already ended when they were fetched
+WEATHER_CACHE_MAX_AGE_DAYS = int(os.environ.get("WEATHER_CACHE_MAX_AGE_DAYS", 7))
+
+# seconds that compute-only meter evaluations (/api/v1/projects/<id>/evaluate/)
+# are cached for, in the default Django cache
+METER_EVALUATION_CACHE_SECONDS = int(os.environ.get("METER_EVALUATION_CACHE_SECONDS", 300))
+
+# meter runs kept per consumption metadata by the prunemeterruns command: the
+# latest METER_RUN_RETENTION_KEEP_LAST, plus any added within the last
+# METER_RUN_RETENTION_MAX_AGE_DAYS days if set
+METER_RUN_RETENTION_KEEP_LAST = int(os.environ.get("METER_RUN_RETENTION_KEEP_LAST", 1))
+METER_RUN_RETENTION_MAX_AGE_DAYS = os.environ.get("METER_RUN_RETENTION_MAX_AGE_DAYS")
+if METER_RUN_RETENTION_MAX_AGE_DAYS is not None:
+    METER_RUN_RETENTION_MAX_AGE_DAYS = int(METER_RUN_RETENTION_MAX_AGE_DAYS)
+
+# 'gsod' fetches temperatures from NOAA and normals from NREL; 'synthetic'
+# generates seeded temperatures and normals offline, and is the default
+# under `manage.py test` and py.test
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+WEATHER_SOURCE = os.environ.get("WEATHER_SOURCE", "synthetic" if TESTING else "gsod")
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -128,6 +156,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'datastore': {
+            'handlers': ['logfile'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     }
 }
 
@@ -137,6 +170,13 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# chords (e.g. datastore.tasks.run_block_meters) need a result backend;
+# default to the application database via SQLAlchemy, which does not
+# accept the postgres:// scheme of DATABASE_URL
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND',
+        'db+{}'.format(re.sub(r'^postgres://', 'postgresql://',
+                os.environ.get('DATABASE_URL', 'sqlite:///celery-results.sqlite'))))
+
 SWAGGER_SETTINGS = {
     'base_path': '{}/docs'.format(os.environ["SERVER_NAME"]),
     'protocol': os.environ["PROTOCOL"],
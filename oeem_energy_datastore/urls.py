@@ -27,7 +27,10 @@ router.register(r'project_owners', datastore_views.ProjectOwnerViewSet, base_nam
 router.register(r'project_blocks', datastore_views.ProjectBlockViewSet, base_name='project_block')
 router.register(r'consumption_metadatas', datastore_views.ConsumptionMetadataViewSet, base_name='consumption_metadata')
 router.register(r'consumption_records', datastore_views.ConsumptionRecordViewSet, base_name='consumption_record')
+router.register(r'ingestion_jobs', datastore_views.IngestionJobViewSet, base_name='ingestion_job')
 router.register(r'meter_runs', datastore_views.MeterRunViewSet, base_name='meter_run')
+router.register(r'meter_batches', datastore_views.MeterBatchViewSet, base_name='meter_batch')
+router.register(r'meter_batch_items', datastore_views.MeterBatchItemViewSet, base_name='meter_batch_item')
 
 urlpatterns = [
     url(r'^grappelli/', include('grappelli.urls')),